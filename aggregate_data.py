@@ -1,7 +1,23 @@
 import os
-import csv
 import json
-import matplotlib.pyplot as plt
+import argparse
+import hashlib
+import math
+import numpy as np
+
+from run_store import RUN_STORE_NAME, RunStore, tier_for_resolution
+from render import RENDER_MODES, LinePlotJob, PlotRenderer
+from sketches import QuantileSketch
+from service_graph import ServiceGraph
+from efficiency import efficiency_summary
+from wrk2_parser import WRK2_STORE_DIR
+
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+# Compact separators for the JSON written to aggregate/
+COMPACT_JSON = {"separators": (",", ":")}
+# Fingerprints of the series already aggregated by --incremental, keyed
+# "<run>/<service>/<metric>@<resolution>" (see manifest_key)
+MANIFEST_FILE = "manifest.json"
 
 def load_network_map(network_map_path="visualizations/network_map.json"):
     """
@@ -22,151 +38,376 @@ def load_network_map(network_map_path="visualizations/network_map.json"):
     }
     """
     print(f"Loading network structure from {network_map_path} ...")
+    return ServiceGraph.load(network_map_path).to_parent_child_dict()
 
-    with open(network_map_path, "r") as f:
-        raw_map = json.load(f)
-    
-    # raw_map["data"] is assumed to be a list of {parent, child, callCount}
-    parent_child_dict = {}
-
-    for entry in raw_map["data"]:
-        parent = entry["parent"]
-        child = entry["child"]
-        call_count = entry["callCount"]
-
-        if parent not in parent_child_dict:
-            parent_child_dict[parent] = []
-        
-        parent_child_dict[parent].append({
-            "child": child,
-            "callCount": call_count
-        })
 
-    return parent_child_dict
-
-
-def load_all_service_metrics(data_path="data"):
+def load_all_service_metrics(data_path="data", run_id=None):
     """
-    Scans the given data_path for subdirectories (each representing a service),
-    then reads all CSV files within each subdirectory.
+    Reads one run from the Parquet run store under data_path (the latest run if
+    run_id is None). Only the columns needed here are loaded, and only the
+    partitions of the requested run are touched.
     
     Returns a dictionary of the form:
     {
         "social-graph-service": {
-            "cpu_consumption_compose": [
-                {"timestamp": "2025-03-22 21:16:42", "value": 0.05360663539330211},
-                {"timestamp": "2025-03-22 21:16:57", "value": 0.05360663539330211},
+            "cpu_usage_per_pod": [
+                {"timestamp": "2025-03-22 21:16:42", "pod": "social-graph-service-...", "value": 0.05360663539330211},
+                {"timestamp": "2025-03-22 21:16:57", "pod": "social-graph-service-...", "value": 0.05360663539330211},
                 ...
             ],
-            "cpu_consumption_nginx": [...],
-            ...
-        },
-        "text-service": {
-            "cpu_consumption_text": [...],
-            "cpu_consumption_user_mention": [...],
+            "network_receive": [...],
+            "cpu_consumption": [...],
+            "replicas": [...],
             ...
         },
         ...
     }
     """
-    print(f"Loading data from {data_path} ...")
+    store = RunStore(os.path.join(data_path, RUN_STORE_NAME))
+    run_id = run_id or store.latest_run_id()
+    print(f"Loading run {run_id} from {store.root} ...")
     services_data = {}
+    if run_id is None:
+        return services_data
 
-    # Loop over each service folder in data_path
-    for service_dir in os.listdir(data_path):
-        service_path = os.path.join(data_path, service_dir)
-        
-        # Only proceed if this is a directory (not a file)
-        if os.path.isdir(service_path):
-            metrics_dict = {}
-
-            # Look for CSV files in this service directory
-            for file_name in os.listdir(service_path):
-                if file_name.endswith(".csv"):
-                    metric_name = file_name.replace(".csv", "")
-                    file_path = os.path.join(service_path, file_name)
-
-                    # Read CSV data
-                    data_points = []
-                    with open(file_path, "r", newline="") as f:
-                        reader = csv.DictReader(f)  # expects columns: timestamp, value
-                        
-                        for row in reader:
-                            # Convert the "value" to float, keep timestamp as string
-                            data_points.append({
-                                "timestamp": row["timestamp"],
-                                "value": float(row["value"])
-                            })
-                    
-                    # Store the list of data points under this metric
-                    metrics_dict[metric_name] = data_points
-
-            # Store all metrics for this service
-            services_data[service_dir] = metrics_dict
+    samples = store.read_df(columns=["service", "metric", "pod", "timestamp", "value"], run_id=run_id)
+    for (service, metric_name), series in samples.groupby(["service", "metric"], sort=True):
+        services_data.setdefault(service, {})[metric_name] = series_to_records(series)
 
     return services_data
 
 
-if __name__ == "__main__":
-    # 1) Load all CSV metrics from each service
-    services_data = load_all_service_metrics("data")
+def series_to_records(series):
+    """
+    Converts a timestamp/pod/value DataFrame into the list-of-dicts form used in the JSON outputs.
+    """
+    return [
+        {"timestamp": timestamp, "pod": pod, "value": value}
+        for timestamp, pod, value in zip(
+            series["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+            series["pod"].astype(str),
+            series["value"].tolist(),
+        )
+    ]
+
+
+def read_series(store: RunStore, run_id, service, metric_name, resolution=None):
+    """
+    Reads one series as timestamp/pod/value, at full resolution or, if resolution is set,
+    from the coarsest rollup tier that satisfies it (value is then the bucket mean).
+    Rollups of runs stored before rollups existed are built on first use.
+    """
+    if resolution is None:
+        series = store.read_df(
+            columns=["timestamp", "pod", "value"], run_id=run_id, service=service, metric=metric_name
+        )
+    else:
+        if tier_for_resolution(resolution) is not None and not store.has_rollups(run_id):
+            print(f"Building rollups for run {run_id} ...", flush=True)
+            store.build_rollups(run_id)
+        series = store.read_rollup_df(resolution, run_id=run_id, service=service, metric=metric_name)
+        series = series[["timestamp", "pod", "value"]] if not series.empty else series
+    return series.sort_values("timestamp", kind="stable") if not series.empty else series
+
+
+def iter_service_metrics(data_path="data", run_id=None, resolution=None):
+    """
+    Yields (service, metric_name, DataFrame) one series at a time, so only a single
+    series is ever held in memory. Services come out in sorted order.
+
+    :param resolution: Read from rollups at this resolution (e.g. "5m") instead of raw samples.
+    """
+    store = RunStore(os.path.join(data_path, RUN_STORE_NAME))
+    run_id = run_id or store.latest_run_id()
+    if run_id is None:
+        return
+    for service, metric_name in store.series_keys(run_id):
+        yield service, metric_name, read_series(store, run_id, service, metric_name, resolution)
+
+
+class MetricSummary:
+    """
+    Running count/mean/min/max and quantile sketch for one service metric.
+    Memory use does not grow with the number of samples.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch()
+
+    def update(self, values):
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return
+        self.count += int(values.size)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.sketch.add(values)
+
+    def to_dict(self):
+        if not self.count:
+            return {"count": 0}
+        summary = {"count": self.count, "mean": self.total / self.count, "min": self.min, "max": self.max}
+        for q in SUMMARY_QUANTILES:
+            summary[f"p{round(q * 100)}"] = self.sketch.quantile(q)
+        return summary
+
+
+def summarize_service_metrics(data_path="data", run_id=None, batch_size=65536):
+    """
+    Streams a run from the store in record batches and computes per-service/per-metric
+    count, mean, min, max and p50/p95/p99 incrementally.
+
+    Returns {"<service>": {"<metric>": {"count": ..., "mean": ..., "p95": ...}, ...}, ...}
+    """
+    store = RunStore(os.path.join(data_path, RUN_STORE_NAME))
+    run_id = run_id or store.latest_run_id()
+    print(f"Summarizing run {run_id} from {store.root} ...")
+    summaries = {}
+    if run_id is None:
+        return summaries
+
+    for batch in store.iter_batches(columns=["service", "metric", "value"], batch_size=batch_size, run_id=run_id):
+        frame = batch.to_pandas()
+        for (service, metric_name), values in frame.groupby(["service", "metric"], sort=False)["value"]:
+            summary = summaries.setdefault(service, {}).setdefault(metric_name, MetricSummary())
+            summary.update(values.to_numpy())
+
+    return {
+        service: {metric_name: summary.to_dict() for metric_name, summary in sorted(metrics.items())}
+        for service, metrics in sorted(summaries.items())
+    }
+
+
+def service_graph_summary(service_graph: ServiceGraph):
+    _, total_amplification = service_graph.fan_out_amplification()
+    bottlenecks = service_graph.bottlenecks()
+    return {
+        "ingress_services": service_graph.ingress_services(),
+        "calls_per_request": total_amplification,
+        "services": bottlenecks.astype(object).where(bottlenecks.notna(), None).to_dict(orient="records"),
+    }
+
+
+def write_json(data, path):
+    with open(path, "w") as f:
+        json.dump(data, f, **COMPACT_JSON)
+
+
+def metric_plot_job(service, metric_name, series, output_dir="aggregate"):
+    return LinePlotJob(
+        data=series,
+        output_path=os.path.join(output_dir, f"{service}_{metric_name}.png"),
+        title=f"{service} - {metric_name}",
+        hue="pod",
+        figsize=(8, 4),
+        marker="o",
+        xtick_rotation=45,
+        tight_layout=True,
+    )
+
+
+def series_fingerprint(partition_path, content_hash=False):
+    """
+    Fingerprints a series partition from its files without parsing them: name, size and
+    mtime of every Parquet file, or name and SHA-256 of the contents if content_hash is set.
+    """
+    fingerprint = []
+    for entry in sorted(os.scandir(partition_path), key=lambda entry: entry.name):
+        if not entry.is_file():
+            continue
+        if content_hash:
+            with open(entry.path, "rb") as f:
+                fingerprint.append([entry.name, hashlib.sha256(f.read()).hexdigest()])
+        else:
+            stat = entry.stat()
+            fingerprint.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def manifest_key(run_id, service, metric_name, resolution=None):
+    """
+    Manifest key of a series; plots and raw exports depend on the resolution they were made at.
+    """
+    return f"{run_id}/{service}/{metric_name}@{resolution or 'raw'}"
+
+
+def aggregate_incrementally(data_path="data", output_dir="aggregate", renderer: PlotRenderer = None,
+                            raw=False, content_hash=False, resolution=None):
+    """
+    Aggregates every run in the store into <output_dir>/<run_id>/, but only parses,
+    summarizes and re-plots the series whose files changed since the last call (or that
+    were last aggregated at another resolution).
 
-    # 2) Load the parent-child network map
-    network_map = load_network_map("visualizations/network_map.json")
+    Per-run outputs: summary.json, <service>_<metric>.png and, with raw, <service>.json
+    holding every metric of the service, like the non-incremental export. What has been
+    aggregated is tracked in <output_dir>/manifest.json. Summaries always use the raw
+    samples; with resolution set, plots and raw exports come from the rollups instead.
+
+    :return: Number of series (re)aggregated.
+    """
+    store = RunStore(os.path.join(data_path, RUN_STORE_NAME))
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = load_json(manifest_path, {})
+    new_manifest = {}
+    updated = 0
+
+    for run_id in store.run_ids():
+        run_output_dir = os.path.join(output_dir, run_id)
+        os.makedirs(run_output_dir, exist_ok=True)
+        summary_path = os.path.join(run_output_dir, "summary.json")
+        summaries = load_json(summary_path, {})
+        run_changed = False
+        # service -> {metric: records} of the raw exports read in this run, and those changed
+        exports, changed_exports = {}, set()
+
+        def raw_export(service):
+            if service not in exports:
+                exports[service] = load_json(os.path.join(run_output_dir, f"{service}.json"), {})
+            return exports[service]
+
+        series_keys = store.series_keys(run_id)
+        for service, metric_name in series_keys:
+            key = manifest_key(run_id, service, metric_name, resolution)
+            fingerprint = series_fingerprint(store.partition_path(run_id, service, metric_name), content_hash)
+            new_manifest[key] = fingerprint
+            if (manifest.get(key) == fingerprint and metric_name in summaries.get(service, {})
+                    and (not raw or metric_name in raw_export(service))):
+                continue
+
+            series = read_series(store, run_id, service, metric_name)
+            summary = MetricSummary()
+            summary.update(series["value"].to_numpy())
+            summaries.setdefault(service, {})[metric_name] = summary.to_dict()
+            output_series = series if resolution is None else read_series(store, run_id, service, metric_name, resolution)
+            if raw:
+                raw_export(service)[metric_name] = series_to_records(output_series)
+                changed_exports.add(service)
+            if renderer is not None and not output_series.empty:
+                renderer.submit(metric_plot_job(service, metric_name, output_series, run_output_dir))
+            updated += 1
+            run_changed = True
+
+        # Forget series that disappeared from the store
+        present = set(series_keys)
+        for service in list(summaries):
+            for metric_name in list(summaries[service]):
+                if (service, metric_name) not in present:
+                    del summaries[service][metric_name]
+                    if raw_export(service).pop(metric_name, None) is not None:
+                        changed_exports.add(service)
+                    stale_path = os.path.join(run_output_dir, f"{service}_{metric_name}.png")
+                    if os.path.exists(stale_path):
+                        os.remove(stale_path)
+                    run_changed = True
+            if not summaries[service]:
+                del summaries[service]
+
+        if run_changed:
+            write_json(summaries, summary_path)
+        for service in changed_exports:
+            export_path = os.path.join(run_output_dir, f"{service}.json")
+            if exports[service]:
+                write_json(exports[service], export_path)
+            elif os.path.exists(export_path):
+                os.remove(export_path)
+
+    write_json(new_manifest, manifest_path)
+    print(f"Incremental aggregation: {updated} of {len(new_manifest)} series updated", flush=True)
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate runs from the run store.")
+    parser.add_argument("--data-path", default="data", help="Directory holding the run store.")
+    parser.add_argument("--run-id", default=None, help="Run to aggregate, the latest run by default.")
+    parser.add_argument("--raw", action="store_true",
+                        help="Also export every series to aggregate/<service>.json (aggregate/<run_id>/<service>.json "
+                             "with --incremental), from the rollups with --resolution.")
+    parser.add_argument("--render", choices=RENDER_MODES, default="parallel",
+                        help="Render plots in a process pool as series are read, after all series are read, or not at all.")
+    parser.add_argument("--render-workers", type=int, default=None, help="Plot worker processes, one per core by default.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Aggregate every run into aggregate/<run_id>/, only redoing series that changed.")
+    parser.add_argument("--hash", action="store_true",
+                        help="With --incremental, detect changes by content hash instead of file size and mtime.")
+    parser.add_argument("--resolution", default=None,
+                        help="Plot (and with --raw, export) from the rollup tiers at this resolution, e.g. 5m or 1h.")
+    args = parser.parse_args()
 
     # Create the "aggregate" folder if it doesn't exist
     if not os.path.exists("aggregate"):
         os.makedirs("aggregate")
 
-    # 3) Save the entire services_data to a single JSON for reference
-    aggregated_data_path = os.path.join("aggregate", "all_services_data.json")
-    with open(aggregated_data_path, "w") as f:
-        json.dump(services_data, f, indent=2)
-
-    # 4) Save the network_map as well
-    aggregated_network_map_path = os.path.join("aggregate", "network_map.json")
-    with open(aggregated_network_map_path, "w") as f:
-        json.dump(network_map, f, indent=2)
-
-    # 5) For each service, save a separate JSON and create plots for each metric
-    for service_dir, metrics_dict in services_data.items():
-        # a) Save each service's data to a JSON file
-        output_json_path = os.path.join("aggregate", f"{service_dir}.json")
-        with open(output_json_path, "w") as f:
-            json.dump(metrics_dict, f, indent=2)
-        
-        # b) Generate and save plots for each metric
-        for metric_name, data_points in metrics_dict.items():
-            if not data_points:
-                continue
+    if args.incremental:
+        with PlotRenderer(mode=args.render, max_workers=args.render_workers) as renderer:
+            aggregate_incrementally(args.data_path, "aggregate", renderer, raw=args.raw, content_hash=args.hash,
+                                    resolution=args.resolution)
+        network_map = load_network_map("visualizations/network_map.json")
+        write_json(network_map, os.path.join("aggregate", "network_map.json"))
+        return
 
-            timestamps = [dp["timestamp"] for dp in data_points]
-            values = [dp["value"] for dp in data_points]
+    # 1) Stream the run once to compute per-service/per-metric summaries
+    summaries = summarize_service_metrics(args.data_path, args.run_id)
+    write_json(summaries, os.path.join("aggregate", "summary.json"))
+    store = RunStore(os.path.join(args.data_path, RUN_STORE_NAME))
+    efficiency = efficiency_summary(store, args.run_id or store.latest_run_id(),
+                                    os.path.join(args.data_path, os.path.basename(WRK2_STORE_DIR)))
+    write_json(efficiency, os.path.join("aggregate", "efficiency.json"))
 
-            plt.figure(figsize=(8, 4))
-            plt.plot(timestamps, values, marker='o')
-            plt.title(f"{service_dir} - {metric_name}")
-            plt.xlabel("Timestamp")
-            plt.ylabel("Value")
-            plt.xticks(rotation=45, ha="right")
-            plt.tight_layout()
+    # 2) Load the parent-child network map and save it as well, together with the graph
+    #    annotated with the summaries (fan-out amplification, per-service load)
+    service_graph = ServiceGraph.load("visualizations/network_map.json").add_service_metrics(summaries)
+    network_map = service_graph.to_parent_child_dict()
+    write_json(network_map, os.path.join("aggregate", "network_map.json"))
+    write_json(service_graph_summary(service_graph), os.path.join("aggregate", "service_graph.json"))
+
+    # 3) Walk the series one at a time: queue a plot for each metric and, if asked, collect
+    #    the current service's raw series to write out before moving to the next service
+    current_service, raw_metrics = None, {}
+    with PlotRenderer(mode=args.render, max_workers=args.render_workers) as renderer:
+        for service_dir, metric_name, series in iter_service_metrics(args.data_path, args.run_id, args.resolution):
+            if args.raw and service_dir != current_service:
+                if current_service is not None:
+                    write_json(raw_metrics, os.path.join("aggregate", f"{current_service}.json"))
+                current_service, raw_metrics = service_dir, {}
+            if args.raw:
+                raw_metrics[metric_name] = series_to_records(series)
+
+            if series.empty:
+                continue
 
             # Save plot to the aggregate folder
-            output_plot_path = os.path.join("aggregate", f"{service_dir}_{metric_name}.png")
-            plt.savefig(output_plot_path)
-            plt.close()
+            renderer.submit(metric_plot_job(service_dir, metric_name, series))
+        if args.raw and current_service is not None:
+            write_json(raw_metrics, os.path.join("aggregate", f"{current_service}.json"))
 
-    # 6) Example usage of the data
+    # 4) Example usage of the data
     print("\n--- Example Usage / Verification ---")
     for parent_service, children_info in network_map.items():
-        if parent_service in services_data:
-            # You can get the parent's metrics here
-            parent_metrics = services_data[parent_service]
-            # For example, CPU consumption data (if any)
-            cpu_data = parent_metrics.get("cpu_consumption_compose", [])
+        if parent_service in summaries:
+            # You can get the parent's metric summaries here
+            parent_metrics = summaries[parent_service]
+            # For example, CPU usage (if any)
+            cpu_summary = parent_metrics.get("cpu_usage_per_pod", {})
             
             print(f"Parent service: {parent_service}")
             print(f"Children: {children_info}")
-            print(f"CPU data sample: {cpu_data[:3]}")
+            print(f"CPU usage summary: {cpu_summary}")
         else:
             print(f"No metrics found for {parent_service}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import argparse
+import json
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import tracer
+from dependency_snapshots import save_run_dependencies
+from efficiency import save_run_efficiency
+from latency_sketches import store_wrk2_sketches
+from prom_queries import QUERY_CATALOG
+from query_catalog import validate_catalog
+from run_store import RunStore, new_run_id
+from wrk2_parser import parse_wrk2_output, save_wrk2_results, wrk2_summary
+
+CAMPAIGN_OUTPUT_DIR = "data/campaigns"
+
+# A step is sustainable if wrk2 achieved at least this fraction of the target rate...
+MIN_ACHIEVED_RATE_FRACTION = 0.95
+# ...with at most this fraction of requests failing (non-2xx/3xx or socket errors)
+MAX_ERROR_RATIO = 0.01
+# Pause between steps so one step's load doesn't bleed into the next one's metrics
+COOLDOWN_SECONDS = 30
+
+CPU_METRIC = "cpu_usage_per_pod"
+LATENCY_METRIC = "http_request_latency_95th"
+# wrk2 keeps every connection of a thread on one event loop; past a few dozen connections
+# per thread the load generator itself becomes the bottleneck
+CONNECTIONS_PER_THREAD = 32
+
+
+def linear_schedule(start, stop, step):
+    """
+    Rates start, start + step, ... up to and including stop.
+    """
+    return [float(rate) for rate in np.arange(start, stop + step / 2, step)]
+
+
+def geometric_schedule(start, stop, factor=2.0):
+    """
+    Rates start, start * factor, ... up to and including stop.
+    """
+    rates = []
+    rate = float(start)
+    while rate <= stop * (1 + 1e-9):
+        rates.append(rate)
+        rate *= factor
+    return rates
+
+
+def step_load(rate, threads=None, connections=None, rate_per_connection=None):
+    """
+    Threads and connections of one step. With rate_per_connection, connections grow with the
+    rate (at least connections, if given) and threads with the connections, so higher rates
+    aren't limited by a fixed number of open connections; otherwise both stay as given.
+
+    :return: (threads, connections), None meaning tracer.test_params' value.
+    """
+    if rate_per_connection is None:
+        return threads, connections
+    connections = max(connections or 1, math.ceil(rate / rate_per_connection))
+    threads = max(threads or 1, math.ceil(connections / CONNECTIONS_PER_THREAD))
+    return threads, connections
+
+
+def load_schedule(rates, threads=None, connections=None, rate_per_connection=None):
+    """
+    Schedule of (rate, threads, connections) steps for the rates, see step_load.
+    """
+    return [(rate, *step_load(rate, threads, connections, rate_per_connection)) for rate in rates]
+
+
+def step_params(rate, threads=None, connections=None, duration=None):
+    """
+    wrk2 parameters for one step, based on tracer.test_params.
+    """
+    params = dict(tracer.test_params)
+    # wrk2's -R only takes whole rates; geometric and binary-search steps aren't always whole
+    params["rate"] = int(round(rate))
+    if threads is not None:
+        params["threads"] = threads
+    if connections is not None:
+        params["connections"] = connections
+    if duration is not None:
+        params["duration"] = duration
+    return params
+
+
+def is_sustainable(summary, target_rate, slo_p99_ms=None):
+    """
+    Decides whether a step kept up with its target rate within the error budget and SLO.
+
+    :return: (sustainable, reason) where reason explains a failure.
+    """
+    achieved = summary.get("requests_per_sec") or 0.0
+    if achieved < MIN_ACHIEVED_RATE_FRACTION * target_rate:
+        return False, f"achieved {achieved:.1f} req/s of {target_rate} target"
+    requests = summary.get("requests") or 0
+    errors = (summary.get("non_2xx_3xx") or 0) + (summary.get("socket_errors") or 0)
+    if requests and errors / requests > MAX_ERROR_RATIO:
+        return False, f"{errors} of {requests} requests failed"
+    p99 = summary.get("p99_ms")
+    if slo_p99_ms is not None and p99 is not None and p99 > slo_p99_ms:
+        return False, f"p99 {p99:.1f}ms above the {slo_p99_ms}ms SLO"
+    return True, None
+
+
+def service_load(run_store: RunStore, run_id):
+    """
+    Per-service load of one step from the run store: mean CPU cores (summed over pods)
+    and mean p95 latency.
+
+    :return: {service: {"cpu_cores": ..., "p95_latency_s": ...}}
+    """
+    samples = run_store.read_df(
+        columns=["service", "metric", "pod", "timestamp", "value"], run_id=run_id, metric=[CPU_METRIC, LATENCY_METRIC]
+    )
+    load = {}
+    if samples.empty:
+        return load
+    samples = samples[np.isfinite(samples["value"])]
+    cpu = samples[samples["metric"] == CPU_METRIC]
+    for service, cores in cpu.groupby(["service", "timestamp"], observed=True)["value"].sum().groupby(level=0):
+        load.setdefault(service, {})["cpu_cores"] = float(cores.mean())
+    latency = samples[samples["metric"] == LATENCY_METRIC]
+    for service, seconds in latency.groupby("service", observed=True)["value"]:
+        load.setdefault(service, {})["p95_latency_s"] = float(seconds.mean())
+    return load
+
+
+def run_step(prom, planned_queries, run_store: RunStore, params, slo_p99_ms=None):
+    """
+    Runs one wrk2 step, collects its Prometheus metrics and evaluates it. A step whose load
+    or collection fails is recorded as unsustainable with the error as its reason, so the
+    campaign (and the report of the steps before it) carries on.
+    """
+    run_id = new_run_id()
+    print(f"[{tracer.get_current_utc_timestamp()}] Step {run_id}: rate {params['rate']}, "
+          f"{params['threads']} threads, {params['connections']} connections", flush=True)
+    step = {"run_id": run_id, "params": params, "wrk2": {}, "sustainable": False, "reason": None,
+            "services": {}, "efficiency": None}
+
+    start_time = datetime.now() - timedelta(seconds=tracer.BEFORE_AFTER_QUERY_LAG)
+    load_start = datetime.now()
+    try:
+        wrk2_output = tracer.run_wrk2_test(params)
+    except RuntimeError as e:
+        step["reason"] = str(e).strip()
+        print(f"  -> NOT sustainable: {step['reason']}", flush=True)
+        return step
+    end_time = datetime.now() + timedelta(seconds=tracer.BEFORE_AFTER_QUERY_LAG)
+    time.sleep(tracer.BEFORE_AFTER_QUERY_LAG)
+
+    parsed = parse_wrk2_output(wrk2_output)
+    summary = wrk2_summary(parsed)
+    step["wrk2"] = summary
+    try:
+        save_wrk2_results(parsed, run_id, params, load_start=load_start)
+        store_wrk2_sketches(run_store, run_id, parsed, load_start)
+        save_run_dependencies(tracer.jaeger_url, run_id, start_time, end_time)
+        tracer.save_metrics_and_visualizations(
+            prom, planned_queries, start_time, end_time, run_store, run_id, render_mode="skip"
+        )
+        step["services"] = service_load(run_store, run_id)
+        step["efficiency"] = save_run_efficiency(run_store, run_id)
+    except Exception as e:
+        step["reason"] = f"collecting the step failed: {type(e).__name__}: {e}"
+        print(f"  -> {summary.get('requests_per_sec')} req/s, NOT sustainable: {step['reason']}", flush=True)
+        return step
+
+    sustainable, reason = is_sustainable(summary, float(params["rate"]), slo_p99_ms)
+    step["sustainable"], step["reason"] = sustainable, reason
+    print(f"  -> {summary.get('requests_per_sec')} req/s, p99 {summary.get('p99_ms')}ms, "
+          f"{'sustainable' if sustainable else 'NOT sustainable: ' + reason}", flush=True)
+    return step
+
+
+def saturating_service(steps):
+    """
+    Picks the service that saturates first: the one whose p95 latency grew the most between
+    the first step and the first unsustainable step (the last step if all were sustainable).
+    Falls back to the highest CPU usage at that step when no latency data is available.
+    """
+    if not steps:
+        return None
+    ordered = sorted(steps, key=lambda step: float(step["params"]["rate"]))
+    failing = next((step for step in ordered if not step["sustainable"]), ordered[-1])
+    baseline = ordered[0]["services"]
+
+    inflation = {}
+    for service, load in failing["services"].items():
+        before = baseline.get(service, {}).get("p95_latency_s")
+        after = load.get("p95_latency_s")
+        if before and after:
+            inflation[service] = after / before
+    if inflation:
+        return max(inflation, key=inflation.get)
+
+    cpu = {service: load["cpu_cores"] for service, load in failing["services"].items() if "cpu_cores" in load}
+    return max(cpu, key=cpu.get) if cpu else None
+
+
+def campaign_report(steps, slo_p99_ms=None):
+    sustainable = [step for step in steps if step["sustainable"]]
+    best = max(sustainable, key=lambda step: step["wrk2"].get("requests_per_sec") or 0, default=None)
+    return {
+        "slo_p99_ms": slo_p99_ms,
+        "max_sustainable_rate": float(best["params"]["rate"]) if best else None,
+        "max_sustainable_throughput": best["wrk2"].get("requests_per_sec") if best else None,
+        "saturating_service": saturating_service(steps),
+        "steps": steps,
+    }
+
+
+def run_campaign(prom, schedule, duration=None, slo_p99_ms=None, stop_on_failure=True, cooldown=COOLDOWN_SECONDS):
+    """
+    Steps through a load schedule, collecting metrics for each step.
+
+    :param schedule: (rate in req/s, threads, connections) per step, see load_schedule.
+    :param stop_on_failure: Stop at the first unsustainable step.
+    :return: A campaign report (see campaign_report).
+    """
+    run_store = RunStore()
+    planned_queries = campaign_planned_queries()
+    steps = []
+    for index, (rate, threads, connections) in enumerate(schedule):
+        if index:
+            time.sleep(cooldown)
+        step = run_step(prom, planned_queries, run_store, step_params(rate, threads, connections, duration), slo_p99_ms)
+        steps.append(step)
+        if stop_on_failure and not step["sustainable"]:
+            break
+    return campaign_report(steps, slo_p99_ms)
+
+
+def binary_search_campaign(prom, low, high, slo_p99_ms, tolerance=10, threads=None, connections=None,
+                           rate_per_connection=None, duration=None, cooldown=COOLDOWN_SECONDS):
+    """
+    Binary-searches the highest rate between low and high that meets the p99 SLO,
+    stopping once the bracket is narrower than tolerance req/s. wrk2 only takes whole
+    rates, so probes are rounded and the search also stops once no whole rate is left
+    strictly inside the bracket. Threads and connections of each probe follow step_load.
+
+    :return: A campaign report (see campaign_report).
+    """
+    run_store = RunStore()
+    planned_queries = campaign_planned_queries()
+    steps = []
+
+    def probe(rate):
+        if steps:
+            time.sleep(cooldown)
+        params = step_params(rate, *step_load(rate, threads, connections, rate_per_connection), duration)
+        step = run_step(prom, planned_queries, run_store, params, slo_p99_ms)
+        steps.append(step)
+        return step["sustainable"]
+
+    if not probe(low):
+        print(f"Even the lowest rate {low} is not sustainable.", flush=True)
+        return campaign_report(steps, slo_p99_ms)
+    if probe(high):
+        print(f"The highest rate {high} is still sustainable; raise --stop to find the knee.", flush=True)
+        return campaign_report(steps, slo_p99_ms)
+    while high - low > tolerance:
+        middle = round((low + high) / 2)
+        if not low < middle < high:
+            break
+        if probe(middle):
+            low = middle
+        else:
+            high = middle
+    return campaign_report(steps, slo_p99_ms)
+
+
+def campaign_planned_queries():
+    network_dict = tracer.save_jaeger_network_map()
+    services = tracer.extract_services_from_network_map(network_dict)
+    print(f"Services extracted: {services}", flush=True)
+    return tracer.compile_service_queries(services)
+
+
+def save_campaign_report(report, output_dir=CAMPAIGN_OUTPUT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"campaign-{new_run_id()}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def print_campaign_report(report):
+    print("\n--- Campaign results ---")
+    for step in report["steps"]:
+        wrk2 = step["wrk2"]
+        print(f"{step['run_id']}: target {step['params']['rate']:>7} req/s, achieved {wrk2.get('requests_per_sec')} req/s, "
+              f"p99 {wrk2.get('p99_ms')}ms, {'ok' if step['sustainable'] else step['reason']}")
+    print(f"Max sustainable throughput: {report['max_sustainable_throughput']} req/s "
+          f"(target rate {report['max_sustainable_rate']})")
+    print(f"First service to saturate: {report['saturating_service']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a wrk2 rate sweep and find the saturation point.")
+    parser.add_argument("--mode", choices=("linear", "geometric", "binary"), default="linear")
+    parser.add_argument("--start", type=float, required=True, help="First (or lowest) rate in req/s.")
+    parser.add_argument("--stop", type=float, required=True, help="Last (or highest) rate in req/s.")
+    parser.add_argument("--step", type=float, default=50, help="Rate increment for linear sweeps.")
+    parser.add_argument("--factor", type=float, default=2.0, help="Rate multiplier for geometric sweeps.")
+    parser.add_argument("--tolerance", type=float, default=10, help="Stop a binary search once the bracket is this narrow.")
+    parser.add_argument("--threads", type=int, default=None, help="wrk2 threads (the minimum with --rate-per-connection).")
+    parser.add_argument("--connections", type=int, default=None,
+                        help="wrk2 connections (the minimum with --rate-per-connection).")
+    parser.add_argument("--rate-per-connection", type=float, default=None,
+                        help="Scale connections (and threads) with each step's rate, one connection per this many req/s.")
+    parser.add_argument("--duration", default="120s", help="wrk2 duration of each step.")
+    parser.add_argument("--slo-p99-ms", type=float, default=None, help="p99 latency SLO; required for --mode binary.")
+    parser.add_argument("--keep-going", action="store_true", help="Don't stop a sweep at the first unsustainable step.")
+    args = parser.parse_args()
+
+    validate_catalog(QUERY_CATALOG)
+    prom = tracer.connect_to_prometheus()
+    if args.mode == "binary":
+        if args.slo_p99_ms is None:
+            parser.error("--mode binary needs --slo-p99-ms")
+        if args.tolerance < 1:
+            parser.error("--tolerance must be at least 1 req/s, wrk2 rates are whole numbers")
+        report = binary_search_campaign(prom, args.start, args.stop, args.slo_p99_ms, args.tolerance,
+                                        args.threads, args.connections, args.rate_per_connection, args.duration)
+    else:
+        if args.mode == "linear":
+            rates = linear_schedule(args.start, args.stop, args.step)
+        else:
+            rates = geometric_schedule(args.start, args.stop, args.factor)
+        schedule = load_schedule(rates, args.threads, args.connections, args.rate_per_connection)
+        report = run_campaign(prom, schedule, args.duration, args.slo_p99_ms, stop_on_failure=not args.keep_going)
+
+    print_campaign_report(report)
+    print(f"Campaign report saved to {save_campaign_report(report)}")
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from span_store import SpanStore
+
+E2E_PERCENTILES = (50, 95, 99)
+
+
+def critical_path(store: SpanStore, roots=None):
+    """
+    Computes the critical path of every trace, walking back from each root's end: a span is
+    waiting on the child that finished last before the current point, then on the child
+    that finished last before that one started, and so on; the gaps are its own (self) time.
+    Children are clipped to their parent's interval, so clock skew can't push time outside it.
+
+    :param roots: Rows of the root spans to walk from, every span without a parent if None.
+    :return: (self_us, total_us) arrays with, per span, the critical-path time spent in the
+        span itself and the time from its start to its (clipped) end, both 0 for spans off
+        the critical path.
+    """
+    start = store.start_us
+    end = store.end_us
+    if roots is None:
+        roots = np.flatnonzero(store.parent < 0)
+    order, offsets = store.children()
+
+    # Plain lists: scalar indexing is much faster than on NumPy arrays in the walk below
+    start_list, end_list = start.tolist(), end.tolist()
+    order_list, offsets_list = order.tolist(), offsets.tolist()
+    self_us = np.zeros(len(start), dtype=np.int64)
+    total_us = np.zeros(len(start), dtype=np.int64)
+    for root in np.asarray(roots).tolist():
+        stack = [(root, end_list[root])]
+        while stack:
+            span, upper = stack.pop()
+            span_start = start_list[span]
+            cursor = min(end_list[span], upper)
+            if cursor <= span_start:
+                continue
+            total_us[span] += cursor - span_start
+            own = 0
+            for child in order_list[offsets_list[span]:offsets_list[span + 1]]:
+                child_start = max(start_list[child], span_start)
+                if child_start >= cursor:
+                    continue
+                child_end = min(end_list[child], cursor)
+                own += cursor - child_end
+                stack.append((child, child_end))
+                cursor = child_start
+                if cursor <= span_start:
+                    break
+            self_us[span] += own + max(cursor - span_start, 0)
+    return self_us, total_us
+
+
+def select_roots(store: SpanStore, service=None, operation=None):
+    """
+    Returns the rows of root spans, optionally only those of a given service and operation.
+    """
+    roots = np.flatnonzero(store.parent < 0)
+    if service is not None:
+        roots = roots[store.service_names(store.service[roots]) == service]
+    if operation is not None:
+        roots = roots[store.operation_names(store.operation[roots]) == operation]
+    return roots
+
+
+def end_to_end_latency(store: SpanStore, roots):
+    durations_ms = store.duration_us[roots] / 1000
+    if not len(durations_ms):
+        return {"traces": 0}
+    summary = {"traces": int(len(durations_ms)), "mean_ms": float(durations_ms.mean())}
+    for percentile, value in zip(E2E_PERCENTILES, np.percentile(durations_ms, E2E_PERCENTILES)):
+        summary[f"p{percentile}_ms"] = float(value)
+    return summary
+
+
+def service_contributions(store: SpanStore, root_service=None, root_operation=None):
+    """
+    Splits end-to-end latency across services using each trace's critical path.
+
+    :param root_service: Only analyse traces whose root span belongs to this service.
+    :param root_operation: ...and has this operation name (e.g. "/wrk2-api/post/compose").
+    :return: (DataFrame, end-to-end summary). One row per service with the mean critical-path
+        self time and time waiting on children per trace, the share of end-to-end latency
+        spent in the service itself, and the fraction of traces it appears on the critical path of.
+    """
+    roots = select_roots(store, root_service, root_operation)
+    traces = len(roots)
+    columns = ["service", "self_ms", "waiting_ms", "self_share", "on_critical_path"]
+    if not traces:
+        return pd.DataFrame(columns=columns), end_to_end_latency(store, roots)
+
+    self_us, total_us = critical_path(store, roots)
+    services = store.service
+    size = len(store.services)
+    self_total = np.bincount(services, weights=self_us, minlength=size)
+    waiting_total = np.bincount(services, weights=total_us - self_us, minlength=size)
+    on_path = total_us > 0
+    # Distinct (trace, service) pairs on the critical path
+    pairs = np.unique(store.trace[on_path].astype(np.int64) * size + services[on_path])
+    trace_counts = np.bincount(pairs % size, minlength=size)
+    e2e_total = float(store.duration_us[roots].sum())
+
+    present = np.flatnonzero(trace_counts)
+    contributions = pd.DataFrame({
+        "service": store.service_names(present),
+        "self_ms": self_total[present] / traces / 1000,
+        "waiting_ms": waiting_total[present] / traces / 1000,
+        "self_share": self_total[present] / e2e_total if e2e_total else 0.0,
+        "on_critical_path": trace_counts[present] / traces,
+    }, columns=columns)
+    contributions = contributions.sort_values("self_ms", ascending=False, ignore_index=True)
+    return contributions, end_to_end_latency(store, roots)
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from service_graph import ServiceGraph
+from utils import get_jaeger_network_map
+
+DEPENDENCY_OUTPUT_DIR = "data/dependencies"
+# Edges whose calls per ingress request changed by more than this fraction are flagged
+CALL_RATIO_THRESHOLD = 0.1
+
+
+def to_epoch_ms(time):
+    return int(time.timestamp() * 1000)
+
+
+def fetch_dependencies(jaeger_url, start_time, end_time):
+    """
+    Fetches the Jaeger dependency links of exactly [start_time, end_time].
+
+    :return: List of {parent, child, callCount} entries.
+    """
+    network_map = get_jaeger_network_map(jaeger_url, end_time=to_epoch_ms(end_time), start_time=to_epoch_ms(start_time))
+    return ServiceGraph.from_network_map(network_map).edges()
+
+
+def snapshot_path(run_id, output_dir=DEPENDENCY_OUTPUT_DIR):
+    return os.path.join(output_dir, f"{run_id}.json")
+
+
+def save_run_dependencies(jaeger_url, run_id, start_time, end_time, slice_seconds=None,
+                          output_dir=DEPENDENCY_OUTPUT_DIR):
+    """
+    Stores the dependency snapshot of a run window in <output_dir>/<run_id>.json, optionally
+    with one snapshot per slice_seconds slice of the window so changes within a run can be
+    diffed too.
+
+    :return: The snapshot dictionary; "data" holds the edges in the Jaeger dependencies format,
+        so the file can be passed anywhere a network map is expected.
+    """
+    snapshot = {
+        "run_id": run_id,
+        "start": start_time.isoformat(),
+        "end": end_time.isoformat(),
+        "data": fetch_dependencies(jaeger_url, start_time, end_time),
+        "slices": [],
+    }
+    if slice_seconds:
+        slice_start = start_time
+        while slice_start < end_time:
+            slice_end = min(slice_start + timedelta(seconds=slice_seconds), end_time)
+            snapshot["slices"].append({
+                "start": slice_start.isoformat(),
+                "end": slice_end.isoformat(),
+                "data": fetch_dependencies(jaeger_url, slice_start, slice_end),
+            })
+            slice_start = slice_end
+    os.makedirs(output_dir, exist_ok=True)
+    with open(snapshot_path(run_id, output_dir), "w") as f:
+        json.dump(snapshot, f, indent=2)
+    return snapshot
+
+
+def load_dependency_snapshot(run_id, output_dir=DEPENDENCY_OUTPUT_DIR):
+    with open(snapshot_path(run_id, output_dir), "r") as f:
+        return json.load(f)
+
+
+def diff_graphs(before: ServiceGraph, after: ServiceGraph, threshold=CALL_RATIO_THRESHOLD):
+    """
+    Compares two dependency graphs edge by edge. Call counts are normalised per ingress
+    request (ServiceGraph.ingress_request_count) so windows of different length or load
+    compare; the ratio of those normalised counts shows traffic amplification changes.
+
+    :param threshold: Relative change of calls per request above which an edge is "changed".
+    :return: DataFrame with one row per edge in either graph: parent, child, status (added,
+        removed, changed or unchanged), calls_before, calls_after, per_request_before,
+        per_request_after and ratio (after / before per request), sorted with the largest
+        changes first.
+    """
+    columns = ["parent", "child", "status", "calls_before", "calls_after",
+               "per_request_before", "per_request_after", "ratio"]
+    edges = sorted(set(before.graph.edges) | set(after.graph.edges))
+    if not edges:
+        return pd.DataFrame(columns=columns)
+    diff = pd.DataFrame(edges, columns=["parent", "child"])
+    for graph, suffix in ((before, "before"), (after, "after")):
+        calls = np.array([graph.graph.edges[edge]["weight"] if graph.graph.has_edge(*edge) else 0 for edge in edges],
+                         dtype=np.float64)
+        diff[f"calls_{suffix}"] = calls
+        requests = graph.ingress_request_count()
+        diff[f"per_request_{suffix}"] = calls / requests if requests else np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        diff["ratio"] = diff["per_request_after"] / diff["per_request_before"]
+    present_before = diff["calls_before"] > 0
+    present_after = diff["calls_after"] > 0
+    diff["status"] = np.select(
+        [~present_before, ~present_after, (diff["ratio"] - 1).abs() > threshold],
+        ["added", "removed", "changed"],
+        "unchanged",
+    )
+    # Structural changes first, then the biggest amplification changes
+    diff["_order"] = diff["status"].map({"added": 0, "removed": 0, "changed": 1, "unchanged": 2})
+    diff["_change"] = -(np.log(diff["ratio"].where(np.isfinite(diff["ratio"]) & (diff["ratio"] > 0)))).abs()
+    diff = diff.sort_values(["_order", "_change", "parent", "child"], na_position="last", ignore_index=True)
+    return diff[columns]
+
+
+def diff_runs(run_a, run_b, output_dir=DEPENDENCY_OUTPUT_DIR, threshold=CALL_RATIO_THRESHOLD):
+    """
+    Diffs the dependency snapshots of two runs (run_a is the baseline).
+    """
+    before = ServiceGraph.from_network_map(load_dependency_snapshot(run_a, output_dir))
+    after = ServiceGraph.from_network_map(load_dependency_snapshot(run_b, output_dir))
+    return diff_graphs(before, after, threshold)
+
+
+def diff_slices(run_id, output_dir=DEPENDENCY_OUTPUT_DIR, threshold=CALL_RATIO_THRESHOLD):
+    """
+    Diffs every time slice of a run's snapshot against the previous one.
+
+    :return: DataFrame as returned by diff_graphs with slice_start and slice_end columns
+        (of the later slice), without unchanged edges.
+    """
+    slices = load_dependency_snapshot(run_id, output_dir)["slices"]
+    diffs = []
+    for previous, current in zip(slices, slices[1:]):
+        diff = diff_graphs(ServiceGraph.from_network_map(previous), ServiceGraph.from_network_map(current), threshold)
+        diff = diff[diff["status"] != "unchanged"]
+        diffs.append(diff.assign(slice_start=current["start"], slice_end=current["end"]))
+    if not diffs:
+        return pd.DataFrame()
+    return pd.concat(diffs, ignore_index=True)
+
+
+def print_dependency_diff(diff):
+    changes = diff[diff["status"] != "unchanged"] if "status" in diff else diff
+    if changes.empty:
+        print("No dependency changes.")
+        return
+    for row in changes.itertuples(index=False):
+        where = f"[{row.slice_start}] " if hasattr(row, "slice_start") else ""
+        if row.status == "added":
+            detail = f"{row.calls_after:.0f} calls"
+        elif row.status == "removed":
+            detail = f"{row.calls_before:.0f} calls"
+        else:
+            detail = f"{row.per_request_before:.3f} -> {row.per_request_after:.3f} calls/request (x{row.ratio:.2f})"
+        print(f"{where}{row.status:<8} {row.parent} -> {row.child}: {detail}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diff per-run Jaeger dependency snapshots.")
+    parser.add_argument("runs", nargs="+",
+                        help="Two run ids to diff (baseline first), or one run id to diff its time slices.")
+    parser.add_argument("--output-dir", default=DEPENDENCY_OUTPUT_DIR, help="Directory holding the snapshots.")
+    parser.add_argument("--threshold", type=float, default=CALL_RATIO_THRESHOLD,
+                        help="Relative change of calls per request at which an edge counts as changed.")
+    args = parser.parse_args()
+
+    if len(args.runs) == 1:
+        print_dependency_diff(diff_slices(args.runs[0], args.output_dir, args.threshold))
+    elif len(args.runs) == 2:
+        print_dependency_diff(diff_runs(*args.runs, args.output_dir, args.threshold))
+    else:
+        parser.error("Pass one run id (slices) or two run ids (baseline, candidate).")
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from metrics_decoder import TIMESTAMP_COLUMN, VALUE_COLUMN
+from query_planner import SHARED_SERVICE
+from run_store import RUN_STORE_NAME, RunStore
+from wrk2_parser import WRK2_STORE_DIR, load_wrk2_summaries
+
+# Per-pod input series (QUERY_CATALOG names) and the role they play in the join
+EFFICIENCY_INPUTS = {
+    "cpu_usage_per_pod": "cpu_cores",
+    "total_http_requests": "requests_per_sec",
+    "network_receive": "receive_bytes_per_sec",
+    "network_transmit": "transmit_bytes_per_sec",
+    "memory_usage_per_pod": "memory_bytes",
+}
+# Derived series written back to the run store, next to their inputs
+DERIVED_METRICS = ("cpu_ms_per_request", "network_bytes_per_request", "memory_per_replica")
+# Samples of pods serving fewer requests per second than this give no per-request ratio
+MIN_REQUEST_RATE = 0.1
+EFFICIENCY_OUTPUT_DIR = "data/efficiency"
+
+
+def read_efficiency_inputs(store: RunStore, run_id):
+    """
+    Reads the input series of a run in one pass and joins them on service, pod and timestamp.
+
+    :return: DataFrame with columns service, pod, timestamp and one column per role in
+        EFFICIENCY_INPUTS (NaN where a pod has no sample of that series).
+    """
+    samples = store.read_df(columns=["service", "metric", "pod", TIMESTAMP_COLUMN, VALUE_COLUMN],
+                            run_id=run_id, metric=list(EFFICIENCY_INPUTS))
+    columns = ["service", "pod", TIMESTAMP_COLUMN, *EFFICIENCY_INPUTS.values()]
+    if samples.empty:
+        return pd.DataFrame(columns=columns)
+    for column in ("service", "metric", "pod"):
+        samples[column] = samples[column].astype(str)
+    samples = samples[(samples["service"] != SHARED_SERVICE) & np.isfinite(samples[VALUE_COLUMN])]
+    # Series with extra labels next to pod are summed per pod
+    joined = samples.pivot_table(index=["service", "pod", TIMESTAMP_COLUMN], columns="metric",
+                                 values=VALUE_COLUMN, aggfunc="sum")
+    joined = joined.rename(columns=EFFICIENCY_INPUTS).reset_index()
+    return joined.reindex(columns=columns)
+
+
+def per_pod_efficiency(joined):
+    """
+    CPU-ms and network bytes (received + transmitted) per request for every pod sample that
+    has both the resource and the request rate.
+
+    :return: DataFrame with columns service, pod, timestamp, cpu_ms_per_request, network_bytes_per_request.
+    """
+    requests = joined["requests_per_sec"].where(joined["requests_per_sec"] >= MIN_REQUEST_RATE)
+    network = joined["receive_bytes_per_sec"] + joined["transmit_bytes_per_sec"]
+    return pd.DataFrame({
+        "service": joined["service"],
+        "pod": joined["pod"],
+        TIMESTAMP_COLUMN: joined[TIMESTAMP_COLUMN],
+        "cpu_ms_per_request": joined["cpu_cores"] * 1000 / requests,
+        "network_bytes_per_request": network / requests,
+    })
+
+
+def per_service_memory(joined):
+    """
+    Mean memory per replica of every service at every timestamp, the replicas being the pods
+    reporting memory at that time.
+
+    :return: DataFrame with columns service, timestamp, memory_per_replica, replicas.
+    """
+    memory = joined.dropna(subset=["memory_bytes"]).groupby(["service", TIMESTAMP_COLUMN])["memory_bytes"]
+    return pd.DataFrame({
+        "memory_per_replica": memory.mean(),
+        "replicas": memory.count(),
+    }).reset_index()
+
+
+def store_efficiency_metrics(store: RunStore, run_id):
+    """
+    Derives the DERIVED_METRICS series of a run and writes them to the run store under each
+    service, replacing earlier derived series, so they are summarised, plotted and compared
+    like any collected metric.
+
+    :return: Number of series written.
+    """
+    joined = read_efficiency_inputs(store, run_id)
+    for service in joined["service"].unique():
+        for metric in DERIVED_METRICS:
+            store.delete_series(run_id, service, metric)
+    per_pod = per_pod_efficiency(joined)
+    memory = per_service_memory(joined)
+    written = 0
+    for service, service_rows in per_pod.groupby("service"):
+        for metric in ("cpu_ms_per_request", "network_bytes_per_request"):
+            series = service_rows.dropna(subset=[metric])
+            if series.empty:
+                continue
+            store.append(run_id, service, metric, series[["pod", TIMESTAMP_COLUMN, metric]].rename(columns={metric: VALUE_COLUMN}))
+            written += 1
+    for service, service_rows in memory.groupby("service"):
+        store.append(run_id, service, "memory_per_replica",
+                     service_rows[[TIMESTAMP_COLUMN, "memory_per_replica"]].rename(columns={"memory_per_replica": VALUE_COLUMN}))
+        written += 1
+    return written
+
+
+def _ratio(numerator, denominator):
+    return float(numerator / denominator) if denominator else None
+
+
+def efficiency_summary(store: RunStore, run_id, wrk2_dir=WRK2_STORE_DIR):
+    """
+    Run-level efficiency per service, as ratios of totals over the run (not means of
+    per-sample ratios, which idle samples would skew):
+
+    - cpu_ms_per_request: CPU time over requests served, only counting samples with both
+    - network_bytes_per_request: bytes received + transmitted over requests served
+    - memory_per_replica: mean and max memory of one replica, with the mean replica count
+
+    The "system" entry relates the CPU and network of all services to the requests wrk2
+    sent, i.e. the cost of one end-to-end request.
+    """
+    joined = read_efficiency_inputs(store, run_id)
+    services = {}
+    if joined.empty:
+        return {"run_id": run_id, "services": services, "system": {}}
+    memory = per_service_memory(joined)
+    for service, rows in joined.groupby("service"):
+        served = rows[rows["requests_per_sec"] >= MIN_REQUEST_RATE]
+        with_cpu = served.dropna(subset=["cpu_cores"])
+        with_network = served.dropna(subset=["receive_bytes_per_sec", "transmit_bytes_per_sec"])
+        service_memory = memory[memory["service"] == service]
+        services[service] = {
+            "cpu_ms_per_request": _ratio(with_cpu["cpu_cores"].sum() * 1000, with_cpu["requests_per_sec"].sum()),
+            "network_bytes_per_request": _ratio(
+                (with_network["receive_bytes_per_sec"] + with_network["transmit_bytes_per_sec"]).sum(),
+                with_network["requests_per_sec"].sum(),
+            ),
+            "requests_per_sec": float(rows.groupby(TIMESTAMP_COLUMN)["requests_per_sec"].sum(min_count=1).mean()),
+            "cpu_cores": float(rows.groupby(TIMESTAMP_COLUMN)["cpu_cores"].sum(min_count=1).mean()),
+            "memory_per_replica_mean": float(service_memory["memory_per_replica"].mean()) if len(service_memory) else None,
+            "memory_per_replica_max": float(service_memory["memory_per_replica"].max()) if len(service_memory) else None,
+            "replicas": float(service_memory["replicas"].mean()) if len(service_memory) else None,
+        }
+    services = {
+        service: {key: (None if value is None or np.isnan(value) else value) for key, value in summary.items()}
+        for service, summary in services.items()
+    }
+
+    system = {}
+    summaries = load_wrk2_summaries(wrk2_dir, [run_id])
+    request_rate = summaries.at[run_id, "requests_per_sec"] if run_id in summaries.index else None
+    if request_rate:
+        totals = joined.groupby(TIMESTAMP_COLUMN)[["cpu_cores", "receive_bytes_per_sec", "transmit_bytes_per_sec"]].sum()
+        system = {
+            "requests_per_sec": float(request_rate),
+            "cpu_ms_per_request": float(totals["cpu_cores"].mean() * 1000 / request_rate),
+            "network_bytes_per_request": float(
+                (totals["receive_bytes_per_sec"] + totals["transmit_bytes_per_sec"]).mean() / request_rate
+            ),
+        }
+    return {"run_id": run_id, "services": services, "system": system}
+
+
+def save_efficiency_summary(summary, output_dir=EFFICIENCY_OUTPUT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{summary['run_id']}.json")
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    return path
+
+
+def print_efficiency_summary(summary):
+    def show(value, fmt):
+        return format(value, fmt) if value is not None else "-"
+
+    print(f"Efficiency of run {summary['run_id']}:")
+    print(f"  {'service':<30} {'CPU-ms/req':>10} {'bytes/req':>10} {'req/s':>8} {'MiB/replica':>11} {'replicas':>8}")
+    for service, row in sorted(summary["services"].items()):
+        memory = row["memory_per_replica_mean"] / 2 ** 20 if row["memory_per_replica_mean"] is not None else None
+        print(f"  {service:<30} {show(row['cpu_ms_per_request'], '10.3f')} {show(row['network_bytes_per_request'], '10.0f')} "
+              f"{show(row['requests_per_sec'], '8.1f')} {show(memory, '11.1f')} {show(row['replicas'], '8.1f')}")
+    system = summary["system"]
+    if system:
+        print(f"  Per end-to-end request ({system['requests_per_sec']:.1f} req/s): "
+              f"{system['cpu_ms_per_request']:.3f} CPU-ms, {system['network_bytes_per_request']:.0f} bytes")
+
+
+def save_run_efficiency(store: RunStore, run_id, wrk2_dir=WRK2_STORE_DIR, output_dir=EFFICIENCY_OUTPUT_DIR):
+    """
+    Writes the derived series of a run to the store and its summary to <output_dir>/<run_id>.json.
+    """
+    store_efficiency_metrics(store, run_id)
+    summary = efficiency_summary(store, run_id, wrk2_dir)
+    save_efficiency_summary(summary, output_dir)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive CPU, network and memory efficiency metrics of a run.")
+    parser.add_argument("--data-path", default="data", help="Directory holding the run store.")
+    parser.add_argument("--run-id", default=None, help="Run to derive metrics for, the latest run by default.")
+    args = parser.parse_args()
+
+    store = RunStore(os.path.join(args.data_path, RUN_STORE_NAME))
+    run_id = args.run_id or store.latest_run_id()
+    summary = save_run_efficiency(store, run_id, os.path.join(args.data_path, os.path.basename(WRK2_STORE_DIR)),
+                                  os.path.join(args.data_path, os.path.basename(EFFICIENCY_OUTPUT_DIR)))
+    print_efficiency_summary(summary)
@@ -0,0 +1,297 @@
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from datetime import timedelta
+
+import requests
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_TIMEOUT = 30
+DEFAULT_STEP = "15s"
+MAX_ATTEMPTS = 5
+
+# Prometheus rejects range queries returning more than 11,000 points per series
+MAX_POINTS_PER_QUERY = 11000
+# Automatic steps aim for about this many points per series over the whole window,
+# never going below DEFAULT_STEP (the scrape interval)...
+TARGET_POINTS = 2000
+# ...and long windows are split into parallel requests of at most this many points each
+CHUNK_POINTS = 720
+# Steps the automatic step is rounded up to, in seconds
+NICE_STEPS = (15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 21600, 43200, 86400)
+
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+# Prometheus answers with these when it is overloaded or rate limiting us
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+def step_to_seconds(step):
+    """
+    Converts a Prometheus step/duration ("15s", "1m", "500ms" or plain seconds) into seconds.
+    """
+    if isinstance(step, (int, float)):
+        return float(step)
+    step = str(step).strip()
+    for unit in sorted(DURATION_UNITS, key=len, reverse=True):
+        if step.endswith(unit) and step[:-len(unit)].replace(".", "", 1).isdigit():
+            return float(step[:-len(unit)]) * DURATION_UNITS[unit]
+    try:
+        return float(step)
+    except ValueError:
+        raise ValueError(f"Invalid step '{step}'. Use seconds or a duration such as '15s', '1m' or '1h'.")
+
+
+def source_key(url, headers=None, auth=None):
+    """
+    Identifies the Prometheus a result came from for query_cache.QueryCache: its base URL plus
+    a hash of the credentials (auth, Authorization and tenant headers), so different servers
+    or tenants never share cached results and no secret ends up in the cache files.
+    """
+    identity = json.dumps([repr(auth), {name: value for name, value in (headers or {}).items()
+                                        if name.lower() in ("authorization", "x-scope-orgid")}], sort_keys=True)
+    return f"{url.rstrip('/')}|{hashlib.sha256(identity.encode()).hexdigest()[:16]}"
+
+
+def auto_step(start_time, end_time, target_points=TARGET_POINTS, min_step=DEFAULT_STEP, max_step=None):
+    """
+    Picks a range query step for a window: the smallest "nice" step giving at most
+    target_points points per series, and at least min_step.
+
+    :param max_step: Optional upper bound in seconds, e.g. the query's shortest range window,
+        since wider steps skip samples between windows. Costs more points (and chunks) on
+        long windows.
+    :return: The step as a Prometheus duration string, e.g. "15s" or "300s".
+    """
+    duration = max((end_time - start_time).total_seconds(), 0)
+    min_seconds = step_to_seconds(min_step)
+    needed = max(min_seconds, duration / target_points)
+    step = next((nice for nice in NICE_STEPS if nice >= needed), None)
+    if step is None:
+        step = math.ceil(needed / NICE_STEPS[-1]) * NICE_STEPS[-1]
+    if max_step is not None and step > max_step:
+        step = max([nice for nice in NICE_STEPS if nice <= max_step] or [max_step])
+        step = max(step, min_seconds)
+    return f"{step:g}s"
+
+
+def split_range(start_time, end_time, step, chunk_points=CHUNK_POINTS):
+    """
+    Splits a window into consecutive chunks of at most chunk_points evaluation steps.
+    Each chunk starts a whole number of steps after start_time, so chunks never share an
+    evaluation timestamp and their results can simply be concatenated.
+
+    :return: List of (chunk_start, chunk_end) datetimes.
+    """
+    chunk_points = min(chunk_points, MAX_POINTS_PER_QUERY)
+    step = timedelta(seconds=step_to_seconds(step))
+    chunks = []
+    chunk_start = start_time
+    while chunk_start <= end_time:
+        chunk_end = min(chunk_start + (chunk_points - 1) * step, end_time)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start += chunk_points * step
+    return chunks
+
+
+def merge_results(merged, result):
+    """
+    Appends the series of one chunk's matrix result to the merged result of the chunks
+    before it, in place, matching series by their labels.
+
+    :return: The merged result.
+    """
+    index = {tuple(sorted(series.get("metric", {}).items())): series for series in merged}
+    for series in result:
+        labels = tuple(sorted(series.get("metric", {}).items()))
+        if labels in index:
+            index[labels]["values"].extend(series.get("values", []))
+        else:
+            series = {"metric": series.get("metric", {}), "values": list(series.get("values", []))}
+            index[labels] = series
+            merged.append(series)
+    return merged
+
+
+@dataclass
+class FetchJob:
+    """
+    A single Prometheus query to run.
+
+    :param key: Caller-defined identifier handed back with the result, e.g. (service, metric_name).
+    :param query: PromQL query string.
+    :param range_query: Use /api/v1/query_range if True, otherwise /api/v1/query.
+    :param step: Resolution step for range queries; None picks one from the window length (see auto_step).
+    :param chunk: (index, count) of the time chunk this job covers, set by fetch_all when it
+        splits a long window.
+    """
+    key: tuple
+    query: str
+    range_query: bool = True
+    step: str = None
+    chunk: tuple = (0, 1)
+
+
+class AdaptiveBackoff:
+    """
+    Backoff state shared by all workers of a fetch.
+
+    Every throttled response (429/503) doubles the delay and pauses *all* workers,
+    so we back off as a whole instead of each thread hammering Prometheus on its own.
+    Successful responses halve the delay again.
+    """
+
+    def __init__(self, initial_delay=0.5, max_delay=30.0):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.delay = 0.0
+        self.pause_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            remaining = self.pause_until - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            self.delay = min(self.max_delay, max(self.initial_delay, self.delay * 2))
+            pause = retry_after if retry_after is not None else self.delay
+            # Jitter so paused workers don't all come back on the same tick
+            pause += random.uniform(0, self.delay / 2)
+            self.pause_until = max(self.pause_until, time.monotonic() + pause)
+            return pause
+
+    def succeeded(self):
+        with self._lock:
+            self.delay = self.delay / 2 if self.delay > self.initial_delay else 0.0
+
+
+def _parse_retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def prometheus_result(payload):
+    return payload["data"]["result"]
+
+
+def request_with_backoff(session, url, params, timeout, backoff: AdaptiveBackoff, headers=None, auth=None,
+                         parse=prometheus_result, data=None, raw=False):
+    """
+    Sends one GET request (or POST, with data), retrying throttled responses and timeouts.
+
+    :param parse: Extracts the result from the decoded JSON body; Prometheus' data.result by default.
+    :param data: Request body; the request is POSTed if set.
+    :param raw: Hand parse the response bytes instead of the decoded JSON body.
+    :return: (result, msg) where msg is "OK" on success and result is None on failure.
+    """
+    msg = "No attempts made"
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        backoff.wait()
+        try:
+            if data is None:
+                response = session.get(url, params=params, headers=headers, auth=auth, timeout=timeout)
+            else:
+                response = session.post(url, params=params, data=data, headers=headers, auth=auth, timeout=timeout)
+        except requests.Timeout:
+            msg = f"Timed out after {timeout}s"
+            continue
+        except requests.RequestException as e:
+            return None, str(e)
+
+        if response.status_code in THROTTLE_STATUS_CODES:
+            pause = backoff.throttled(_parse_retry_after(response))
+            msg = f"HTTP Status Code {response.status_code}, backing off {pause:.1f}s (attempt {attempt}/{MAX_ATTEMPTS})"
+            continue
+        if response.status_code != 200:
+            return None, f"HTTP Status Code {response.status_code} ({response.content!r})"
+
+        backoff.succeeded()
+        # A proxy or tunnel error page can come back as a 200 too
+        try:
+            return parse(response.content if raw else response.json()), "OK"
+        except (ValueError, KeyError, TypeError) as e:
+            return None, f"Unexpected response body ({type(e).__name__}: {e}): {response.content[:200]!r}"
+    return None, msg
+
+
+def query_prometheus(session, prom_url, job: FetchJob, start_time, end_time, timeout=DEFAULT_TIMEOUT,
+                     backoff: AdaptiveBackoff = None, headers=None, auth=None, cache=None):
+    """
+    Runs one job against the Prometheus HTTP API, retrying throttled responses.
+
+    :param cache: Optional query_cache.QueryCache; range queries are then served from it
+        and only the sub-ranges it is missing are requested.
+    :return: (result, msg) in the same shape as tracer.fetch_metrics.
+    """
+    backoff = backoff or AdaptiveBackoff()
+    # Let Prometheus abandon the evaluation too, not just the client
+    if not job.range_query:
+        params = {"query": job.query, "timeout": f"{timeout}s"}
+        return request_with_backoff(session, f"{prom_url}/api/v1/query", params, timeout, backoff, headers, auth)
+
+    def fetch_range(start, end):
+        params = {"query": job.query, "start": start, "end": end, "step": job.step, "timeout": f"{timeout}s"}
+        return request_with_backoff(session, f"{prom_url}/api/v1/query_range", params, timeout, backoff, headers, auth)
+
+    if cache is not None:
+        return cache.query_range(source_key(prom_url, headers, auth), job.query, start_time.timestamp(),
+                                 end_time.timestamp(), job.step, fetch_range)
+    return fetch_range(round(start_time.timestamp()), round(end_time.timestamp()))
+
+
+def fetch_all(prom, jobs, start_time, end_time, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT,
+              cache=None, chunk_points=CHUNK_POINTS):
+    """
+    Runs all jobs through a bounded thread pool and yields results as they complete.
+
+    Range queries over long windows are split into chunks of at most chunk_points steps
+    that run in parallel. Each chunk is yielded on its own (with job.chunk set), so callers
+    can store results as they stream in instead of holding whole windows in memory.
+
+    :param prom: PrometheusConnect object, used for its URL, headers and auth; requests go
+        through its session, the shared http_client pool if it was created by
+        http_client.HttpClient.prometheus.
+    :param jobs: Iterable of FetchJob.
+    :param start_time: Start time for range queries.
+    :param end_time: End time for range queries.
+    :param max_workers: Maximum number of requests in flight at once.
+    :param timeout: Per-request timeout in seconds.
+    :param cache: Optional query_cache.QueryCache for range queries.
+    :param chunk_points: Maximum number of steps per range request.
+    :return: Generator of (job, result, msg) tuples, in completion order.
+    """
+    session = prom._session
+    backoff = AdaptiveBackoff()
+    default_step = auto_step(start_time, end_time)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for job in jobs:
+            if not job.range_query:
+                windows = [(start_time, end_time)]
+            else:
+                job = replace(job, step=job.step or default_step)
+                windows = split_range(start_time, end_time, job.step, chunk_points)
+            for index, (chunk_start, chunk_end) in enumerate(windows):
+                chunk_job = replace(job, chunk=(index, len(windows)))
+                future = executor.submit(
+                    query_prometheus, session, prom.url, chunk_job, chunk_start, chunk_end,
+                    timeout, backoff, prom.headers, prom.auth, cache,
+                )
+                futures[future] = chunk_job
+        for future in as_completed(futures):
+            # One failing job must not end the generator for all the others
+            try:
+                result, msg = future.result()
+            except Exception as e:
+                result, msg = None, f"{type(e).__name__}: {e}"
+            yield futures.pop(future), result, msg
@@ -0,0 +1,162 @@
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import requests
+from prometheus_api_client import PrometheusConnect
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Host pools kept open at once (Prometheus, Jaeger, ...)
+POOL_HOSTS = 8
+# Keep-alive connections kept per host; at least the fetch concurrency (PROM_MAX_CONCURRENCY,
+# fetch_engine.DEFAULT_MAX_WORKERS), or the extra connections are closed after every request
+POOL_MAXSIZE = 16
+DEFAULT_TIMEOUT = 30
+# Connection errors and gateway errors of a dropped tunnel are retried here, with exponential
+# backoff and jitter. Throttling (429/503) and timeouts are left to the callers, which back
+# off across all workers (see fetch_engine.AdaptiveBackoff)
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_BACKOFF_JITTER = 0.5
+RETRY_STATUS_CODES = (502, 504)
+# Every POST sent (remote read, Prometheus queries) only reads, so it is safe to retry
+RETRY_METHODS = frozenset({"GET", "HEAD", "POST"})
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+
+
+@dataclass
+class HostTimings:
+    """
+    Request timing of one host, from sending the request until the body is read and decoded.
+    """
+    requests: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+    bytes: int = 0
+
+    def add(self, seconds, size=0, error=False):
+        self.requests += 1
+        self.errors += error
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += size
+
+
+class TimedSession(requests.Session):
+    """
+    requests session that reports every request to a callback (status code or None on
+    failure, seconds, decoded body size) and skips certificate checks for the URL prefixes
+    in insecure_prefixes.
+    """
+
+    def __init__(self, on_request):
+        super().__init__()
+        self.on_request = on_request
+        self.insecure_prefixes = set()
+
+    def request(self, method, url, *args, **kwargs):
+        if any(url.startswith(prefix) for prefix in self.insecure_prefixes):
+            kwargs.setdefault("verify", False)
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            self.on_request(url, None, time.perf_counter() - started, 0)
+            raise
+        # Streamed bodies aren't read yet, so only their time to the headers is known
+        size = 0 if kwargs.get("stream") else len(response.content)
+        self.on_request(url, response.status_code, time.perf_counter() - started, size)
+        return response
+
+
+class HttpClient:
+    """
+    Shared HTTP layer for Prometheus and Jaeger: one session with a keep-alive connection pool
+    per host, gzip/deflate responses, retries with jittered backoff and per-host timings. Going
+    through one pool saves the TCP (and TLS) setup of every request, which is expensive
+    through SSH tunnels.
+    """
+
+    def __init__(self, pool_maxsize=POOL_MAXSIZE, max_retries=MAX_RETRIES):
+        self.session = TimedSession(self._record)
+        self.session.headers.update(DEFAULT_HEADERS)
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            # One read retry covers keep-alive connections a tunnel closed while idle
+            read=1,
+            status=max_retries,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=RETRY_METHODS,
+            backoff_factor=RETRY_BACKOFF_FACTOR,
+            backoff_jitter=RETRY_BACKOFF_JITTER,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.mount("http://")
+        self.mount("https://")
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def mount(self, prefix):
+        self.session.mount(prefix, self.adapter)
+
+    def _record(self, url, status_code, seconds, size):
+        with self._lock:
+            self.timings.setdefault(urlparse(url).netloc, HostTimings()).add(
+                seconds, size, error=status_code is None or status_code >= 400
+            )
+
+    def get(self, url, params=None, timeout=DEFAULT_TIMEOUT, **kwargs):
+        return self.session.get(url, params=params, timeout=timeout, **kwargs)
+
+    def prometheus(self, url, headers=None, auth=None, disable_ssl=False):
+        """
+        PrometheusConnect whose requests go through the shared session and pool.
+        """
+        if disable_ssl:
+            self.session.insecure_prefixes.add(url)
+        prom = PrometheusConnect(url=url, headers=headers, auth=auth, session=self.session)
+        # PrometheusConnect mounts its own adapter on the URL; put the pooled one back
+        self.mount(url)
+        return prom
+
+    def timing_summary(self):
+        """
+        :return: {host: {"requests", "errors", "mean_ms", "max_ms", "bytes"}}
+        """
+        with self._lock:
+            return {
+                host: {
+                    "requests": timings.requests,
+                    "errors": timings.errors,
+                    "mean_ms": timings.seconds * 1000 / timings.requests,
+                    "max_ms": timings.max_seconds * 1000,
+                    "bytes": timings.bytes,
+                }
+                for host, timings in self.timings.items()
+            }
+
+    def print_timings(self):
+        for host, summary in sorted(self.timing_summary().items()):
+            print(f"HTTP {host}: {summary['requests']} requests ({summary['errors']} failed), "
+                  f"mean {summary['mean_ms']:.0f}ms, max {summary['max_ms']:.0f}ms, "
+                  f"{summary['bytes'] / 2 ** 20:.1f} MiB", flush=True)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    The process-wide HttpClient, created on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,156 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from critical_path import service_contributions
+from fetch_engine import DEFAULT_MAX_WORKERS, DEFAULT_TIMEOUT, AdaptiveBackoff, request_with_backoff
+from http_client import get_client
+from span_store import SpanStore
+from utils import get_current_utc_timestamp
+
+TRACE_OUTPUT_DIR = "data/traces"
+
+# The wrk2 compose-post requests enter the system here
+TRACE_SERVICE = "nginx-web-server"
+TRACE_OPERATION = "/wrk2-api/post/compose"
+
+# Jaeger's search API has no cursor, so the run window is cut into slices of this many
+# seconds, each fetched with at most TRACE_PAGE_LIMIT traces...
+TRACE_SLICE_SECONDS = 10
+TRACE_PAGE_LIMIT = 1000
+# ...and slices that hit the limit are halved until they are this short (microseconds)
+MIN_TRACE_SLICE_US = 100_000
+
+
+def trace_windows(start_us, end_us, slice_us):
+    windows = []
+    window_start = start_us
+    while window_start < end_us:
+        windows.append((window_start, min(window_start + slice_us, end_us)))
+        window_start += slice_us
+    return windows
+
+
+def fetch_trace_page(session, jaeger_url, service, operation, start_us, end_us, limit=TRACE_PAGE_LIMIT,
+                     timeout=DEFAULT_TIMEOUT, backoff: AdaptiveBackoff = None):
+    """
+    Fetches the traces of one time slice from Jaeger's /api/traces.
+
+    :return: (traces, msg) where traces is the "data" list, or None on failure.
+    """
+    params = {
+        "service": service,
+        "start": start_us,
+        "end": end_us,
+        "limit": limit,
+        "lookback": "custom",
+    }
+    if operation:
+        params["operation"] = operation
+    return request_with_backoff(
+        session, f"{jaeger_url}/api/traces", params, timeout, backoff or AdaptiveBackoff(),
+        parse=lambda payload: payload.get("data") or [],
+    )
+
+
+def stream_traces(jaeger_url, start_time, end_time, service=TRACE_SERVICE, operation=TRACE_OPERATION,
+                  limit=TRACE_PAGE_LIMIT, slice_seconds=TRACE_SLICE_SECONDS,
+                  max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+    """
+    Fetches all sampled traces of a time window, slice by slice through a bounded thread pool,
+    and yields each slice's new traces as soon as it arrives. Slices that come back full are
+    split in half and fetched again, so busy periods aren't truncated at the page limit.
+
+    :return: Generator of lists of Jaeger trace dicts, each trace yielded once.
+    """
+    start_us = int(start_time.timestamp() * 1_000_000)
+    end_us = int(end_time.timestamp() * 1_000_000)
+    session = get_client().session
+    backoff = AdaptiveBackoff()
+    seen = set()
+
+    def submit(executor, window):
+        return executor.submit(fetch_trace_page, session, jaeger_url, service, operation, *window,
+                               limit, timeout, backoff)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {submit(executor, window): window for window in trace_windows(start_us, end_us, slice_seconds * 1_000_000)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                window_start, window_end = pending.pop(future)
+                traces, msg = future.result()
+                if traces is None:
+                    print(f"Trace fetch failed for {window_start}-{window_end}: {msg}", flush=True)
+                    continue
+                if len(traces) >= limit and window_end - window_start > MIN_TRACE_SLICE_US:
+                    middle = (window_start + window_end) // 2
+                    for window in ((window_start, middle), (middle, window_end)):
+                        pending[submit(executor, window)] = window
+                new_traces = [trace for trace in traces if trace.get("traceID") not in seen]
+                seen.update(trace.get("traceID") for trace in new_traces)
+                if new_traces:
+                    yield new_traces
+
+
+def run_spans_path(run_id, output_dir=TRACE_OUTPUT_DIR):
+    return os.path.join(output_dir, f"{run_id}_spans")
+
+
+def load_run_spans(run_id, output_dir=TRACE_OUTPUT_DIR, memory_map=True):
+    """
+    Opens the spans saved for a run by analyze_run_traces, memory-mapped by default.
+    """
+    return SpanStore.load(run_spans_path(run_id, output_dir), memory_map)
+
+
+def ingest_traces(jaeger_url, start_time, end_time, **kwargs):
+    """
+    Streams the traces of a window into a SpanStore; each page's JSON is dropped once converted.
+    Takes the same keyword arguments as stream_traces.
+    """
+    store = SpanStore()
+    for traces in stream_traces(jaeger_url, start_time, end_time, **kwargs):
+        store.add_traces(traces)
+    return store
+
+
+def critical_path_report(store: SpanStore, run_id=None, root_service=TRACE_SERVICE, root_operation=TRACE_OPERATION):
+    contributions, end_to_end = service_contributions(store, root_service, root_operation)
+    return {
+        "run_id": run_id,
+        "root_service": root_service,
+        "root_operation": root_operation,
+        "spans": len(store),
+        "end_to_end": end_to_end,
+        "services": contributions.to_dict(orient="records"),
+    }
+
+
+def analyze_run_traces(jaeger_url, run_id, start_time, end_time, output_dir=TRACE_OUTPUT_DIR, **kwargs):
+    """
+    Ingests the traces of a run window, saves the spans to <output_dir>/<run_id>_spans/ and
+    writes the per-service critical-path breakdown of end-to-end latency to
+    <output_dir>/<run_id>_critical_path.json.
+
+    :return: The report dictionary.
+    """
+    print(f"[{get_current_utc_timestamp()}] Fetching traces from Jaeger...", flush=True)
+    store = ingest_traces(jaeger_url, start_time, end_time, **kwargs)
+    os.makedirs(output_dir, exist_ok=True)
+    store.save(run_spans_path(run_id, output_dir))
+    report = critical_path_report(store, run_id)
+    with open(os.path.join(output_dir, f"{run_id}_critical_path.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def print_critical_path_report(report):
+    end_to_end = report["end_to_end"]
+    print(f"Critical path of {end_to_end['traces']} '{report['root_operation']}' traces ({report['spans']} spans)")
+    if not end_to_end["traces"]:
+        return
+    print(f"End-to-end latency: mean {end_to_end['mean_ms']:.2f}ms, p99 {end_to_end['p99_ms']:.2f}ms")
+    for row in report["services"]:
+        print(f"  {row['service']:<30} self {row['self_ms']:8.2f}ms ({row['self_share']:6.1%})  "
+              f"waiting {row['waiting_ms']:8.2f}ms  on path in {row['on_critical_path']:6.1%} of traces")
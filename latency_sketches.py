@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from metrics_decoder import TIMESTAMP_COLUMN, VALUE_COLUMN
+from run_store import RunStore
+from sketches import QuantileSketch, merge_sketches
+
+# Metrics holding per-bucket request rates of a Prometheus histogram (series labelled "le"),
+# stored as latency sketches instead of raw samples
+HISTOGRAM_METRICS = ("http_request_duration_bucket",)
+# Width of the time slices histograms are sketched over; any coarser slice can be merged from these
+SKETCH_SLICE_SECONDS = 60
+# wrk2's client-side latency spectra are stored under this service, one metric per kind
+WRK2_SERVICE = "wrk2"
+WRK2_SKETCH_METRIC = "latency_{kind}"
+
+
+def histogram_to_sketches(metrics_df, step_seconds, slice_seconds=SKETCH_SLICE_SECONDS):
+    """
+    Turns a decoded histogram query result (cumulative per-second request rates per "le"
+    bucket, e.g. sum(rate(..._bucket[2m])) by (le, pod)) into one latency sketch per pod
+    and time slice. Each sample stands for rate * step requests.
+
+    :param metrics_df: Output of metrics_decoder.decode_result with an "le" column.
+    :param step_seconds: Query step the samples were taken at.
+    :return: DataFrame with columns pod, timestamp (slice start), count and sketch (bytes).
+    """
+    if metrics_df.empty or "le" not in metrics_df:
+        return pd.DataFrame(columns=["pod", TIMESTAMP_COLUMN, "count", "sketch"])
+    frame = pd.DataFrame({
+        "pod": metrics_df["pod"].astype(str) if "pod" in metrics_df else "",
+        "le": pd.to_numeric(metrics_df["le"].astype(str).replace("+Inf", "inf"), errors="coerce"),
+        TIMESTAMP_COLUMN: metrics_df[TIMESTAMP_COLUMN].dt.floor(f"{slice_seconds}s"),
+        "requests": metrics_df[VALUE_COLUMN].to_numpy(dtype=np.float64) * step_seconds,
+    })
+    frame = frame[np.isfinite(frame["requests"]) & frame["le"].notna()]
+    cumulative = frame.groupby(["pod", TIMESTAMP_COLUMN, "le"], sort=True)["requests"].sum().unstack("le")
+
+    rows = []
+    bounds = cumulative.columns.to_numpy(dtype=np.float64)
+    for (pod, timestamp), counts in zip(cumulative.index, cumulative.to_numpy()):
+        present = ~np.isnan(counts)
+        sketch = QuantileSketch()
+        sketch.add_histogram(bounds[present], counts[present])
+        if sketch.count > 0:
+            rows.append({"pod": pod, TIMESTAMP_COLUMN: timestamp, "count": sketch.count, "sketch": sketch.to_bytes()})
+    return pd.DataFrame(rows, columns=["pod", TIMESTAMP_COLUMN, "count", "sketch"])
+
+
+def store_histogram_sketches(run_store: RunStore, run_id, service, metric_name, metrics_df, step_seconds):
+    sketches = histogram_to_sketches(metrics_df, step_seconds)
+    run_store.append_sketches(run_id, service, metric_name, sketches)
+    return len(sketches)
+
+
+def spectrum_sketch(spectrum):
+    """
+    Builds a latency sketch in seconds from a parsed wrk2 spectrum (see wrk2_parser),
+    counting each spectrum line's new requests at its latency value.
+    """
+    sketch = QuantileSketch()
+    counts = np.diff(spectrum["total_count"], prepend=0)
+    sketch.add_weighted(spectrum["value_ms"] / 1000, counts)
+    return sketch
+
+
+def store_wrk2_sketches(run_store: RunStore, run_id, parsed, timestamp):
+    """
+    Stores the client-side latency spectra of a parsed wrk2 run as sketches, so they can be
+    merged across runs like the server-side histograms.
+
+    :param timestamp: When the load started (naive local time, like save_wrk2_results'
+        load_start), so time-filtered queries over the run window include the sketches.
+    """
+    timestamp = pd.Timestamp(timestamp)
+    for kind, spectrum in parsed["spectrum"].items():
+        sketch = spectrum_sketch(spectrum)
+        if not sketch.count:
+            continue
+        sketches = pd.DataFrame({"pod": [""], TIMESTAMP_COLUMN: [timestamp], "count": [sketch.count],
+                                 "sketch": [sketch.to_bytes()]})
+        run_store.append_sketches(run_id, WRK2_SERVICE, WRK2_SKETCH_METRIC.format(kind=kind), sketches)
+
+
+def _time_filter(start=None, end=None):
+    expression = None
+    for bound, compare in ((start, "__ge__"), (end, "__lt__")):
+        if bound is None:
+            continue
+        condition = getattr(ds.field(TIMESTAMP_COLUMN), compare)(pa.scalar(pd.Timestamp(bound), pa.timestamp("ms")))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def sketch_quantiles(run_store: RunStore, quantiles=(0.5, 0.95, 0.99), by=("service",), run_id=None,
+                     service=None, metric=HISTOGRAM_METRICS[0], pod=None, start=None, end=None):
+    """
+    Computes latency percentiles over any grouping by merging the stored sketches, without
+    going back to Prometheus.
+
+    :param quantiles: Quantiles (0-1) to compute.
+    :param by: Columns to group by, any of run_id, service, metric, pod, timestamp; an empty
+        tuple merges everything that matches the filters.
+    :param run_id: Run id or list of run ids to include (a run set).
+    :param start: Only include time slices starting at or after this time.
+    :param end: Only include time slices starting before this time.
+    :return: DataFrame with the group columns, count and one p<q*100> column per quantile,
+        in the sketch unit (seconds).
+    """
+    sketches = run_store.read_sketches(run_id=run_id, service=service, metric=metric, pod=pod,
+                                       filter=_time_filter(start, end))
+    rows = []
+    groups = sketches.groupby(list(by), sort=True, observed=True)["sketch"] if by else [((), sketches["sketch"])]
+    for key, serialized in groups:
+        merged = merge_sketches(serialized)
+        key = key if isinstance(key, tuple) else (key,)
+        row = dict(zip(by, key))
+        row["count"] = merged.count
+        for q in quantiles:
+            row[f"p{q * 100:g}"] = merged.quantile(q)
+        rows.append(row)
+    return pd.DataFrame(rows, columns=[*by, "count", *[f"p{q * 100:g}" for q in quantiles]])
@@ -0,0 +1,205 @@
+import math
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from fetch_engine import DEFAULT_MAX_WORKERS, DEFAULT_TIMEOUT, FetchJob, auto_step, fetch_all, step_to_seconds
+from latency_sketches import HISTOGRAM_METRICS, store_histogram_sketches
+from metrics_decoder import decode_result
+from promql import PromQLError, analyze_query
+from query_planner import split_result
+from run_store import RunStore
+from utils import get_current_utc_timestamp
+
+# Poll at the Prometheus scrape interval, and stay one interval behind "now" so the
+# newest sample has actually been scraped before we ask for it
+LIVE_POLL_INTERVAL = 15
+LIVE_QUERY_LAG = 15
+
+# Metrics shown in the rolling per-service summary printed after every poll
+LIVE_SUMMARY_METRICS = ("cpu_usage_per_pod", "http_request_latency_95th", "http_5xx_error_rate")
+
+
+def error_rate_abort(max_5xx_rate=5.0, metric_name="http_5xx_error_rate"):
+    """
+    Returns an abort check for LiveCollector that stops the run once any service's latest
+    5xx error rate (in percent) goes above max_5xx_rate.
+    """
+    def should_abort(summary):
+        for service, metrics in summary.items():
+            latest = metrics.get(metric_name, {}).get("last")
+            if latest is not None and latest > max_5xx_rate:
+                return f"{service} 5xx error rate {latest:.1f}% > {max_5xx_rate}%"
+        return None
+    return should_abort
+
+
+def align_to_step(time, step_seconds):
+    """
+    Snaps a datetime down onto the step grid (multiples of step since the epoch), like
+    query_cache.align_window does, so live windows evaluate at the same timestamps as a
+    regular fetch of the run with that step.
+    """
+    return datetime.fromtimestamp(math.floor(time.timestamp() / step_seconds) * step_seconds)
+
+
+class LiveCollector:
+    """
+    Polls Prometheus while the load generator is running and appends each new window of
+    samples to the run store, so the data is complete as soon as the load ends. Each query
+    is evaluated at its catalog step, with one cursor per step: a query with a 60s step is
+    only fetched once a whole new minute is available.
+    """
+
+    def __init__(self, prom, planned_queries, run_store: RunStore, run_id, start_time,
+                 poll_interval=LIVE_POLL_INTERVAL, lag=LIVE_QUERY_LAG,
+                 max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT, abort_if=None):
+        """
+        :param prom: PrometheusConnect object.
+        :param planned_queries: Output of query_catalog.compile_catalog (or query_planner.plan_queries).
+        :param run_store: Store the samples are appended to.
+        :param run_id: Run the samples belong to.
+        :param start_time: Start of the first window to collect.
+        :param poll_interval: Seconds between polls; also the step of queries without a catalog
+            step (rounded up to a step auto_step would pick).
+        :param lag: Seconds to stay behind the current time.
+        :param abort_if: Optional callable taking rolling_summary() and returning a reason
+            string to abort the run, or None to continue.
+        """
+        self.prom = prom
+        self.planned_queries = planned_queries
+        self.run_store = run_store
+        self.run_id = run_id
+        self.poll_interval = poll_interval
+        self.lag = lag
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.abort_if = abort_if
+        self.abort_reason = None
+        default_step = auto_step(start_time, start_time, min_step=f"{poll_interval}s")
+        # Only queries returning instant vectors can be polled window by window; they are
+        # grouped by step, each group with its own cursor on that step's grid
+        self.step_indexes = {}
+        for index, planned in enumerate(planned_queries):
+            try:
+                if analyze_query(planned.query).range_query:
+                    self.step_indexes.setdefault(planned.step or default_step, []).append(index)
+                    continue
+                reason = "it can't be fetched as a range query"
+            except PromQLError as e:
+                reason = str(e)
+            print(f"Not collecting {', '.join(planned.metric_names)} live: {reason}", flush=True)
+        self.cursors = {step: align_to_step(start_time, step_to_seconds(step)) for step in self.step_indexes}
+        # (service, metric) -> [last value, running sum, running count]
+        self._rolling = {}
+
+    def poll(self, until=None):
+        """
+        Fetches every query for the window from its step's cursor up to `until` (default:
+        now - lag) and appends the samples to the store.
+
+        :return: Number of samples stored.
+        """
+        until = until or datetime.now() - timedelta(seconds=self.lag)
+        stored = 0
+        for step, indexes in self.step_indexes.items():
+            stored += self._poll_step(step, indexes, until)
+        return stored
+
+    def _poll_step(self, step, indexes, until):
+        step_seconds = step_to_seconds(step)
+        step_delta = timedelta(seconds=step_seconds)
+        cursor = self.cursors[step]
+        # Only whole steps, so consecutive windows never return the same evaluation timestamp
+        steps = math.floor((until - cursor) / step_delta)
+        if steps < 0:
+            return 0
+        window_end = cursor + steps * step_delta
+
+        jobs = [FetchJob(key=(index,), query=self.planned_queries[index].query, range_query=True, step=step)
+                for index in indexes]
+        stored = 0
+        for job, result, msg in fetch_all(self.prom, jobs, cursor, window_end,
+                                          max_workers=self.max_workers, timeout=self.timeout):
+            if result is None:
+                print(f"Live fetch failed for {', '.join(self.planned_queries[job.key[0]].metric_names)}: {msg}",
+                      flush=True)
+                continue
+            for service, metric_name, series in split_result(self.planned_queries[job.key[0]], result):
+                metrics_df = decode_result(series)
+                if metrics_df.empty:
+                    continue
+                if metric_name in HISTOGRAM_METRICS:
+                    store_histogram_sketches(self.run_store, self.run_id, service, metric_name, metrics_df,
+                                             step_seconds)
+                    continue
+                self.run_store.append(self.run_id, service, metric_name, metrics_df)
+                self._update_rolling(service, metric_name, metrics_df)
+                stored += len(metrics_df)
+        self.cursors[step] = window_end + step_delta
+        return stored
+
+    def _update_rolling(self, service, metric_name, metrics_df):
+        if metric_name not in LIVE_SUMMARY_METRICS:
+            return
+        values = metrics_df["value"].to_numpy()
+        finite = values[np.isfinite(values)]
+        if not finite.size:
+            return
+        # Latest value averaged over the service's pods
+        latest_time = metrics_df["timestamp"].max()
+        latest = metrics_df.loc[metrics_df["timestamp"] == latest_time, "value"].mean()
+        state = self._rolling.setdefault((service, metric_name), [None, 0.0, 0])
+        state[0] = float(latest)
+        state[1] += float(finite.sum())
+        state[2] += int(finite.size)
+
+    def rolling_summary(self):
+        """
+        Returns {service: {metric: {"last": ..., "mean": ...}}} for LIVE_SUMMARY_METRICS.
+        """
+        summary = {}
+        for (service, metric_name), (last, total, count) in sorted(self._rolling.items()):
+            summary.setdefault(service, {})[metric_name] = {"last": last, "mean": total / count if count else None}
+        return summary
+
+    def print_summary(self):
+        print(f"[{get_current_utc_timestamp()}] Live summary (last / run mean):", flush=True)
+        for service, metrics in self.rolling_summary().items():
+            parts = [f"{metric_name}={values['last']:.4g}/{values['mean']:.4g}" for metric_name, values in metrics.items()]
+            print(f"  {service}: {', '.join(parts)}", flush=True)
+
+    def run(self, process, end_padding=0):
+        """
+        Polls until `process` (the running wrk2 Popen) exits, aborting it early if abort_if
+        fires or on Ctrl-C, then collects the tail of the window.
+
+        :param process: subprocess.Popen of the load generator.
+        :param end_padding: Extra seconds after the load ends to include in the final poll.
+        :return: The abort reason, or None if the run completed.
+        """
+        try:
+            while process.poll() is None:
+                time.sleep(self.poll_interval)
+                stored = self.poll()
+                print(f"[{get_current_utc_timestamp()}] Stored {stored} live samples", flush=True)
+                self.print_summary()
+                reason = self.abort_if(self.rolling_summary()) if self.abort_if else None
+                if reason:
+                    self.abort_reason = reason
+                    print(f"Aborting run: {reason}", flush=True)
+                    process.terminate()
+                    break
+        except KeyboardInterrupt:
+            self.abort_reason = "interrupted"
+            print("Interrupted, stopping load generator...", flush=True)
+            process.terminate()
+        process.wait()
+
+        # Wait out the scrape lag once, then fetch everything up to the end of the load (+ padding)
+        end_time = datetime.now() + timedelta(seconds=end_padding)
+        time.sleep(self.lag + end_padding)
+        self.poll(until=end_time)
+        self.run_store.compact(self.run_id)
+        return self.abort_reason
@@ -0,0 +1,83 @@
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from tzlocal import get_localzone_name
+
+TIMESTAMP_COLUMN = "timestamp"
+VALUE_COLUMN = "value"
+# Series name label, set on selected (e.g. recorded) series but not on computed ones; the
+# store keeps the metric name separately, so it isn't decoded as a label
+NAME_LABEL = "__name__"
+
+
+def _series_samples(series):
+    # Range queries carry a "values" list, instant queries a single "value" pair
+    if "values" in series:
+        return series["values"]
+    if "value" in series:
+        return [series["value"]]
+    return []
+
+
+def decode_result(result, local_time=True):
+    """
+    Decodes a Prometheus query result into a long-format DataFrame in one pass.
+
+    Samples from all series are converted straight into NumPy arrays (int64 epoch
+    milliseconds and float64 values) and every label of the originating series is kept
+    as a categorical column, so samples from different pods stay distinguishable.
+
+    Columns: one per label (e.g. "pod"; __name__ is left out), then "timestamp" and "value".
+
+    :param result: The "result" list of a Prometheus query or query_range response.
+    :param local_time: Convert timestamps to naive local time, matching the CSVs written
+        before this decoder existed. Naive UTC otherwise.
+    :return: A DataFrame, empty if the result holds no samples.
+    """
+    result = result or []
+    samples_per_series = [_series_samples(series) for series in result]
+    lengths = np.fromiter((len(samples) for samples in samples_per_series), dtype=np.int64, count=len(result))
+    if not lengths.sum():
+        return pd.DataFrame(columns=[TIMESTAMP_COLUMN, VALUE_COLUMN])
+
+    timestamps, values = zip(*chain.from_iterable(samples_per_series))
+    timestamps_ms = np.rint(np.array(timestamps, dtype=np.float64) * 1000).astype(np.int64)
+    # NumPy parses Prometheus' string values ("0.5", "NaN", "+Inf") directly
+    values = np.array(values, dtype=np.float64)
+
+    return long_frame([series.get("metric", {}) for series in result], lengths, timestamps_ms, values, local_time)
+
+
+def long_frame(label_sets, lengths, timestamps_ms, values, local_time=True):
+    """
+    Builds the long-format DataFrame of decode_result from already flattened samples, e.g.
+    ones decoded from a remote-read response.
+
+    :param label_sets: Label dict of every series.
+    :param lengths: Number of samples of every series, in the same order.
+    :param timestamps_ms: int64 epoch milliseconds of all samples, series after series.
+    :param values: float64 values of all samples.
+    """
+    columns = {}
+    label_names = sorted({name for labels in label_sets for name in labels if name != NAME_LABEL})
+    for name in label_names:
+        categories, codes = np.unique(
+            np.array([labels.get(name, "") for labels in label_sets], dtype=object),
+            return_inverse=True,
+        )
+        columns[name] = pd.Categorical.from_codes(np.repeat(codes, lengths), categories=categories)
+
+    timestamps = pd.to_datetime(timestamps_ms, unit="ms")
+    if local_time:
+        timestamps = timestamps.tz_localize("UTC").tz_convert(get_localzone_name()).tz_localize(None)
+    columns[TIMESTAMP_COLUMN] = timestamps
+    columns[VALUE_COLUMN] = values
+    return pd.DataFrame(columns)
+
+
+def label_columns(metrics_df):
+    """
+    Returns the label columns of a decoded DataFrame, i.e. everything but timestamp and value.
+    """
+    return [column for column in metrics_df.columns if column not in (TIMESTAMP_COLUMN, VALUE_COLUMN)]
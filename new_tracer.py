@@ -1,17 +1,17 @@
 import os
 import json
-import requests
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime, timedelta
-from prometheus_api_client import PrometheusConnect
+
+from http_client import get_client
+from metrics_decoder import decode_result
 
 def connect_to_prometheus():
     """
     Connect to the Prometheus server.
     """
-    prom = PrometheusConnect(url="http://localhost:9090", disable_ssl=True)
+    prom = get_client().prometheus("http://localhost:9090", disable_ssl=True)
     if prom.check_prometheus_connection():
         print("Connected to Prometheus.")
     else:
@@ -39,7 +39,7 @@ def fetch_metrics(prom, query, start_time, end_time):
 
 def process_metrics(metrics, msg):
     """
-    Process raw metrics data into a DataFrame.
+    Process raw metrics data into a long-format DataFrame, keeping series labels as columns.
     :param metrics: Raw metrics data from Prometheus.
     :param msg: Message indicating the status of the fetch.
     :return: Processed DataFrame.
@@ -48,16 +48,7 @@ def process_metrics(metrics, msg):
         print(f"No data returned: {msg}")
         return None
 
-    df_list = []
-    for metric in metrics:
-        values = metric["values"]
-        for value in values:
-            df_list.append({
-                "timestamp": datetime.fromtimestamp(float(value[0])),
-                "value": float(value[1])
-            })
-
-    metrics_df = pd.DataFrame(df_list)
+    metrics_df = decode_result(metrics)
     return metrics_df
 
 def save_wrk2_outputs():
@@ -151,7 +142,7 @@ def get_jaeger_network_map(jaeger_url):
     :param jaeger_url: URL of the Jaeger server.
     :return: Network map JSON.
     """
-    response = requests.get(f"{jaeger_url}/api/dependencies?lookback=1h")
+    response = get_client().get(f"{jaeger_url}/api/dependencies", params={"lookback": "1h"})
     if response.status_code == 200:
         return response.json()
     else:
@@ -54,54 +54,78 @@
 
 # -----------
 
-def build_query(service_name):
-    return f'count(kube_pod_info{{pod=~"{service_name}.*", namespace="socialnetwork"}})'
+from query_catalog import QueryParam, QueryTemplate
 
-PROMETHEUS_QUERIES = {
+NAMESPACE = QueryParam("label", "socialnetwork")
+# Range window of the rate() and *_over_time() calls
+WINDOW = QueryParam("duration", "5m")
+SHORT_WINDOW = QueryParam("duration", "2m")
+
+# record=True marks the costliest queries to evaluate from raw data on every fetch (ratios of
+# rates, quantiles, regex unions over all services); see recording_rules.py
+QUERY_CATALOG = [
     # HTTP Request Success Rate per Pod
-    "http_request_success_rate": r'sum(rate(http_requests_total{status!~"5.."}[5m])) by (pod) / sum(rate(http_requests_total[5m])) by (pod) * 100',
+    QueryTemplate("http_request_success_rate",
+                  r'sum(rate(http_requests_total{status!~"5.."}[$window])) by (pod) / sum(rate(http_requests_total[$window])) by (pod) * 100',
+                  params={"window": WINDOW}, record=True),
 
     # Total HTTP Requests per Pod
-    "total_http_requests": r'sum(rate(http_requests_total[5m])) by (pod)',
+    QueryTemplate("total_http_requests", r'sum(rate(http_requests_total[$window])) by (pod)',
+                  params={"window": WINDOW}, priority=0),
 
     # HTTP 2xx Success Rate per Pod
-    "http_2xx_success_rate": r'sum(rate(http_requests_total{status=~"2.."}[5m])) by (pod) / sum(rate(http_requests_total[5m])) by (pod) * 100',
+    QueryTemplate("http_2xx_success_rate",
+                  r'sum(rate(http_requests_total{status=~"2.."}[$window])) by (pod) / sum(rate(http_requests_total[$window])) by (pod) * 100',
+                  params={"window": WINDOW}, priority=2, record=True),
 
     # HTTP 4xx Client Errors Rate per Pod
-    "http_4xx_error_rate": r'sum(rate(http_requests_total{status=~"4.."}[5m])) by (pod) / sum(rate(http_requests_total[5m])) by (pod) * 100',
+    QueryTemplate("http_4xx_error_rate",
+                  r'sum(rate(http_requests_total{status=~"4.."}[$window])) by (pod) / sum(rate(http_requests_total[$window])) by (pod) * 100',
+                  params={"window": WINDOW}, priority=2, record=True),
 
     # HTTP 5xx Server Errors Rate per Pod
-    "http_5xx_error_rate": r'sum(rate(http_requests_total{status=~"5.."}[5m])) by (pod) / sum(rate(http_requests_total[5m])) by (pod) * 100',
+    QueryTemplate("http_5xx_error_rate",
+                  r'sum(rate(http_requests_total{status=~"5.."}[$window])) by (pod) / sum(rate(http_requests_total[$window])) by (pod) * 100',
+                  params={"window": WINDOW}, priority=0, record=True),
 
     # 95th Percentile HTTP Request Latency per Pod
-    "http_request_latency_95th": r'histogram_quantile(0.95, sum(rate(http_request_duration_seconds_bucket[5m])) by (le, pod))',
+    QueryTemplate("http_request_latency_95th",
+                  r'histogram_quantile(0.95, sum(rate(http_request_duration_seconds_bucket[$window])) by (le, pod))',
+                  params={"window": WINDOW}, priority=0, record=True),
+
+    # Raw HTTP Request Latency Histogram per Pod (stored as mergeable sketches, see latency_sketches.py)
+    QueryTemplate("http_request_duration_bucket", r'sum(rate(http_request_duration_seconds_bucket[$window])) by (le, pod)',
+                  params={"window": SHORT_WINDOW}, priority=0),
 
     # CPU Usage per Pod
-    "cpu_usage_per_pod": r'sum(rate(container_cpu_usage_seconds_total[5m])) by (pod)',
+    QueryTemplate("cpu_usage_per_pod", r'sum(rate(container_cpu_usage_seconds_total[$window])) by (pod)',
+                  params={"window": WINDOW}, priority=0),
 
     # Memory Usage per Pod
-    "memory_usage_per_pod": r'avg_over_time(container_memory_usage_bytes[5m]) by (pod)',
+    QueryTemplate("memory_usage_per_pod", r'sum(avg_over_time(container_memory_usage_bytes[$window])) by (pod)',
+                  params={"window": WINDOW}),
+
     # Network Traffic Received per Pod
-    "network_receive": r'sum(rate(container_network_receive_bytes_total[5m])) by (pod)',
+    QueryTemplate("network_receive", r'sum(rate(container_network_receive_bytes_total[$window])) by (pod)',
+                  params={"window": WINDOW}),
 
     # Network Traffic Transmitted per Pod
-    "network_transmit": r'sum(rate(container_network_transmit_bytes_total[5m])) by (pod)',
+    QueryTemplate("network_transmit", r'sum(rate(container_network_transmit_bytes_total[$window])) by (pod)',
+                  params={"window": WINDOW}),
 
-    # CPU Consumption by Service
-    "cpu_consumption_compose": r'sum by (service) (rate(container_cpu_usage_seconds_total{namespace="socialnetwork", container=~"compose.*"}[2m]))',
-    "cpu_consumption_nginx": r'sum by (service) (rate(container_cpu_usage_seconds_total{namespace="socialnetwork", container=~"nginx.*"}[2m]))',
-    "cpu_consumption_text": r'sum by (service) (rate(container_cpu_usage_seconds_total{namespace="socialnetwork", container=~"text.*"}[2m]))',
-    "cpu_consumption_user_mention": r'sum by (service) (rate(container_cpu_usage_seconds_total{namespace="socialnetwork", container=~"user-mention.*"}[2m]))',
+    # CPU Consumption per Service (containers named after the service), one query for all services
+    QueryTemplate("cpu_consumption",
+                  r'sum by (service) (label_replace(rate(container_cpu_usage_seconds_total{namespace="$namespace", container=~"$services.*"}[$window]), "service", "$$1", "container", "$services.*"))',
+                  scope="service", params={"namespace": NAMESPACE, "window": SHORT_WINDOW}, priority=2, retention_days=30, record=True),
 
     # CPU Utilization per Service (using Requests instead of Limits)
-    "cpu_utilization_compose": r'sum(rate(container_cpu_usage_seconds_total{namespace="socialnetwork", container=~"compose.*"}[2m])) / sum(kube_pod_container_resource_requests{resource="cpu", namespace="socialnetwork", container=~"compose.*"}) * 100',
-    "cpu_utilization_nginx": r'sum(rate(container_cpu_usage_seconds_total{namespace="socialnetwork", container=~"nginx.*"}[2m])) / sum(kube_pod_container_resource_requests{resource="cpu", namespace="socialnetwork", container=~"nginx.*"}) * 100',
-    "cpu_utilization_text": r'sum(rate(container_cpu_usage_seconds_total{namespace="socialnetwork", container=~"text-service.*"}[2m])) / sum(kube_pod_container_resource_requests{resource="cpu", namespace="socialnetwork", container=~"text-service.*"}) * 100',
-    "cpu_utilization_user_mention": r'sum(rate(container_cpu_usage_seconds_total{namespace="socialnetwork", container=~"user-mention.*"}[2m])) / sum(kube_pod_container_resource_requests{resource="cpu", namespace="socialnetwork", container=~"user-mention.*"}) * 100',
-
-    # Replicas per Service
-    "replicas_compose": build_query("compose"),
-    "replicas_nginx": build_query("nginx"),
-    "replicas_text": build_query("text-service"),
-    "replicas_user_mention": build_query("user-mention")
-}
+    QueryTemplate("cpu_utilization",
+                  r'sum by (service) (label_replace(rate(container_cpu_usage_seconds_total{namespace="$namespace", container=~"$services.*"}[$window]), "service", "$$1", "container", "$services.*"))'
+                  r' / sum by (service) (label_replace(kube_pod_container_resource_requests{resource="cpu", namespace="$namespace", container=~"$services.*"}, "service", "$$1", "container", "$services.*")) * 100',
+                  scope="service", params={"namespace": NAMESPACE, "window": SHORT_WINDOW}, priority=1, retention_days=30, record=True),
+
+    # Replicas per Service; pod counts change rarely, so a coarse step is enough
+    QueryTemplate("replicas",
+                  r'count by (service) (label_replace(kube_pod_info{namespace="$namespace", pod=~"$services-.*"}, "service", "$$1", "pod", "$services-.*"))',
+                  scope="service", params={"namespace": NAMESPACE}, step="60s", priority=2, retention_days=30),
+]
@@ -0,0 +1,428 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+from fetch_engine import auto_step
+
+# Prometheus' default scrape interval here; rate() windows shorter than two scrapes are flagged
+SCRAPE_INTERVAL_SECONDS = 15
+
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+_DURATION = re.compile(r"(?:\d+(?:ms|s|m|h|d|w|y))+")
+_DURATION_PART = re.compile(r"(\d+)(ms|s|m|h|d|w|y)")
+_TOKEN = re.compile(r"""
+    (?P<space>\s+|\#[^\n]*)
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`[^`]*`)
+  | (?P<ident>[a-zA-Z_:][a-zA-Z0-9_:]*)
+  | (?P<op>=~|!~|==|!=|<=|>=|[-+*/%^<>=(){}\[\],:@])
+""", re.VERBOSE)
+
+AGGREGATIONS = {
+    # name: type of the leading parameter, if any
+    "sum": None, "avg": None, "min": None, "max": None, "count": None, "group": None,
+    "stddev": None, "stdvar": None, "topk": "scalar", "bottomk": "scalar", "quantile": "scalar",
+    "count_values": "string", "limitk": "scalar", "limit_ratio": "scalar",
+}
+# name: (argument types, number of required arguments, return type); "*" repeats the last type
+FUNCTIONS = {
+    **{name: (("matrix",), 1, "vector") for name in (
+        "rate", "irate", "increase", "delta", "idelta", "deriv", "changes", "resets",
+        "avg_over_time", "min_over_time", "max_over_time", "sum_over_time", "count_over_time",
+        "stddev_over_time", "stdvar_over_time", "last_over_time", "present_over_time",
+        "absent_over_time", "mad_over_time",
+    )},
+    "quantile_over_time": (("scalar", "matrix"), 2, "vector"),
+    "predict_linear": (("matrix", "scalar"), 2, "vector"),
+    "holt_winters": (("matrix", "scalar", "scalar"), 3, "vector"),
+    **{name: (("vector",), 1, "vector") for name in (
+        "abs", "ceil", "floor", "exp", "ln", "log2", "log10", "sqrt", "sgn", "absent",
+        "sort", "sort_desc", "timestamp",
+    )},
+    **{name: (("vector",), 0, "vector") for name in (
+        "day_of_month", "day_of_week", "day_of_year", "days_in_month", "hour", "minute", "month", "year",
+    )},
+    "round": (("vector", "scalar"), 1, "vector"),
+    "clamp": (("vector", "scalar", "scalar"), 3, "vector"),
+    "clamp_min": (("vector", "scalar"), 2, "vector"),
+    "clamp_max": (("vector", "scalar"), 2, "vector"),
+    "histogram_quantile": (("scalar", "vector"), 2, "vector"),
+    "label_replace": (("vector", "string", "string", "string", "string"), 5, "vector"),
+    "label_join": (("vector", "string", "string", "string", "*"), 3, "vector"),
+    "scalar": (("vector",), 1, "scalar"),
+    "vector": (("scalar",), 1, "vector"),
+    "time": ((), 0, "scalar"),
+    "pi": ((), 0, "scalar"),
+}
+# Functions that need at least two samples in their window
+RATE_FUNCTIONS = ("rate", "irate", "increase", "delta", "idelta", "deriv")
+
+# Binary operators by precedence, loosest first; "^" is right-associative
+BINARY_PRECEDENCE = [("or",), ("and", "unless"), ("==", "!=", "<=", "<", ">=", ">"), ("+", "-"), ("*", "/", "%", "atan2"), ("^",)]
+SET_OPERATORS = ("and", "or", "unless")
+COMPARISON_OPERATORS = ("==", "!=", "<=", "<", ">=", ">")
+_TYPE_NAMES = {"scalar": "a scalar", "vector": "an instant vector", "matrix": "a range vector", "string": "a string"}
+
+
+class PromQLError(ValueError):
+    pass
+
+
+def parse_duration(text):
+    """
+    Converts a Prometheus duration such as "5m", "1h30m" or "500ms" to seconds.
+    """
+    if not _DURATION.fullmatch(text):
+        raise PromQLError(f"Invalid duration '{text}'.")
+    return sum(int(amount) * DURATION_UNITS[unit] for amount, unit in _DURATION_PART.findall(text))
+
+
+@dataclass(frozen=True)
+class QueryInfo:
+    """
+    What a PromQL query does, from parsing it once: the series it selects, its range
+    windows, functions and aggregations, its result type and how it should be fetched.
+    Immutable, since analyze_query hands the same instance to every caller.
+    """
+    query: str
+    result_type: str = "vector"
+    # Number of series selectors, with or without a metric name
+    selectors: int = 0
+    # Metric name of every selector that has one
+    metrics: tuple = ()
+    # (metric, label, operator, value) per label matcher
+    matchers: tuple = ()
+    # Window of every range selector and subquery, in seconds
+    range_selectors: tuple = ()
+    functions: tuple = ()
+    # (operator, "by"/"without"/None, labels) per aggregation, outermost last
+    aggregations: tuple = ()
+    warnings: tuple = ()
+
+    @property
+    def range_query(self):
+        """
+        Whether the query is fetched over the whole window with /api/v1/query_range. Gauges
+        are too: one instant sample at the end of a load test says little, and so are
+        selector-free expressions such as vector(1) or time(). Only range-vector results
+        (which query_range rejects) and plain literals are evaluated once with /api/v1/query.
+        """
+        return self.result_type in ("vector", "scalar") and bool(self.selectors or self.functions)
+
+    @property
+    def max_step(self):
+        """
+        Largest step that doesn't skip samples: the shortest range window, if any.
+        """
+        return min(self.range_selectors) if self.range_selectors else None
+
+    @property
+    def grouping(self):
+        """
+        Labels the result series keep, from the outermost "by" aggregation, or None if unknown.
+        """
+        if self.aggregations and self.aggregations[-1][1] == "by":
+            return self.aggregations[-1][2]
+        return None
+
+    def step_for(self, start_time, end_time):
+        """
+        Range query step for a window: auto_step's choice, but no wider than max_step.
+        """
+        return auto_step(start_time, end_time, max_step=self.max_step)
+
+
+class _Parser:
+    def __init__(self, query):
+        self.query = query
+        self.tokens = self._tokenize(query)
+        self.position = 0
+        self.selectors = 0
+        self.metrics, self.matchers, self.range_selectors = [], [], []
+        self.functions, self.aggregations, self.warnings = [], [], []
+
+    @staticmethod
+    def _tokenize(query):
+        tokens = []
+        index = 0
+        while index < len(query):
+            match = _TOKEN.match(query, index)
+            if not match:
+                raise PromQLError(f"Unexpected character '{query[index]}' at position {index}.")
+            if match.lastgroup != "space":
+                tokens.append((match.lastgroup, match.group(), index))
+            index = match.end()
+        tokens.append(("end", "", len(query)))
+        return tokens
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)]
+
+    def next(self):
+        token = self.tokens[self.position]
+        self.position = min(self.position + 1, len(self.tokens) - 1)
+        return token
+
+    def error(self, message, token=None):
+        token = token or self.peek()
+        return PromQLError(f"{message} at position {token[2]}" + (f" ('{token[1]}')." if token[1] else " (end of query)."))
+
+    def expect(self, value):
+        token = self.next()
+        if token[1] != value:
+            raise self.error(f"Expected '{value}'", token)
+        return token
+
+    def accept(self, value):
+        if self.peek()[1] == value and self.peek()[0] in ("op", "ident"):
+            return self.next()
+        return None
+
+    def parse(self):
+        result_type = self.expression(0)
+        if self.peek()[0] != "end":
+            raise self.error("Unexpected token")
+        return QueryInfo(
+            self.query, "vector" if result_type == "selector" else result_type, self.selectors,
+            tuple(self.metrics), tuple(self.matchers), tuple(self.range_selectors), tuple(self.functions),
+            tuple(self.aggregations), tuple(self.warnings),
+        )
+
+    def expression(self, level):
+        if level == len(BINARY_PRECEDENCE):
+            return self.unary()
+        left = self.expression(level + 1)
+        while self.peek()[1] in BINARY_PRECEDENCE[level] and self.peek()[0] in ("op", "ident"):
+            operator = self.next()[1]
+            self.binary_modifiers(operator)
+            # "^" binds right to left
+            right = self.expression(level if operator == "^" else level + 1)
+            left = self.binary_type(operator, left, right)
+        return left
+
+    def binary_modifiers(self, operator):
+        if self.accept("bool") and operator not in COMPARISON_OPERATORS:
+            raise self.error("'bool' is only allowed on comparisons")
+        if self.accept("on") or self.accept("ignoring"):
+            self.label_list()
+            if self.accept("group_left") or self.accept("group_right"):
+                if self.peek()[1] == "(":
+                    self.label_list()
+
+    def binary_type(self, operator, left, right):
+        for operand in (left, right):
+            if operand in ("matrix", "string"):
+                raise self.error(f"Binary operator '{operator}' can't take {_TYPE_NAMES[operand]}")
+        if operator in SET_OPERATORS and "scalar" in (left, right):
+            raise self.error(f"Set operator '{operator}' needs vectors on both sides")
+        return "scalar" if left == right == "scalar" else "vector"
+
+    def unary(self):
+        if self.peek()[1] in ("+", "-") and self.peek()[0] == "op":
+            self.next()
+            operand = self.as_instant(self.unary())
+            if operand not in ("scalar", "vector"):
+                raise self.error("Unary operators need a scalar or vector")
+            return operand
+        return self.postfix(self.primary())
+
+    def postfix(self, value_type):
+        while True:
+            if self.peek()[1] == "[":
+                value_type = self.range_or_subquery(value_type)
+            elif self.peek()[1] == "offset":
+                self.next()
+                negative = bool(self.accept("-"))
+                self.duration(allow_negative=negative)
+            elif self.peek()[1] == "@":
+                self.next()
+                token = self.next()
+                if token[0] != "number" and token[1] not in ("start", "end"):
+                    raise self.error("Expected a timestamp, start() or end() after '@'", token)
+                if token[0] == "ident":
+                    self.expect("(")
+                    self.expect(")")
+            elif self.peek()[1] in ("by", "without"):
+                raise self.error(f"'{self.peek()[1]}' is only allowed on aggregations (sum, avg, count, ...)")
+            else:
+                return value_type
+
+    def range_or_subquery(self, value_type):
+        opening = self.expect("[")
+        # Read "[range]" / "[range:step]" from the text: identifiers may contain ":", so the
+        # tokens would run a subquery's range and step together
+        closing = self.query.find("]", opening[2])
+        if closing < 0:
+            raise self.error("Expected ']'")
+        window, colon, step = self.query[opening[2] + 1:closing].partition(":")
+        try:
+            self.range_selectors.append(parse_duration(window.strip()))
+            if step.strip():
+                parse_duration(step.strip())
+        except PromQLError as e:
+            raise self.error(str(e).rstrip("."), opening)
+        if colon and value_type not in ("vector", "selector"):
+            raise self.error("Subqueries need an instant vector", opening)
+        if not colon and value_type != "selector":
+            raise self.error("Range selectors need a plain series selector; use a subquery ([range:step])", opening)
+        while self.peek()[2] < closing:
+            self.next()
+        self.expect("]")
+        return "matrix"
+
+    def duration(self, allow_negative=False):
+        # Durations are split into a number and an identifier by the tokenizer ("5m" -> "5", "m")
+        text = ""
+        while self.peek()[0] in ("number", "ident") and (not text or self.peek()[2] == self._end_of_previous()):
+            text += self.next()[1]
+        if not text:
+            raise self.error("Expected a duration")
+        return parse_duration(text)
+
+    def _end_of_previous(self):
+        kind, value, start = self.tokens[self.position - 1]
+        return start + len(value)
+
+    def primary(self):
+        kind, value, _ = token = self.peek()
+        if kind == "number":
+            self.next()
+            return "scalar"
+        if kind == "string":
+            self.next()
+            return "string"
+        if value == "(":
+            self.next()
+            inner = self.expression(0)
+            self.expect(")")
+            return "vector" if inner == "selector" else inner
+        if value == "{":
+            return self.selector(None)
+        if kind == "ident":
+            if value.lower() in ("inf", "nan"):
+                self.next()
+                return "scalar"
+            if value in AGGREGATIONS:
+                return self.aggregation()
+            if self.peek(1)[1] == "(":
+                return self.function()
+            if value in ("by", "without") and self.peek(1)[1] == "(":
+                raise self.error("Grouping without an aggregation")
+            return self.selector(self.next()[1])
+        raise self.error("Unexpected token", token)
+
+    def label_list(self):
+        self.expect("(")
+        labels = []
+        while self.peek()[1] != ")":
+            token = self.next()
+            if token[0] != "ident":
+                raise self.error("Expected a label name", token)
+            labels.append(token[1])
+            if not self.accept(","):
+                break
+        self.expect(")")
+        return labels
+
+    def aggregation(self):
+        operator = self.next()[1]
+        grouping, labels = None, []
+        if self.peek()[1] in ("by", "without"):
+            grouping = self.next()[1]
+            labels = self.label_list()
+        self.expect("(")
+        parameter = AGGREGATIONS[operator]
+        if parameter:
+            if self.expression(0) != parameter:
+                raise self.error(f"'{operator}' needs a {parameter} parameter first")
+            self.expect(",")
+        if self.as_instant(self.expression(0)) != "vector":
+            raise self.error(f"'{operator}' needs an instant vector")
+        self.expect(")")
+        if self.peek()[1] in ("by", "without"):
+            if grouping:
+                raise self.error(f"'{operator}' is grouped twice")
+            grouping = self.next()[1]
+            labels = self.label_list()
+        self.aggregations.append((operator, grouping, tuple(labels)))
+        return "vector"
+
+    def function(self):
+        name_token = self.next()
+        name = name_token[1]
+        if name not in FUNCTIONS:
+            raise self.error(f"Unknown function '{name}'", name_token)
+        argument_types, required, return_type = FUNCTIONS[name]
+        self.expect("(")
+        arguments = []
+        while self.peek()[1] != ")":
+            arguments.append(self.as_instant(self.expression(0)))
+            if not self.accept(","):
+                break
+        self.expect(")")
+        variadic = argument_types and argument_types[-1] == "*"
+        if len(arguments) < required or (not variadic and len(arguments) > len(argument_types)):
+            raise self.error(f"'{name}' takes {required if required == len(argument_types) else f'{required} to {len(argument_types)}'} arguments, got {len(arguments)}", name_token)
+        for index, argument in enumerate(arguments):
+            expected = argument_types[min(index, len(argument_types) - 1)]
+            expected = argument_types[-2] if expected == "*" else expected
+            if argument != expected:
+                raise self.error(f"Argument {index + 1} of '{name}' must be {_TYPE_NAMES[expected]}, "
+                                 f"got {_TYPE_NAMES[argument]}", name_token)
+        self.functions.append(name)
+        if name in RATE_FUNCTIONS and self.range_selectors and self.range_selectors[-1] < 2 * SCRAPE_INTERVAL_SECONDS:
+            self.warnings.append(f"{name}() over {self.range_selectors[-1]:g}s sees fewer than two "
+                                      f"samples at a {SCRAPE_INTERVAL_SECONDS}s scrape interval")
+        return return_type
+
+    @staticmethod
+    def as_instant(value_type):
+        # A plain selector is an instant vector unless a range follows it
+        return "vector" if value_type == "selector" else value_type
+
+    def selector(self, metric):
+        self.selectors += 1
+        if metric is not None:
+            self.metrics.append(metric)
+        if self.accept("{"):
+            while self.peek()[1] != "}":
+                label = self.next()
+                if label[0] != "ident":
+                    raise self.error("Expected a label name", label)
+                operator = self.next()
+                if operator[1] not in ("=", "!=", "=~", "!~"):
+                    raise self.error("Expected a label matcher operator", operator)
+                value = self.next()
+                if value[0] != "string":
+                    raise self.error("Expected a quoted label value", value)
+                text = _unquote(value[1])
+                if operator[1] in ("=~", "!~"):
+                    try:
+                        re.compile(text)
+                    except re.error as e:
+                        raise self.error(f"Invalid regex in matcher ({e})", value)
+                self.matchers.append((metric, label[1], operator[1], text))
+                if not self.accept(","):
+                    break
+            self.expect("}")
+        elif metric is None:
+            raise self.error("Expected a selector")
+        return "selector"
+
+
+
+def _unquote(text):
+    if text[0] == "`":
+        return text[1:-1]
+    return re.sub(r"\\(.)", r"\1", text[1:-1])
+
+
+@lru_cache(maxsize=1024)
+def analyze_query(query):
+    """
+    Parses a PromQL query and returns its QueryInfo. Results are cached, so each distinct
+    query is parsed once however often it is fetched.
+
+    :raises PromQLError: If the query is not valid PromQL.
+    """
+    return _Parser(query).parse()
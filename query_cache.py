@@ -0,0 +1,330 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fetch_engine import step_to_seconds
+
+QUERY_CACHE_DIR = "data/query_cache"
+# Windows ending less than this long ago may still change (scrape lag, [5m] rate windows)...
+OPEN_TAIL_SECONDS = 300
+# ...so they are only cached for this long; anything older is cached permanently
+OPEN_TAIL_TTL = 60
+# Samples kept in memory over all cached queries (roughly 150 bytes each as parsed JSON);
+# least recently used blocks beyond it are dropped and re-read from disk when needed
+MAX_MEMORY_SAMPLES = 500_000
+# Steps per on-disk block (the fetch chunk size, 3h at a 15s step); a request only reads and
+# rewrites the blocks it touches
+BLOCK_POINTS = 720
+# Newest blocks kept per query and step (30 days at a 15s step); older ones are deleted
+MAX_BLOCKS_PER_QUERY = 240
+
+
+def normalize_query(query):
+    return " ".join(query.split())
+
+
+def align_window(start, end, step):
+    """
+    Snaps a window onto the step grid (multiples of step since the epoch), so that
+    overlapping windows evaluate at the same timestamps and can be spliced together.
+
+    :param start: Start time as epoch seconds.
+    :param end: End time as epoch seconds.
+    :return: (aligned_start, aligned_end) as epoch seconds.
+    """
+    return math.floor(start / step) * step, math.floor(end / step) * step
+
+
+def _series_key(labels):
+    return json.dumps(labels, sort_keys=True)
+
+
+class _CacheEntry:
+    """
+    Cached samples of one block of a (query, step): every series' samples keyed by timestamp,
+    plus the grid ranges they cover as [start, end, expires_at] (expires_at None = permanent).
+    """
+
+    def __init__(self, coverage=None, series=None):
+        self.coverage = coverage or []
+        # series key -> {"metric": labels, "samples": {timestamp: value string}}
+        self.series = series or {}
+
+    @classmethod
+    def from_json(cls, data):
+        series = {}
+        for item in data["series"]:
+            series[_series_key(item["metric"])] = {
+                "metric": item["metric"],
+                "samples": {float(timestamp): value for timestamp, value in item["values"]},
+            }
+        return cls(data["coverage"], series)
+
+    def to_json(self):
+        return {
+            "coverage": self.coverage,
+            "series": [
+                {"metric": item["metric"], "values": [[timestamp, value] for timestamp, value in sorted(item["samples"].items())]}
+                for item in self.series.values()
+            ],
+        }
+
+    @property
+    def samples(self):
+        return sum(len(item["samples"]) for item in self.series.values())
+
+    def drop_expired(self, now):
+        self.coverage = [interval for interval in self.coverage if interval[2] is None or interval[2] > now]
+
+    def missing(self, start, end, step):
+        """
+        Returns the grid sub-ranges of [start, end] that no valid coverage interval holds.
+        """
+        missing = []
+        cursor = start
+        for covered_start, covered_end, _ in sorted(self.coverage, key=lambda interval: interval[:2]):
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                missing.append((cursor, covered_start - step))
+            cursor = max(cursor, covered_end + step)
+            if cursor > end:
+                break
+        if cursor <= end:
+            missing.append((cursor, end))
+        return missing
+
+    def add(self, result, start, end, step, now):
+        for item in result:
+            key = _series_key(item.get("metric", {}))
+            samples = self.series.setdefault(key, {"metric": item.get("metric", {}), "samples": {}})["samples"]
+            for timestamp, value in item.get("values", []):
+                samples[float(timestamp)] = value
+        # Split the fetched range into the part that is settled and the still-open tail
+        boundary = math.floor((now - OPEN_TAIL_SECONDS) / step) * step
+        if end <= boundary:
+            self.coverage.append([start, end, None])
+        elif start > boundary:
+            self.coverage.append([start, end, now + OPEN_TAIL_TTL])
+        else:
+            self.coverage.append([start, boundary, None])
+            self.coverage.append([boundary + step, end, now + OPEN_TAIL_TTL])
+        self._merge_coverage(step)
+
+    def _merge_coverage(self, step):
+        merged = []
+        for interval in sorted(self.coverage, key=lambda interval: (interval[2] is not None, interval[0])):
+            previous = merged[-1] if merged else None
+            if previous and previous[2] == interval[2] and interval[0] <= previous[1] + step:
+                previous[1] = max(previous[1], interval[1])
+            else:
+                merged.append(list(interval))
+        self.coverage = merged
+
+    def result(self, start, end):
+        """
+        Returns the cached samples within [start, end] in Prometheus' matrix result format.
+        """
+        result = []
+        for item in self.series.values():
+            values = [[timestamp, value] for timestamp, value in sorted(item["samples"].items()) if start <= timestamp <= end]
+            if values:
+                result.append({"metric": item["metric"], "values": values})
+        return result
+
+
+def _clip(result, start, end):
+    """
+    The samples of a matrix result within [start, end].
+    """
+    return [
+        {"metric": item.get("metric", {}), "values": [value for value in item.get("values", []) if start <= float(value[0]) <= end]}
+        for item in result
+    ]
+
+
+def _merge_ranges(ranges, step):
+    """
+    Joins grid ranges that follow each other without a gap, so they are fetched in one request.
+    """
+    merged = []
+    for range_start, range_end in sorted(ranges):
+        if merged and range_start <= merged[-1][1] + step:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return [tuple(item) for item in merged]
+
+
+class QueryCache:
+    """
+    In-memory LRU plus on-disk cache of range query results, keyed by the Prometheus source
+    (see fetch_engine.source_key), the normalized query and the step. Requests are aligned
+    to the step grid; only the sub-ranges not already cached are fetched, and the pieces are
+    spliced back into one result.
+
+    Each key's samples are split into blocks of BLOCK_POINTS steps, one file per block, so a
+    request only reads and rewrites the blocks its window touches. Only the
+    MAX_BLOCKS_PER_QUERY newest blocks of a key are kept on disk, and the LRU holds blocks
+    up to max_samples samples in total.
+
+    Thread-safe: fetches for different queries can run concurrently.
+    """
+
+    def __init__(self, cache_dir=QUERY_CACHE_DIR, max_samples=MAX_MEMORY_SAMPLES, max_blocks=MAX_BLOCKS_PER_QUERY):
+        self.cache_dir = cache_dir
+        self.max_samples = max_samples
+        self.max_blocks = max_blocks
+        # (key, block) -> _CacheEntry, least recently used first
+        self._entries = OrderedDict()
+        # (key, block) -> samples of the entry as of its last load or update, and their total
+        self._sizes = {}
+        self._held = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _key_dir(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest())
+
+    def _path(self, key, block):
+        return os.path.join(self._key_dir(key), f"{block}.json")
+
+    def _load(self, key, block):
+        with self._lock:
+            entry = self._entries.get((key, block))
+            if entry is not None:
+                self._entries.move_to_end((key, block))
+                return entry
+        entry = _CacheEntry()
+        if self.cache_dir and os.path.exists(self._path(key, block)):
+            with open(self._path(key, block), "r") as f:
+                entry = _CacheEntry.from_json(json.load(f))
+        with self._lock:
+            entry = self._entries.setdefault((key, block), entry)
+            self._remember((key, block), entry)
+        return entry
+
+    def _remember(self, entry_key, entry):
+        """
+        Marks the entry as most recently used and evicts the least recently used ones until
+        the samples held fit max_samples again, this one included if it is larger on its own.
+        Call with the lock held.
+        """
+        self._entries.move_to_end(entry_key)
+        self._held += entry.samples - self._sizes.get(entry_key, 0)
+        self._sizes[entry_key] = entry.samples
+        while self._entries and self._held > self.max_samples:
+            self._forget(next(iter(self._entries)))
+
+    def _forget(self, entry_key):
+        self._entries.pop(entry_key, None)
+        self._held -= self._sizes.pop(entry_key, 0)
+
+    def _save(self, key, block, entry):
+        if not self.cache_dir:
+            return
+        path = self._path(key, block)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            data = entry.to_json()
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"key": key, "block": block, **data}, f, separators=(",", ":"))
+        os.replace(temporary_path, path)
+
+    def _drop_old_blocks(self, key):
+        """
+        Deletes all but the max_blocks newest blocks of a key from disk and memory.
+        """
+        if not self.cache_dir:
+            return
+        blocks = sorted(int(name[:-len(".json")]) for name in os.listdir(self._key_dir(key)) if name.endswith(".json"))
+        for block in blocks[:-self.max_blocks]:
+            with self._lock:
+                self._forget((key, block))
+            try:
+                os.remove(self._path(key, block))
+            except FileNotFoundError:
+                pass
+
+    def query_range(self, source, query, start, end, step, fetch):
+        """
+        Serves a range query from the cache, fetching only the missing sub-ranges.
+
+        :param source: Prometheus the query runs against, see fetch_engine.source_key.
+        :param query: PromQL query string.
+        :param start: Start time as epoch seconds.
+        :param end: End time as epoch seconds.
+        :param step: Step as a Prometheus duration ("15s") or seconds.
+        :param fetch: Callable (start, end) -> (result, msg) taking aligned epoch seconds,
+            used for the missing sub-ranges.
+        :return: (result, msg) like fetch, with the samples within [start, end]; msg is the
+            first failure message if a fetch failed.
+        """
+        step_seconds = step_to_seconds(step)
+        key = f"{source}|{step_seconds:g}|{normalize_query(query)}"
+        requested_start = start
+        start, end = align_window(start, end, step_seconds)
+        block_seconds = BLOCK_POINTS * step_seconds
+
+        def block_range(block, range_start, range_end):
+            return max(range_start, block * block_seconds), min(range_end, (block + 1) * block_seconds - step_seconds)
+
+        def blocks(range_start, range_end):
+            return range(math.floor(range_start / block_seconds), math.floor(range_end / block_seconds) + 1)
+
+        entries = {block: self._load(key, block) for block in blocks(start, end)}
+        now = time.time()
+        missing = []
+        with self._lock:
+            for block, entry in entries.items():
+                entry.drop_expired(now)
+                missing += entry.missing(*block_range(block, start, end), step_seconds)
+            if not missing:
+                self.hits += 1
+                return self._result(entries, requested_start, end), "OK (cached)"
+            self.misses += 1
+
+        changed = set()
+        for missing_start, missing_end in _merge_ranges(missing, step_seconds):
+            result, msg = fetch(missing_start, missing_end)
+            if result is None:
+                return None, msg
+            with self._lock:
+                for block in blocks(missing_start, missing_end):
+                    block_start, block_end = block_range(block, missing_start, missing_end)
+                    entries[block].add(_clip(result, block_start, block_end), block_start, block_end, step_seconds, now)
+                    changed.add(block)
+        for block in sorted(changed):
+            self._save(key, block, entries[block])
+        self._drop_old_blocks(key)
+        with self._lock:
+            for block in changed:
+                if (key, block) in self._entries:
+                    self._remember((key, block), entries[block])
+            return self._result(entries, requested_start, end), "OK"
+
+    @staticmethod
+    def _result(entries, start, end):
+        """
+        Splices the blocks' samples within [start, end] into one matrix result. Call with the
+        lock held.
+        """
+        merged = {}
+        for block in sorted(entries):
+            for item in entries[block].result(start, end):
+                key = _series_key(item["metric"])
+                if key in merged:
+                    merged[key]["values"].extend(item["values"])
+                else:
+                    merged[key] = item
+        return list(merged.values())
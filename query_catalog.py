@@ -0,0 +1,219 @@
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from string import Template
+
+from promql import PromQLError, analyze_query, parse_duration
+from query_planner import SHARED_SERVICE, PlannedQuery
+from run_store import RUN_ID_FORMAT, RunStore
+
+# Template scopes: one query whose series are split per service by their pod label, one
+# regex-union query covering every discovered service (series labelled "service"), or one
+# query for the whole cluster
+SCOPES = ("pod", "service", "cluster")
+# Placeholder filled with a regex matching any discovered service name, e.g. "(nginx|text)"
+SERVICES_PARAM = "services"
+# Services compiled into validate_catalog's test queries
+EXAMPLE_SERVICES = ("example-service", "other-service")
+
+
+def _string_literal(value):
+    # Escapes a value for the inside of a double-quoted PromQL string
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def service_regex(services):
+    """
+    Regex matching any of the services, longest first so a service isn't shadowed by
+    another one that is a prefix of it.
+    """
+    names = sorted(set(services), key=lambda name: (-len(name), name))
+    return "(" + "|".join(re.sub(r"([.+*?()|\[\]{}^$\\])", r"\\\1", name) for name in names) + ")"
+
+
+@dataclass(frozen=True)
+class QueryParam:
+    """
+    A typed template parameter:
+    "label" (a label value), "regex" (a label regex), "duration" (e.g. "5m") or "number".
+    """
+    type: str
+    default: object = None
+
+    def render(self, name, value):
+        if value is None:
+            raise ValueError(f"Parameter '{name}' has no value.")
+        if self.type == "duration":
+            try:
+                parse_duration(str(value))
+            except PromQLError:
+                raise ValueError(f"Parameter '{name}' must be a duration such as '5m', got '{value}'.")
+            return str(value)
+        if self.type == "number":
+            return f"{float(value):g}"
+        if self.type == "regex":
+            try:
+                re.compile(str(value))
+            except re.error as e:
+                raise ValueError(f"Parameter '{name}' is not a valid regex ({e}).")
+            return _string_literal(str(value))
+        if self.type == "label":
+            return _string_literal(str(value))
+        raise ValueError(f"Parameter '{name}' has unknown type '{self.type}'.")
+
+
+@dataclass(frozen=True)
+class QueryTemplate:
+    """
+    A catalog query: PromQL with $param placeholders ("$$" for a literal "$"), typed
+    parameters and how it is collected.
+
+    :param scope: "pod", "service" or "cluster" (see SCOPES). Service-scoped templates use
+        $services, a regex of all discovered services, and must label series with "service".
+    :param step: Fixed range query step such as "60s", or None to pick one from the window.
+    :param priority: Fetch order; 0 is fetched first, higher numbers later (or skipped, see
+        compile_catalog's max_priority).
+    :param retention_days: Raw samples of runs older than this are dropped by
+        apply_retention, keeping the rollup tiers; None keeps them forever.
+    :param record: Precompute the query with a Prometheus recording rule (see
+        recording_rules.py) and fetch the recorded series once the rule is loaded.
+    """
+    name: str
+    template: str
+    scope: str = "pod"
+    params: dict = field(default_factory=dict)
+    step: str = None
+    priority: int = 1
+    retention_days: int = None
+    record: bool = False
+
+    @property
+    def record_name(self):
+        """
+        Name of the series the recording rule writes, "<scope>:<name>" as in Prometheus's
+        level:metric naming convention.
+        """
+        return f"{self.scope}:{self.name}"
+
+    def recorded_query(self, services=()):
+        """
+        Query selecting the recorded series; service-scoped ones are limited to the services,
+        as the rule may have been generated for more of them.
+        """
+        if self.scope == "service":
+            return f'{self.record_name}{{service=~"{_string_literal(service_regex(services))}"}}'
+        return self.record_name
+
+    def render(self, services=(), **values):
+        """
+        Fills in the template, with values overriding the parameter defaults.
+        """
+        unknown = set(values) - set(self.params)
+        if unknown:
+            raise ValueError(f"{self.name}: unknown parameters {sorted(unknown)}.")
+        rendered = {name: param.render(name, values.get(name, param.default)) for name, param in self.params.items()}
+        if self.scope == "service":
+            if not services:
+                raise ValueError(f"{self.name}: service-scoped templates need at least one service.")
+            rendered[SERVICES_PARAM] = _string_literal(service_regex(services))
+        try:
+            return Template(self.template).substitute(rendered)
+        except KeyError as e:
+            raise ValueError(f"{self.name}: no value for placeholder {e}.")
+
+
+def compile_catalog(catalog, services, max_priority=None, recorded=(), **values):
+    """
+    Compiles the catalog once for the discovered services into planned queries, in
+    priority order. Pod- and service-scoped queries are shared by all services (their
+    series are split per service afterwards); cluster-scoped ones are stored under
+    SHARED_SERVICE.
+
+    :param max_priority: Skip templates with a higher priority number.
+    :param recorded: Names of templates whose recording rules are loaded and cover the
+        services; their recorded series are fetched instead of the query.
+    :param values: Parameter overrides applied to every template that has the parameter.
+    :return: List of query_planner.PlannedQuery.
+    """
+    services = sorted(services)
+    planned = {}
+    for template in sorted(catalog, key=lambda template: template.priority):
+        if max_priority is not None and template.priority > max_priority:
+            continue
+        if template.name in recorded:
+            query = template.recorded_query(services)
+        else:
+            query = template.render(services, **{name: value for name, value in values.items() if name in template.params})
+        targets = [(SHARED_SERVICE, template.name)] if template.scope == "cluster" else [(service, template.name) for service in services]
+        if not targets:
+            continue
+        entry = planned.setdefault(query, PlannedQuery(query, step=template.step, priority=template.priority))
+        entry.targets.extend(targets)
+    return list(planned.values())
+
+
+def validate_catalog(catalog, services=EXAMPLE_SERVICES):
+    """
+    Checks every template before a run: scope, parameter types and that the compiled query
+    is valid PromQL (see promql.analyze_query). Service-scoped queries must keep a
+    "service" label, or their series can't be split per service.
+
+    :return: {name: QueryInfo}
+    :raises ValueError: Listing every broken template.
+    """
+    infos, errors = {}, []
+    names = [template.name for template in catalog]
+    for duplicate in sorted({name for name in names if names.count(name) > 1}):
+        errors.append(f"{duplicate}: defined more than once")
+    for template in catalog:
+        try:
+            if template.scope not in SCOPES:
+                raise ValueError(f"unknown scope '{template.scope}', use one of {SCOPES}")
+            if template.step is not None:
+                parse_duration(template.step)
+            info = analyze_query(template.render(services))
+        except ValueError as e:
+            errors.append(f"{template.name}: {e}")
+            continue
+        if template.scope == "service" and (info.grouping is None or "service" not in info.grouping):
+            errors.append(f"{template.name}: service-scoped queries must aggregate 'by (service)'")
+        for warning in info.warnings:
+            print(f"Warning: {template.name}: {warning}", flush=True)
+        infos[template.name] = info
+    if errors:
+        raise ValueError("Invalid query catalog:\n  " + "\n  ".join(errors))
+    return infos
+
+
+def run_started_at(run_id):
+    try:
+        return datetime.strptime(run_id, RUN_ID_FORMAT)
+    except ValueError:
+        return None
+
+
+def apply_retention(store: RunStore, catalog, now=None):
+    """
+    Drops the raw samples of templates with retention_days from runs older than that. Their
+    rollup tiers are kept (and built first where missing), so old runs can still be read at
+    1m resolution and coarser.
+
+    :return: Number of series whose raw samples were removed.
+    """
+    now = now or datetime.now()
+    retention = {template.name: template.retention_days for template in catalog if template.retention_days is not None}
+    removed = 0
+    for run_id in store.run_ids():
+        started = run_started_at(run_id)
+        if started is None:
+            continue
+        expired = [(service, metric) for service, metric in store.series_keys(run_id)
+                   if metric in retention and now - started > timedelta(days=retention[metric])]
+        if not expired:
+            continue
+        if not store.has_rollups(run_id):
+            store.build_rollups(run_id)
+        for service, metric in expired:
+            store.delete_series(run_id, service, metric, rollups=False)
+            removed += 1
+    return removed
@@ -0,0 +1,92 @@
+from dataclasses import dataclass, field
+
+# Directory name used for series that don't belong to any single service
+# (e.g. the cluster-scoped queries of the catalog, or series without a pod or service label)
+SHARED_SERVICE = "cluster"
+
+
+@dataclass
+class PlannedQuery:
+    """
+    A unique query string together with every (service, metric_name) that asked for it,
+    and optionally a fixed step and fetch priority (see query_catalog).
+    """
+    query: str
+    targets: list = field(default_factory=list)
+    step: str = None
+    priority: int = 0
+
+    @property
+    def metric_names(self):
+        return sorted({metric_name for _, metric_name in self.targets})
+
+
+def plan_queries(service_queries):
+    """
+    Collapses identical query strings across services so each one is sent to Prometheus once.
+
+    :param service_queries: Dictionary of Prometheus queries per service
+        ({service: {metric_name: query}}); catalog queries are planned by
+        query_catalog.compile_catalog instead.
+    :return: A list of PlannedQuery, one per distinct query string.
+    """
+    planned = {}
+    for service, queries in service_queries.items():
+        for metric_name, query in queries.items():
+            planned.setdefault(query, PlannedQuery(query)).targets.append((service, metric_name))
+    return list(planned.values())
+
+
+def series_owner(labels, services):
+    """
+    Works out which service a result series belongs to from its labels.
+
+    Pods are matched by name prefix (compose-post-service-7d9f... -> compose-post-service),
+    preferring the longest service name when several match.
+
+    :param labels: The series' label set (the "metric" entry of a Prometheus result).
+    :param services: Collection of known service names.
+    :return: The owning service name, or None if the series isn't service-specific.
+    """
+    pod = labels.get("pod")
+    if pod:
+        matches = [service for service in services if pod == service or pod.startswith(f"{service}-")]
+        if matches:
+            return max(matches, key=len)
+    service = labels.get("service")
+    if service in services:
+        return service
+    return None
+
+
+def split_result(planned: PlannedQuery, result):
+    """
+    Splits the result series of a planned query back out to the services that asked for it.
+
+    A query requested by a single service keeps its whole result. Otherwise each series goes
+    to the service that owns it, and series without a service identity are returned once
+    under SHARED_SERVICE instead of being copied into every service.
+
+    :return: A list of (service, metric_name, series) tuples.
+    """
+    if not result:
+        return []
+    if len(planned.targets) == 1:
+        service, metric_name = planned.targets[0]
+        return [(service, metric_name, result)]
+
+    metrics_per_service = {}
+    for service, metric_name in planned.targets:
+        metrics_per_service.setdefault(service, []).append(metric_name)
+
+    series_per_owner = {}
+    for series in result:
+        owner = series_owner(series.get("metric", {}), metrics_per_service) or SHARED_SERVICE
+        series_per_owner.setdefault(owner, []).append(series)
+
+    split = []
+    for owner, series in series_per_owner.items():
+        metric_names = planned.metric_names if owner == SHARED_SERVICE else metrics_per_service[owner]
+        for metric_name in metric_names:
+            split.append((owner, metric_name, series))
+    return split
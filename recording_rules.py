@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import time
+from datetime import datetime
+
+import pandas as pd
+import requests
+import yaml
+
+from http_client import get_client
+from prom_queries import QUERY_CATALOG
+from query_catalog import validate_catalog
+
+# Rule groups are named "<prefix>-<hash of the rules>", so a reloaded group can be told apart
+# from the one a previous run installed
+RULE_GROUP_PREFIX = "tracer-catalog"
+RULE_EVALUATION_INTERVAL = "15s"
+RULES_OUTPUT_PATH = "data/recording_rules.yml"
+# prometheus-community/prometheus keeps its rule files in the server ConfigMap; the chart's
+# configmap-reload sidecar reloads Prometheus when the ConfigMap changes. The installation
+# scripts deploy it into ISTIO_NAMESPACE
+PROMETHEUS_NAMESPACE = os.environ.get("ISTIO_NAMESPACE", "istio-system")
+PROMETHEUS_RULES_CONFIGMAP = "prometheus-server"
+PROMETHEUS_RULES_KEY = "recording_rules.yml"
+# Kubelet can take a minute to sync a changed ConfigMap into the pod
+RULES_LOAD_TIMEOUT = 180
+# kubectl invocation, e.g. KUBECTL="sudo kubectl" where the kubeconfig is root's like in the
+# installation scripts
+KUBECTL_COMMAND = os.environ.get("KUBECTL", "kubectl").split()
+RULES_POLL_INTERVAL = 5
+
+
+def recording_rules(catalog, services, **values):
+    """
+    Prometheus rule file with one recording rule per catalog template marked record=True,
+    rendered for the services like compile_catalog does.
+
+    :return: {"groups": [...]} ready to be dumped as YAML; its single group is named after a
+        hash of the rules.
+    """
+    services = sorted(services)
+    rules = [
+        {"record": template.record_name,
+         "expr": template.render(services, **{name: value for name, value in values.items() if name in template.params})}
+        for template in catalog if template.record
+    ]
+    digest = hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:10]
+    return {"groups": [{"name": f"{RULE_GROUP_PREFIX}-{digest}", "interval": RULE_EVALUATION_INTERVAL, "rules": rules}]}
+
+
+def save_recording_rules(rules, path=RULES_OUTPUT_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        yaml.safe_dump(rules, f, sort_keys=False)
+    return path
+
+
+def install_recording_rules(rules, namespace=PROMETHEUS_NAMESPACE, configmap=PROMETHEUS_RULES_CONFIGMAP,
+                            key=PROMETHEUS_RULES_KEY):
+    """
+    Writes the rule file into the Prometheus server ConfigMap with kubectl, replacing the
+    rules installed before it.
+
+    :return: True if kubectl accepted the patch.
+    """
+    patch = json.dumps({"data": {key: yaml.safe_dump(rules, sort_keys=False)}})
+    try:
+        result = subprocess.run(
+            [*KUBECTL_COMMAND, "patch", "configmap", configmap, "-n", namespace, "--type", "merge", "-p", patch],
+            capture_output=True, text=True,
+        )
+    except FileNotFoundError as e:
+        print(f"Warning: could not run {' '.join(KUBECTL_COMMAND)} to install recording rules: {e}", flush=True)
+        return False
+    if result.returncode != 0:
+        print(f"Warning: failed to install recording rules in {namespace}/{configmap}: {result.stderr.strip()}",
+              flush=True)
+        return False
+    print(f"Recording rules installed in {namespace}/{configmap} ({key}).", flush=True)
+    return True
+
+
+def loaded_rules(prometheus_url, group_name, timeout=10):
+    """
+    Recording rules of one group as Prometheus currently evaluates them.
+
+    :return: {record name: rule} from /api/v1/rules, empty if the group isn't loaded.
+    """
+    response = get_client().get(f"{prometheus_url}/api/v1/rules", params={"type": "record"}, timeout=timeout)
+    response.raise_for_status()
+    for group in response.json()["data"]["groups"]:
+        if group["name"] == group_name:
+            return {rule["name"]: rule for rule in group["rules"]}
+    return {}
+
+
+def wait_for_recording_rules(prometheus_url, rules, timeout=RULES_LOAD_TIMEOUT, poll_interval=RULES_POLL_INTERVAL):
+    """
+    Waits until Prometheus has loaded the rule group and evaluated each of its rules
+    successfully. Recorded series only exist from that moment on, so rules have to be
+    loaded before the run window starts.
+
+    :return: Record names that are loaded and healthy; rules still failing at the timeout
+        are left out (their queries are then fetched from raw data).
+    """
+    group = rules["groups"][0]
+    expected = {rule["record"] for rule in group["rules"]}
+    deadline = time.monotonic() + timeout
+    healthy = set()
+    while True:
+        try:
+            loaded = loaded_rules(prometheus_url, group["name"])
+        except (requests.RequestException, KeyError, ValueError) as e:
+            print(f"Could not read the loaded rules: {e}", flush=True)
+            loaded = {}
+        healthy = {
+            name for name, rule in loaded.items()
+            if name in expected and rule.get("health") == "ok"
+            and pd.Timestamp(rule.get("lastEvaluation", "0001-01-01T00:00:00Z")).year > 1
+        }
+        if healthy == expected or time.monotonic() >= deadline:
+            break
+        time.sleep(poll_interval)
+    for name in sorted(expected - healthy):
+        rule = loaded.get(name, {})
+        print(f"Warning: recording rule {name} not active ({rule.get('health', 'not loaded')}: {rule.get('lastError', '')}).",
+              flush=True)
+    return healthy
+
+
+def prepare_recording_rules(prometheus_url, catalog, services, install=True, **values):
+    """
+    Generates the catalog's recording rules for the services and saves them to
+    RULES_OUTPUT_PATH; with install, also loads them into Prometheus and waits for them.
+
+    :return: Names of the templates whose recorded series can be queried (see
+        query_catalog.compile_catalog's recorded parameter).
+    """
+    rules = recording_rules(catalog, services, **values)
+    path = save_recording_rules(rules)
+    print(f"{len(rules['groups'][0]['rules'])} recording rules written to {path}", flush=True)
+    if not install or not rules["groups"][0]["rules"]:
+        return set()
+    if not install_recording_rules(rules):
+        print("Warning: recording rules not installed; all catalog queries are fetched from raw data.", flush=True)
+        return set()
+    started = datetime.now()
+    active = wait_for_recording_rules(prometheus_url, rules)
+    print(f"{len(active)} recording rules active after {(datetime.now() - started).total_seconds():.0f}s.", flush=True)
+    return {template.name for template in catalog if template.record and template.record_name in active}
+
+
+def usable_recordings(catalog, recorded, rule_services, services):
+    """
+    Recorded templates that cover the services: service-scoped rules generated before the
+    run only record the services known then, so they are dropped if others showed up since.
+    """
+    missing = set(services) - set(rule_services)
+    if not missing:
+        return set(recorded)
+    print(f"Recording rules don't cover {sorted(missing)}; fetching service-scoped queries from raw data.", flush=True)
+    scopes = {template.name: template.scope for template in catalog}
+    return {name for name in recorded if scopes.get(name) != "service"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate (and optionally install) recording rules for the query catalog.")
+    parser.add_argument("services", nargs="+", help="Services the service-scoped rules cover.")
+    parser.add_argument("--output", default=RULES_OUTPUT_PATH, help="Rule file to write.")
+    parser.add_argument("--install", action="store_true",
+                        help=f"Patch the rules into the {PROMETHEUS_NAMESPACE}/{PROMETHEUS_RULES_CONFIGMAP} ConfigMap "
+                             f"and wait for Prometheus to load them.")
+    parser.add_argument("--prometheus-url", default=os.environ.get("PROMETHEUS_URL"))
+    args = parser.parse_args()
+
+    validate_catalog(QUERY_CATALOG)
+    rules = recording_rules(QUERY_CATALOG, args.services)
+    print(f"Rules written to {save_recording_rules(rules, args.output)}")
+    if args.install and install_recording_rules(rules):
+        active = wait_for_recording_rules(args.prometheus_url, rules)
+        print(f"{len(active)} of {len(rules['groups'][0]['rules'])} rules active.")
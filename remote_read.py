@@ -0,0 +1,271 @@
+import argparse
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import snappy
+
+from fetch_engine import DEFAULT_MAX_WORKERS, DEFAULT_TIMEOUT, AdaptiveBackoff, request_with_backoff
+from http_client import get_client
+from metrics_decoder import NAME_LABEL, long_frame
+from promql import analyze_query
+from query_planner import SHARED_SERVICE, series_owner
+from run_store import RunStore
+
+REMOTE_READ_PATH = "/api/v1/read"
+REMOTE_READ_HEADERS = {
+    "Content-Encoding": "snappy",
+    "Content-Type": "application/x-protobuf",
+    "Accept-Encoding": "snappy",
+    "X-Prometheus-Remote-Read-Version": "0.1.0",
+}
+# Series exported by default: everything the benchmark namespace exposes
+EXPORT_SELECTOR = '{namespace="socialnetwork"}'
+# Raw samples go to their own store, so runs' query results aren't mixed with raw counters
+RAW_STORE_DIR = os.path.join("data", "raw_store")
+# Window of one remote-read request; a SAMPLES response is built in memory on both sides,
+# so long runs are read in pieces that are stored one by one
+EXPORT_CHUNK_SECONDS = 600
+
+# prometheus.LabelMatcher.Type
+MATCHER_TYPES = {"=": 0, "!=": 1, "=~": 2, "!~": 3}
+# prometheus.ReadRequest.ResponseType.SAMPLES: one snappy-compressed ReadResponse message
+RESPONSE_TYPE_SAMPLES = 0
+
+# Protobuf wire types
+_VARINT, _FIXED64, _LENGTH_DELIMITED, _FIXED32 = 0, 1, 2, 5
+
+
+def _encode_varint(value):
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _varint_field(number, value):
+    return _encode_varint(number << 3 | _VARINT) + _encode_varint(value)
+
+
+def _bytes_field(number, data):
+    if isinstance(data, str):
+        data = data.encode()
+    return _encode_varint(number << 3 | _LENGTH_DELIMITED) + _encode_varint(len(data)) + data
+
+
+def _decode_varint(buffer, position):
+    result = shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def _fields(buffer, start, end):
+    """
+    Yields (field number, wire type, value) of a message: varints as int, fixed-size fields
+    as their offset and length-delimited fields as (start, end) offsets.
+    """
+    position = start
+    while position < end:
+        key, position = _decode_varint(buffer, position)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == _VARINT:
+            value, position = _decode_varint(buffer, position)
+        elif wire_type == _FIXED64:
+            value, position = position, position + 8
+        elif wire_type == _LENGTH_DELIMITED:
+            length, position = _decode_varint(buffer, position)
+            value, position = (position, position + length), position + length
+        elif wire_type == _FIXED32:
+            value, position = position, position + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield number, wire_type, value
+
+
+def selector_matchers(selector):
+    """
+    Label matchers of a PromQL series selector such as '{namespace="socialnetwork"}' or
+    'up{job!="node"}'.
+
+    :return: List of (name, operator, value).
+    """
+    info = analyze_query(selector)
+    if info.functions or info.aggregations or info.range_selectors or len(set(info.metrics)) > 1:
+        raise ValueError(f"Expected a single series selector, got '{selector}'.")
+    matchers = [(NAME_LABEL, "=", info.metrics[0])] if info.metrics else []
+    matchers += [(name, operator, value) for _, name, operator, value in info.matchers]
+    if not matchers:
+        raise ValueError(f"Selector '{selector}' selects nothing.")
+    return matchers
+
+
+def encode_read_request(start_ms, end_ms, matchers):
+    """
+    Serialises a prometheus.ReadRequest with one query for the window (both ends inclusive)
+    and returns it snappy-compressed, ready to POST.
+    """
+    query = _varint_field(1, start_ms) + _varint_field(2, end_ms)
+    for name, operator, value in matchers:
+        matcher = _varint_field(1, MATCHER_TYPES[operator]) + _bytes_field(2, name) + _bytes_field(3, value)
+        query += _bytes_field(3, matcher)
+    request = _bytes_field(1, query) + _varint_field(2, RESPONSE_TYPE_SAMPLES)
+    return snappy.compress(request)
+
+
+def _decode_series(buffer, start, end):
+    labels, timestamps, values = {}, [], []
+    for number, wire_type, value in _fields(buffer, start, end):
+        if number == 1 and wire_type == _LENGTH_DELIMITED:
+            name = label_value = ""
+            for label_number, _, (label_start, label_end) in _fields(buffer, *value):
+                text = buffer[label_start:label_end].decode()
+                if label_number == 1:
+                    name = text
+                elif label_number == 2:
+                    label_value = text
+            labels[name] = label_value
+        elif number == 2 and wire_type == _LENGTH_DELIMITED:
+            # Sample {double value = 1; int64 timestamp = 2;}, zero values are left out
+            sample_value, timestamp = 0.0, 0
+            for sample_number, sample_type, field in _fields(buffer, *value):
+                if sample_number == 1 and sample_type == _FIXED64:
+                    sample_value = struct.unpack_from("<d", buffer, field)[0]
+                elif sample_number == 2 and sample_type == _VARINT:
+                    timestamp = field - (1 << 64) if field >= 1 << 63 else field
+            timestamps.append(timestamp)
+            values.append(sample_value)
+    return labels, np.array(timestamps, dtype=np.int64), np.array(values, dtype=np.float64)
+
+
+def decode_read_response(body):
+    """
+    Decodes a snappy-compressed prometheus.ReadResponse of SAMPLES.
+
+    :return: List of (labels, timestamps_ms, values) per series, over all queries.
+    :raises ValueError: If the body isn't a snappy-compressed protobuf message.
+    """
+    try:
+        buffer = snappy.decompress(body)
+    except snappy.UncompressError as e:
+        raise ValueError(f"Response is not snappy-compressed: {e}") from e
+    series = []
+    try:
+        for number, wire_type, result in _fields(buffer, 0, len(buffer)):
+            if number != 1 or wire_type != _LENGTH_DELIMITED:
+                continue
+            for series_number, series_type, timeseries in _fields(buffer, *result):
+                if series_number == 1 and series_type == _LENGTH_DELIMITED:
+                    series.append(_decode_series(buffer, *timeseries))
+    except (IndexError, UnicodeDecodeError, struct.error) as e:
+        raise ValueError(f"Malformed ReadResponse: {e}") from e
+    return series
+
+
+def remote_read(session, prom_url, start_ms, end_ms, matchers, timeout=DEFAULT_TIMEOUT,
+                backoff: AdaptiveBackoff = None, headers=None, auth=None):
+    """
+    Reads the raw samples of every series matching the matchers in [start_ms, end_ms].
+
+    :return: (series, msg) like fetch_engine.query_prometheus, series as in decode_read_response.
+    """
+    return request_with_backoff(
+        session, f"{prom_url}{REMOTE_READ_PATH}", None, timeout, backoff or AdaptiveBackoff(),
+        headers={**REMOTE_READ_HEADERS, **(headers or {})}, auth=auth,
+        parse=decode_read_response, data=encode_read_request(start_ms, end_ms, matchers), raw=True,
+    )
+
+
+def export_windows(start_time, end_time, chunk_seconds=EXPORT_CHUNK_SECONDS):
+    """
+    Splits a window into consecutive, non-overlapping [start_ms, end_ms] remote-read windows.
+    """
+    start_ms, end_ms = int(start_time.timestamp() * 1000), int(end_time.timestamp() * 1000)
+    chunk_ms = chunk_seconds * 1000
+    return [(chunk_start, min(chunk_start + chunk_ms - 1, end_ms)) for chunk_start in range(start_ms, end_ms + 1, chunk_ms)]
+
+
+def store_series(store: RunStore, run_id, series, services):
+    """
+    Appends decoded series to the store, under the service owning them (SHARED_SERVICE if
+    none does) and their metric name.
+
+    :return: Number of samples stored.
+    """
+    groups = {}
+    for labels, timestamps, values in series:
+        if not len(timestamps):
+            continue
+        owner = series_owner(labels, services) or SHARED_SERVICE
+        groups.setdefault((owner, labels.get(NAME_LABEL, "")), []).append((labels, timestamps, values))
+    stored = 0
+    for (service, metric), group in groups.items():
+        label_sets, timestamps, values = zip(*group)
+        lengths = np.array([len(series_timestamps) for series_timestamps in timestamps], dtype=np.int64)
+        store.append(run_id, service, metric, long_frame(label_sets, lengths, np.concatenate(timestamps), np.concatenate(values)))
+        stored += int(lengths.sum())
+    return stored
+
+
+def export_run(prom, run_id, start_time, end_time, services=(), selector=EXPORT_SELECTOR, store: RunStore = None,
+               chunk_seconds=EXPORT_CHUNK_SECONDS, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+    """
+    Bulk-exports the raw samples of every series matching the selector in a run window
+    through Prometheus' remote-read endpoint into the raw store: one protobuf request per
+    window chunk instead of a JSON query_range per query, no evaluation and no step.
+    Chunks are read concurrently and stored as they arrive.
+
+    :param prom: PrometheusConnect object, used for its URL, headers, auth and session.
+    :param services: Known services, for splitting series per service by pod or service label.
+    :return: Number of samples stored.
+    """
+    store = store or RunStore(RAW_STORE_DIR, rollups=False)
+    matchers = selector_matchers(selector)
+    windows = export_windows(start_time, end_time, chunk_seconds)
+    session = prom._session
+    backoff = AdaptiveBackoff()
+    stored = failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(remote_read, session, prom.url, chunk_start, chunk_end, matchers, timeout, backoff,
+                            prom.headers, prom.auth)
+            for chunk_start, chunk_end in windows
+        ]
+        for future in as_completed(futures):
+            series, msg = future.result()
+            if series is None:
+                print(f"Remote read failed: {msg}", flush=True)
+                failed += 1
+                continue
+            stored += store_series(store, run_id, series, services)
+    store.compact(run_id)
+    print(f"Exported {stored} raw samples of {selector} for run {run_id} to {store.root} "
+          f"({len(windows) - failed}/{len(windows)} windows read).", flush=True)
+    return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-export raw samples of a time window through Prometheus remote read.")
+    parser.add_argument("--prometheus-url", default=os.environ.get("PROMETHEUS_URL"))
+    parser.add_argument("--run-id", required=True, help="Run the samples are stored under.")
+    parser.add_argument("--start", required=True, help="Window start, ISO format in local time.")
+    parser.add_argument("--end", default=None, help="Window end, ISO format in local time; now by default.")
+    parser.add_argument("--selector", default=EXPORT_SELECTOR)
+    parser.add_argument("--services", nargs="*", default=(), help="Services to split series by.")
+    parser.add_argument("--output", default=RAW_STORE_DIR, help="Store directory.")
+    args = parser.parse_args()
+
+    prom = get_client().prometheus(args.prometheus_url, disable_ssl=True)
+    end = datetime.fromisoformat(args.end) if args.end else datetime.now()
+    export_run(prom, args.run_id, datetime.fromisoformat(args.start), end, args.services, args.selector,
+               RunStore(args.output, rollups=False))
@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import matplotlib
+
+# Headless: never open windows, and safe to use from worker processes
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+
+# parallel: render in worker processes as jobs are submitted
+# defer:    queue jobs and render them all in worker processes on close()
+# skip:     don't render anything
+RENDER_MODES = ("parallel", "defer", "skip")
+
+
+@dataclass
+class LinePlotJob:
+    """
+    Everything needed to draw one time-series line plot in another process.
+    """
+    data: pd.DataFrame
+    output_path: str
+    title: str
+    x: str = "timestamp"
+    y: str = "value"
+    hue: str = None
+    xlabel: str = "Timestamp"
+    ylabel: str = "Value"
+    figsize: tuple = (10, 6)
+    marker: str = None
+    grid: bool = False
+    style: str = None
+    xtick_rotation: int = 0
+    tight_layout: bool = False
+    label: str = "Metric Value"
+
+
+def render_line_plot(job: LinePlotJob):
+    """
+    Draws and saves a LinePlotJob. Runs in worker processes, but can be called directly.
+
+    :return: The path of the saved figure.
+    """
+    if job.style:
+        sns.set(style=job.style)
+    os.makedirs(os.path.dirname(job.output_path) or ".", exist_ok=True)
+    fig = plt.figure(figsize=job.figsize)
+    # One line per hue value when the column exists, otherwise a single labelled line
+    extra = {"hue": job.hue} if job.hue in job.data else {"label": job.label}
+    # errorbar=None: series are plotted as-is, without bootstrapping confidence bands
+    sns.lineplot(x=job.x, y=job.y, data=job.data, marker=job.marker, errorbar=None, **extra)
+    plt.title(job.title)
+    plt.xlabel(job.xlabel)
+    plt.ylabel(job.ylabel)
+    if job.grid:
+        plt.grid(True)
+    if job.xtick_rotation:
+        plt.xticks(rotation=job.xtick_rotation, ha="right")
+    if job.tight_layout:
+        plt.tight_layout()
+    fig.savefig(job.output_path)
+    plt.close(fig)
+    return job.output_path
+
+
+def _ready():
+    return True
+
+
+class PlotRenderer:
+    """
+    Sends plot jobs to a process pool so figures render on all cores without blocking
+    the caller. Use as a context manager, or call close() to wait for every plot.
+
+    Workers are forked, so in parallel mode they are started on entering the context,
+    before the caller starts fetch threads: forking while other threads hold locks (the
+    fetch pool, urllib3's connection pools) can deadlock the children.
+    """
+
+    def __init__(self, mode="parallel", max_workers=None):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Invalid render mode '{mode}'. Use one of {RENDER_MODES}.")
+        self.mode = mode
+        self.max_workers = max_workers or os.cpu_count()
+        self._executor = None
+        self._futures = []
+        self._deferred = []
+
+    def _pool(self):
+        if self._executor is None:
+            # fork keeps workers from re-importing the calling script (tracer.py runs code at import)
+            context = multiprocessing.get_context("fork") if os.name == "posix" else None
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        return self._executor
+
+    def submit(self, job: LinePlotJob):
+        if self.mode == "skip":
+            return
+        if self.mode == "defer":
+            self._deferred.append(job)
+            return
+        self._futures.append((job, self._pool().submit(render_line_plot, job)))
+
+    def close(self):
+        """
+        Renders any deferred jobs, waits for all plots and reports failures.
+
+        :return: Number of figures saved.
+        """
+        for job in self._deferred:
+            self._futures.append((job, self._pool().submit(render_line_plot, job)))
+        self._deferred = []
+
+        saved = 0
+        for job, future in self._futures:
+            try:
+                future.result()
+                saved += 1
+            except Exception as e:
+                print(f"Error rendering {job.output_path}: {e}", flush=True)
+        self._futures = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.mode != "skip":
+            print(f"Rendered {saved} plots", flush=True)
+        return saved
+
+    def start(self):
+        """
+        Starts the worker processes now rather than on the first submit.
+        """
+        # The first task makes the pool start all of its workers; wait until they're up
+        self._pool().submit(_ready).result()
+        return self
+
+    def __enter__(self):
+        if self.mode == "parallel":
+            self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.stats import mannwhitneyu
+
+from metrics_decoder import TIMESTAMP_COLUMN, VALUE_COLUMN
+from run_store import RUN_STORE_NAME, RunStore
+from wrk2_parser import WRK2_STORE_DIR, load_wrk2_summaries
+
+COMPARISON_OUTPUT_DIR = "data/comparisons"
+# Significance level of the Mann-Whitney U test...
+COMPARE_ALPHA = 0.01
+# ...and the smallest relative change of the median worth flagging, however significant
+MIN_RELATIVE_CHANGE = 0.05
+# Samples this soon after the load started are left out (connection setup, caches warming up)
+WARMUP_SECONDS = 30
+# Series with fewer samples than this in either run are reported but not tested
+MIN_SAMPLES = 5
+# Metric name fragments where higher values are better (1) or changes are not good or bad (0);
+# for everything else (latency, CPU, memory, errors) lower is better
+METRIC_DIRECTIONS = {
+    "success_rate": 1,
+    "total_http_requests": 1,
+    "replicas": 0,
+}
+# wrk2 summary fields compared alongside the Prometheus series, with their direction
+WRK2_DIRECTIONS = {
+    "requests_per_sec": 1,
+    "p50_ms": -1,
+    "p90_ms": -1,
+    "p99_ms": -1,
+    "p99.9_ms": -1,
+    "mean_ms": -1,
+    "non_2xx_3xx": -1,
+    "socket_errors": -1,
+}
+
+
+def load_run_metadata(run_id, output_dir=WRK2_STORE_DIR):
+    """
+    Returns the stored wrk2 record of a run (results, test_params, load_start), {} if there is none.
+    """
+    path = os.path.join(output_dir, f"{run_id}.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def metric_direction(metric):
+    for fragment, direction in METRIC_DIRECTIONS.items():
+        if fragment in metric:
+            return direction
+    return -1
+
+
+def aligned_samples(store: RunStore, run_ids, service=None, metric=None, warmup_seconds=WARMUP_SECONDS,
+                    wrk2_dir=WRK2_STORE_DIR):
+    """
+    Reads the samples of several runs in one pass and aligns them by time since each run's
+    load started (offset_s). Only the load window all runs share is kept, from
+    warmup_seconds until the shortest run's load ended, so the before/after padding and a
+    longer run's extra minutes don't skew the comparison.
+
+    The load start comes from the run's wrk2 record, or the run's first sample for runs
+    stored before it was recorded.
+
+    :return: DataFrame with columns run_id, service, metric, pod, offset_s, value.
+    """
+    table = store.read(columns=["run_id", "service", "metric", "pod", TIMESTAMP_COLUMN, VALUE_COLUMN],
+                       run_id=list(run_ids), service=service, metric=metric)
+    samples = table.to_pandas()
+    if samples.empty:
+        return pd.DataFrame(columns=["run_id", "service", "metric", "pod", "offset_s", VALUE_COLUMN])
+    for column in ("run_id", "service", "metric", "pod"):
+        samples[column] = samples[column].astype(str)
+
+    load_starts, durations = {}, []
+    for run_id in run_ids:
+        metadata = load_run_metadata(run_id, wrk2_dir)
+        run_timestamps = samples.loc[samples["run_id"] == run_id, TIMESTAMP_COLUMN]
+        if metadata.get("load_start"):
+            load_starts[run_id] = pd.Timestamp(datetime.fromisoformat(metadata["load_start"]))
+        elif not run_timestamps.empty:
+            load_starts[run_id] = run_timestamps.min()
+        duration = metadata.get("duration_s")
+        if duration is None and not run_timestamps.empty:
+            duration = (run_timestamps.max() - load_starts[run_id]).total_seconds()
+        if duration is not None:
+            durations.append(duration)
+
+    samples["offset_s"] = (samples[TIMESTAMP_COLUMN] - samples["run_id"].map(load_starts)).dt.total_seconds()
+    window_end = min(durations) if durations else np.inf
+    in_window = (samples["offset_s"] >= warmup_seconds) & (samples["offset_s"] <= window_end)
+    samples = samples[in_window & np.isfinite(samples[VALUE_COLUMN])]
+    return samples[["run_id", "service", "metric", "pod", "offset_s", VALUE_COLUMN]].reset_index(drop=True)
+
+
+def classify_change(relative_change, p_value, direction, alpha=COMPARE_ALPHA, min_change=MIN_RELATIVE_CHANGE):
+    if p_value is None or np.isnan(p_value) or p_value >= alpha or abs(relative_change) < min_change:
+        return "unchanged"
+    if direction == 0:
+        return "changed"
+    return "improvement" if np.sign(relative_change) == direction else "regression"
+
+
+def relative_change(before, after):
+    if before == after:
+        return 0.0
+    if before == 0:
+        return np.inf if after > 0 else -np.inf
+    return (after - before) / abs(before)
+
+
+def compare_series(baseline_values, candidate_values, direction=-1, alpha=COMPARE_ALPHA,
+                   min_change=MIN_RELATIVE_CHANGE):
+    """
+    Compares the sample distributions of one series in two runs with a two-sided
+    Mann-Whitney U test and the relative change of the median.
+
+    Consecutive samples are autocorrelated, so p-values are optimistic; min_change keeps
+    tiny but "significant" shifts from being flagged.
+    """
+    baseline_values = np.asarray(baseline_values, dtype=np.float64)
+    candidate_values = np.asarray(candidate_values, dtype=np.float64)
+    row = {
+        "n_baseline": len(baseline_values),
+        "n_candidate": len(candidate_values),
+        "median_baseline": float(np.median(baseline_values)) if len(baseline_values) else np.nan,
+        "median_candidate": float(np.median(candidate_values)) if len(candidate_values) else np.nan,
+        "mean_baseline": float(baseline_values.mean()) if len(baseline_values) else np.nan,
+        "mean_candidate": float(candidate_values.mean()) if len(candidate_values) else np.nan,
+    }
+    if min(len(baseline_values), len(candidate_values)) < MIN_SAMPLES:
+        return {**row, "delta": np.nan, "relative_change": np.nan, "p_value": np.nan, "status": "insufficient"}
+    row["delta"] = row["median_candidate"] - row["median_baseline"]
+    row["relative_change"] = relative_change(row["median_baseline"], row["median_candidate"])
+    if np.ptp(np.concatenate([baseline_values, candidate_values])) == 0:
+        row["p_value"] = 1.0
+    else:
+        row["p_value"] = float(mannwhitneyu(baseline_values, candidate_values, alternative="two-sided",
+                                            method="asymptotic").pvalue)
+    row["status"] = classify_change(row["relative_change"], row["p_value"], direction, alpha, min_change)
+    return row
+
+
+def compare_runs(baseline, candidate, store: RunStore = None, service=None, metric=None, alpha=COMPARE_ALPHA,
+                 min_change=MIN_RELATIVE_CHANGE, warmup_seconds=WARMUP_SECONDS, wrk2_dir=WRK2_STORE_DIR):
+    """
+    Compares every (service, metric) series stored for both runs over their aligned load
+    window. Pods are pooled per service, since a new build runs in new pods.
+
+    :return: DataFrame with one row per series: service, metric, sample counts, medians,
+        means, delta and relative_change of the median, p_value and status (regression,
+        improvement, changed, unchanged or insufficient), regressions first.
+    """
+    store = store or RunStore()
+    samples = aligned_samples(store, [baseline, candidate], service, metric, warmup_seconds, wrk2_dir)
+    rows = []
+    for (service_name, metric_name), series in samples.groupby(["service", "metric"], sort=True):
+        values = {run_id: run_series[VALUE_COLUMN].to_numpy() for run_id, run_series in series.groupby("run_id")}
+        if baseline not in values or candidate not in values:
+            continue
+        rows.append({
+            "service": service_name,
+            "metric": metric_name,
+            **compare_series(values[baseline], values[candidate], metric_direction(metric_name), alpha, min_change),
+        })
+    comparison = pd.DataFrame(rows)
+    if comparison.empty:
+        return comparison
+    order = comparison["status"].map({"regression": 0, "improvement": 1, "changed": 2, "unchanged": 3, "insufficient": 4})
+    comparison = comparison.assign(_order=order, _size=-comparison["relative_change"].abs())
+    return comparison.sort_values(["_order", "_size", "service", "metric"], ignore_index=True).drop(columns=["_order", "_size"])
+
+
+def compare_wrk2(baseline, candidate, min_change=MIN_RELATIVE_CHANGE, wrk2_dir=WRK2_STORE_DIR):
+    """
+    Compares the client-side wrk2 summaries of two runs. These are single numbers per run,
+    so changes are flagged on min_change alone.
+
+    :return: DataFrame with columns field, baseline, candidate, relative_change, status.
+    """
+    summaries = load_wrk2_summaries(wrk2_dir, [baseline, candidate])
+    if baseline not in summaries.index or candidate not in summaries.index:
+        return pd.DataFrame(columns=["field", "baseline", "candidate", "relative_change", "status"])
+    rows = []
+    for field, direction in WRK2_DIRECTIONS.items():
+        before, after = summaries.at[baseline, field], summaries.at[candidate, field]
+        if pd.isna(before) or pd.isna(after):
+            continue
+        change = relative_change(float(before), float(after))
+        rows.append({
+            "field": field,
+            "baseline": float(before),
+            "candidate": float(after),
+            "relative_change": change,
+            "status": classify_change(change, 0.0, direction, alpha=1.0, min_change=min_change),
+        })
+    return pd.DataFrame(rows, columns=["field", "baseline", "candidate", "relative_change", "status"])
+
+
+def comparison_report(baseline, candidate, comparison, wrk2_comparison, wrk2_dir=WRK2_STORE_DIR):
+    statuses = comparison["status"].value_counts().to_dict() if not comparison.empty else {}
+    return {
+        "baseline": baseline,
+        "candidate": candidate,
+        "test_params": {run_id: load_run_metadata(run_id, wrk2_dir).get("test_params") for run_id in (baseline, candidate)},
+        "regressions": int(statuses.get("regression", 0)),
+        "improvements": int(statuses.get("improvement", 0)),
+        "wrk2": wrk2_comparison.to_dict(orient="records"),
+        "series": comparison.replace({np.nan: None, np.inf: None, -np.inf: None}).to_dict(orient="records"),
+    }
+
+
+def save_comparison_report(report, output_dir=COMPARISON_OUTPUT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{report['baseline']}_vs_{report['candidate']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def print_comparison(report):
+    print(f"Run {report['candidate']} vs baseline {report['baseline']}: "
+          f"{report['regressions']} regressions, {report['improvements']} improvements")
+    params = report["test_params"]
+    if params[report["baseline"]] != params[report["candidate"]]:
+        print(f"  Note: wrk2 parameters differ: {params[report['baseline']]} vs {params[report['candidate']]}")
+    for row in report["wrk2"]:
+        if row["status"] != "unchanged":
+            print(f"  {row['status']:<11} wrk2 {row['field']}: {row['baseline']:.2f} -> {row['candidate']:.2f} "
+                  f"({row['relative_change']:+.1%})")
+    for row in report["series"]:
+        if row["status"] in ("regression", "improvement", "changed"):
+            change = f"{row['relative_change']:+.1%}" if row["relative_change"] is not None else "from 0"
+            print(f"  {row['status']:<11} {row['service']}/{row['metric']}: median {row['median_baseline']:.4g} -> "
+                  f"{row['median_candidate']:.4g} ({change}, p={row['p_value']:.2g})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a run against a baseline run and flag regressions.")
+    parser.add_argument("baseline", help="Baseline run id.")
+    parser.add_argument("candidate", nargs="?", default=None, help="Run to check, the latest run by default.")
+    parser.add_argument("--data-path", default="data", help="Directory holding the run store.")
+    parser.add_argument("--service", action="append", default=None, help="Only compare this service (repeatable).")
+    parser.add_argument("--metric", action="append", default=None, help="Only compare this metric (repeatable).")
+    parser.add_argument("--alpha", type=float, default=COMPARE_ALPHA, help="Significance level of the Mann-Whitney test.")
+    parser.add_argument("--min-change", type=float, default=MIN_RELATIVE_CHANGE,
+                        help="Smallest relative change of the median that is flagged.")
+    parser.add_argument("--warmup", type=float, default=WARMUP_SECONDS,
+                        help="Seconds after the load started to leave out.")
+    args = parser.parse_args()
+
+    store = RunStore(os.path.join(args.data_path, RUN_STORE_NAME))
+    wrk2_dir = os.path.join(args.data_path, os.path.basename(WRK2_STORE_DIR))
+    candidate = args.candidate or store.latest_run_id()
+    comparison = compare_runs(args.baseline, candidate, store, args.service, args.metric, args.alpha,
+                              args.min_change, args.warmup, wrk2_dir)
+    report = comparison_report(args.baseline, candidate, comparison,
+                               compare_wrk2(args.baseline, candidate, args.min_change, wrk2_dir), wrk2_dir)
+    print_comparison(report)
+    print(f"Comparison saved to {save_comparison_report(report)}")
@@ -0,0 +1,495 @@
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow.fs import LocalFileSystem
+
+from fetch_engine import step_to_seconds
+from metrics_decoder import TIMESTAMP_COLUMN, VALUE_COLUMN, label_columns
+from sketches import QuantileSketch, merge_sketches
+
+RUN_STORE_NAME = "run_store"
+RUN_STORE_DIR = os.path.join("data", RUN_STORE_NAME)
+
+PARTITION_SCHEMA = pa.schema([
+    ("run_id", pa.string()),
+    ("service", pa.string()),
+    ("metric", pa.string()),
+])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+
+# Rollups live under <root>/_rollups/tier=<tier>/ with the same partitioning as the raw
+# samples; pyarrow skips "_"-prefixed directories, so raw reads never see them
+ROLLUP_DIR_NAME = "_rollups"
+# Tier name -> bucket width in seconds, finest first
+ROLLUP_TIERS = {"1m": 60, "5m": 300, "1h": 3600}
+ROLLUP_GROUP_COLUMNS = ["pod", "labels", TIMESTAMP_COLUMN]
+# Latency sketches (see latency_sketches.py) live under <root>/_sketches/, same partitioning
+SKETCH_DIR_NAME = "_sketches"
+# Run ids are the start time of the run, e.g. "20250322-211642"
+RUN_ID_FORMAT = "%Y%m%d-%H%M%S"
+
+def new_run_id(now=None):
+    """
+    Returns a sortable run identifier such as "20250322-211642".
+    """
+    return (now or datetime.now()).strftime(RUN_ID_FORMAT)
+
+
+def _dictionary_column(codes, values):
+    return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), pa.array(values, type=pa.string()))
+
+
+def _labels_column(metrics_df):
+    """
+    Encodes each row's full label set as a dictionary column of 'name="value",...' strings.
+    """
+    names = [name for name in label_columns(metrics_df) if name != "pod"]
+    if not names:
+        return _dictionary_column(np.zeros(len(metrics_df), dtype=np.int32), [""])
+    codes, uniques = pd.MultiIndex.from_frame(metrics_df[names].astype(str)).factorize()
+    strings = [",".join(f'{name}="{value}"' for name, value in zip(names, key) if value) for key in uniques]
+    return _dictionary_column(codes, strings)
+
+
+def to_sample_table(run_id, service, metric, metrics_df):
+    """
+    Converts a decoded metrics DataFrame into an Arrow table matching the store layout.
+    """
+    rows = len(metrics_df)
+    if "pod" in metrics_df:
+        codes, pods = pd.factorize(metrics_df["pod"].astype(str))
+    else:
+        codes, pods = np.zeros(rows, dtype=np.int32), [""]
+    return pa.table({
+        "pod": _dictionary_column(codes, list(pods)),
+        "labels": _labels_column(metrics_df),
+        TIMESTAMP_COLUMN: pa.array(metrics_df[TIMESTAMP_COLUMN].to_numpy(dtype="datetime64[ms]"), type=pa.timestamp("ms")),
+        VALUE_COLUMN: pa.array(metrics_df[VALUE_COLUMN].to_numpy(dtype=np.float64)),
+        "run_id": pa.array([run_id] * rows, type=pa.string()),
+        "service": pa.array([service] * rows, type=pa.string()),
+        "metric": pa.array([metric] * rows, type=pa.string()),
+    })
+
+
+def rollup_samples(table, tier_seconds):
+    """
+    Buckets a sample table (see to_sample_table) into tier_seconds-wide buckets per pod and
+    label set, with count/sum/min/max of the finite values and a serialized QuantileSketch.
+
+    :return: DataFrame with columns pod, labels, timestamp (bucket start), count, sum, min, max, sketch.
+    """
+    samples = pa.table({
+        "pod": table["pod"].cast(pa.string()),
+        "labels": table["labels"].cast(pa.string()),
+        TIMESTAMP_COLUMN: table[TIMESTAMP_COLUMN],
+        VALUE_COLUMN: table[VALUE_COLUMN],
+    }).to_pandas()
+    samples = samples[np.isfinite(samples[VALUE_COLUMN])]
+    samples[TIMESTAMP_COLUMN] = samples[TIMESTAMP_COLUMN].dt.floor(f"{tier_seconds}s")
+    grouped = samples.groupby(ROLLUP_GROUP_COLUMNS, sort=True)[VALUE_COLUMN]
+    rollup = grouped.agg(["count", "sum", "min", "max"]).reset_index()
+    # Split the values by group number, which follows the same sorted order as agg
+    group_ids = grouped.ngroup().to_numpy()
+    order = np.argsort(group_ids, kind="stable")
+    boundaries = np.flatnonzero(np.diff(group_ids[order])) + 1
+    sketches = []
+    for values in np.split(samples[VALUE_COLUMN].to_numpy()[order], boundaries) if len(order) else []:
+        sketch = QuantileSketch()
+        sketch.add(values)
+        sketches.append(sketch.to_bytes())
+    rollup["sketch"] = sketches
+    return rollup
+
+
+def merge_rollups(rollup):
+    """
+    Combines rows of a rollup DataFrame that cover the same pod, label set and bucket,
+    e.g. partial buckets written by consecutive appends.
+    """
+    if not rollup.duplicated(ROLLUP_GROUP_COLUMNS).any():
+        return rollup
+    grouped = rollup.groupby(ROLLUP_GROUP_COLUMNS, sort=True, observed=True)
+    merged = grouped.agg({"count": "sum", "sum": "sum", "min": "min", "max": "max"}).reset_index()
+    merged["sketch"] = [merge_sketches(sketches).to_bytes() for _, sketches in grouped["sketch"]]
+    return merged
+
+
+def to_rollup_table(run_id, service, metric, rollup):
+    rows = len(rollup)
+    pod_codes, pods = pd.factorize(rollup["pod"].astype(str))
+    label_codes, labels = pd.factorize(rollup["labels"].astype(str))
+    return pa.table({
+        "pod": _dictionary_column(pod_codes, list(pods)),
+        "labels": _dictionary_column(label_codes, list(labels)),
+        TIMESTAMP_COLUMN: pa.array(rollup[TIMESTAMP_COLUMN].to_numpy(dtype="datetime64[ms]"), type=pa.timestamp("ms")),
+        "count": pa.array(rollup["count"].to_numpy(dtype=np.int64)),
+        "sum": pa.array(rollup["sum"].to_numpy(dtype=np.float64)),
+        "min": pa.array(rollup["min"].to_numpy(dtype=np.float64)),
+        "max": pa.array(rollup["max"].to_numpy(dtype=np.float64)),
+        "sketch": pa.array(list(rollup["sketch"]), type=pa.binary()),
+        "run_id": pa.array([run_id] * rows, type=pa.string()),
+        "service": pa.array([service] * rows, type=pa.string()),
+        "metric": pa.array([metric] * rows, type=pa.string()),
+    })
+
+
+def to_sketch_table(run_id, service, metric, sketches):
+    rows = len(sketches)
+    pod_codes, pods = pd.factorize(sketches["pod"].astype(str))
+    return pa.table({
+        "pod": _dictionary_column(pod_codes, list(pods)),
+        TIMESTAMP_COLUMN: pa.array(sketches[TIMESTAMP_COLUMN].to_numpy(dtype="datetime64[ms]"), type=pa.timestamp("ms")),
+        "count": pa.array(sketches["count"].to_numpy(dtype=np.float64)),
+        "sketch": pa.array(list(sketches["sketch"]), type=pa.binary()),
+        "run_id": pa.array([run_id] * rows, type=pa.string()),
+        "service": pa.array([service] * rows, type=pa.string()),
+        "metric": pa.array([metric] * rows, type=pa.string()),
+    })
+
+
+def tier_for_resolution(resolution):
+    """
+    Returns the coarsest rollup tier whose buckets are no wider than resolution
+    (seconds or a duration such as "5m"), or None if only raw samples are fine enough.
+    """
+    seconds = step_to_seconds(resolution)
+    fitting = [tier for tier, width in ROLLUP_TIERS.items() if width <= seconds]
+    return fitting[-1] if fitting else None
+
+
+class RunStore:
+    """
+    Parquet dataset holding every collected sample, partitioned as
+    <root>/run_id=<run>/service=<service>/metric=<metric>/part-*.parquet.
+
+    Each fetch result is appended as its own file, so a run can be written while it is
+    still being collected, and reads only touch the partitions matching their filters.
+
+    Every append also updates the rollup tiers (ROLLUP_TIERS) under <root>/_rollups/, which
+    read_rollup_df serves coarse-resolution reads from.
+    """
+
+    def __init__(self, root=RUN_STORE_DIR, rollups=True):
+        self.root = root
+        self.rollups = rollups
+        os.makedirs(self.root, exist_ok=True)
+
+    def rollup_root(self, tier):
+        return os.path.join(self.root, ROLLUP_DIR_NAME, f"tier={tier}")
+
+    def append(self, run_id, service, metric, metrics_df):
+        """
+        Appends one service/metric result (as returned by metrics_decoder.decode_result) to a run.
+        """
+        if metrics_df is None or metrics_df.empty:
+            return
+        table = to_sample_table(run_id, service, metric, metrics_df)
+        ds.write_dataset(
+            table,
+            self.root,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        if self.rollups:
+            for tier, width in ROLLUP_TIERS.items():
+                self._write_rollup(tier, run_id, service, metric, rollup_samples(table, width))
+
+    def delete_series(self, run_id, service, metric, rollups=True):
+        """
+        Removes one service/metric series of a run, raw samples and (if rollups is set) its
+        rollups, e.g. before rewriting series derived from other ones.
+        """
+        partitions = [self.partition_path(run_id, service, metric)]
+        if rollups:
+            partitions += [self._rollup_partition(tier, run_id, service, metric) for tier in ROLLUP_TIERS]
+        for partition in partitions:
+            if os.path.isdir(partition):
+                shutil.rmtree(partition)
+
+    def _write_rollup(self, tier, run_id, service, metric, rollup):
+        if rollup.empty:
+            return
+        ds.write_dataset(
+            to_rollup_table(run_id, service, metric, rollup),
+            self.rollup_root(tier),
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def _rollup_partition(self, tier, run_id, service, metric):
+        return os.path.join(self.rollup_root(tier), f"run_id={run_id}", f"service={service}", f"metric={metric}")
+
+    def _read_rollup_partition(self, partition):
+        files = sorted(os.path.join(partition, name) for name in os.listdir(partition) if name.endswith(".parquet"))
+        table = pa.concat_tables([pq.read_table(path, partitioning=None) for path in files], promote_options="permissive")
+        return files, table.to_pandas()
+
+    def has_rollups(self, run_id):
+        return all(os.path.isdir(os.path.join(self.rollup_root(tier), f"run_id={run_id}")) for tier in ROLLUP_TIERS)
+
+    def compact_rollups(self, run_id):
+        """
+        Merges the partial buckets appended to each rollup partition of a run into one file.
+        """
+        for tier in ROLLUP_TIERS:
+            for service, metric in self.series_keys(run_id):
+                partition = self._rollup_partition(tier, run_id, service, metric)
+                if not os.path.isdir(partition):
+                    continue
+                files, rollup = self._read_rollup_partition(partition)
+                if len(files) < 2:
+                    continue
+                merged = merge_rollups(rollup)
+                table = to_rollup_table(run_id, service, metric, merged).drop_columns(list(PARTITION_SCHEMA.names))
+                pq.write_table(table, os.path.join(partition, f"part-{uuid.uuid4().hex}-0.parquet"))
+                for path in files:
+                    os.remove(path)
+
+    def build_rollups(self, run_id):
+        """
+        (Re)builds every rollup tier of a run from its raw samples, e.g. for runs stored
+        before rollups existed.
+
+        :return: Number of series rolled up.
+        """
+        for tier in ROLLUP_TIERS:
+            run_path = os.path.join(self.rollup_root(tier), f"run_id={run_id}")
+            if os.path.isdir(run_path):
+                shutil.rmtree(run_path)
+        series_keys = self.series_keys(run_id)
+        for service, metric in series_keys:
+            table = self.read(columns=["pod", "labels", TIMESTAMP_COLUMN, VALUE_COLUMN],
+                              run_id=run_id, service=service, metric=metric)
+            for tier, width in ROLLUP_TIERS.items():
+                self._write_rollup(tier, run_id, service, metric, rollup_samples(table, width))
+        return len(series_keys)
+
+    def compact(self, run_id):
+        """
+        Rewrites every partition of a run that holds several appended files as a single
+        file sorted by pod and timestamp. Live collection appends one small file per poll.
+
+        :return: Number of partitions rewritten.
+        """
+        rewritten = 0
+        for service, metric in self.series_keys(run_id):
+            partition = self.partition_path(run_id, service, metric)
+            files = sorted(
+                os.path.join(partition, name) for name in os.listdir(partition) if name.endswith(".parquet")
+            )
+            if len(files) < 2:
+                continue
+            table = pa.concat_tables([pq.read_table(path) for path in files], promote_options="permissive")
+            # Dictionary columns can't be sort keys, so sort on a decoded copy of pod
+            order = pc.sort_indices(
+                pa.table({"pod": table["pod"].cast(pa.string()), TIMESTAMP_COLUMN: table[TIMESTAMP_COLUMN]}),
+                sort_keys=[("pod", "ascending"), (TIMESTAMP_COLUMN, "ascending")],
+            )
+            table = table.take(order)
+            pq.write_table(table, os.path.join(partition, f"part-{uuid.uuid4().hex}-0.parquet"))
+            for path in files:
+                os.remove(path)
+            rewritten += 1
+        if self.rollups:
+            self.compact_rollups(run_id)
+        return rewritten
+
+    def dataset(self, memory_map=True):
+        """
+        Opens the whole store as a pyarrow dataset; files are memory-mapped when memory_map is set.
+        """
+        return ds.dataset(
+            self.root,
+            format="parquet",
+            partitioning=PARTITIONING,
+            filesystem=LocalFileSystem(use_mmap=memory_map),
+        )
+
+    def run_ids(self):
+        """
+        Returns all stored run ids, oldest first.
+        """
+        prefix = "run_id="
+        return sorted(
+            entry[len(prefix):] for entry in os.listdir(self.root)
+            if entry.startswith(prefix) and os.path.isdir(os.path.join(self.root, entry))
+        )
+
+    def latest_run_id(self):
+        run_ids = self.run_ids()
+        return run_ids[-1] if run_ids else None
+
+    def partition_path(self, run_id, service=None, metric=None):
+        """
+        Returns the directory holding a run, or one of its service/metric partitions.
+        """
+        path = os.path.join(self.root, f"run_id={run_id}")
+        if service is not None:
+            path = os.path.join(path, f"service={service}")
+        if metric is not None:
+            path = os.path.join(path, f"metric={metric}")
+        return path
+
+    def series_keys(self, run_id):
+        """
+        Returns the (service, metric) pairs stored for a run, from the directory layout alone.
+        """
+        run_path = self.partition_path(run_id)
+        keys = []
+        if not os.path.isdir(run_path):
+            return keys
+        for service_entry in sorted(os.listdir(run_path)):
+            service_path = os.path.join(run_path, service_entry)
+            if not service_entry.startswith("service=") or not os.path.isdir(service_path):
+                continue
+            for metric_entry in sorted(os.listdir(service_path)):
+                if metric_entry.startswith("metric="):
+                    keys.append((service_entry[len("service="):], metric_entry[len("metric="):]))
+        return keys
+
+    @staticmethod
+    def _filter_expression(filter=None, run_id=None, service=None, metric=None, pod=None):
+        expression = filter
+        for name, wanted in (("run_id", run_id), ("service", service), ("metric", metric), ("pod", pod)):
+            if wanted is None:
+                continue
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            condition = ds.field(name).isin(wanted)
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def read(self, columns=None, run_id=None, service=None, metric=None, pod=None, filter=None, memory_map=True):
+        """
+        Reads samples as an Arrow table, pushing column selection and filters down to the files.
+
+        :param columns: Columns to load, all if None.
+        :param run_id: Run id or list of run ids to keep.
+        :param service: Service name or list of names to keep.
+        :param metric: Metric name or list of names to keep.
+        :param pod: Pod name or list of names to keep.
+        :param filter: Extra pyarrow.dataset expression, ANDed with the above.
+        :param memory_map: Memory-map the Parquet files instead of reading them into buffers.
+        """
+        expression = self._filter_expression(filter, run_id, service, metric, pod)
+        return self.dataset(memory_map).to_table(columns=columns, filter=expression)
+
+    def iter_batches(self, columns=None, batch_size=65536, run_id=None, service=None, metric=None, pod=None,
+                     filter=None, memory_map=True):
+        """
+        Same filters as read, but yields record batches so memory stays bounded by batch_size.
+        """
+        expression = self._filter_expression(filter, run_id, service, metric, pod)
+        yield from self.dataset(memory_map).to_batches(columns=columns, filter=expression, batch_size=batch_size)
+
+    def read_df(self, **kwargs):
+        """
+        Same as read, returned as a pandas DataFrame.
+        """
+        return self.read(**kwargs).to_pandas()
+
+    def append_sketches(self, run_id, service, metric, sketches):
+        """
+        Appends serialized quantile sketches, one row per pod and time slice.
+
+        :param sketches: DataFrame with columns pod, timestamp (slice start), count and sketch
+            (bytes from QuantileSketch.to_bytes).
+        """
+        if sketches is None or sketches.empty:
+            return
+        ds.write_dataset(
+            to_sketch_table(run_id, service, metric, sketches),
+            os.path.join(self.root, SKETCH_DIR_NAME),
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def read_sketches(self, run_id=None, service=None, metric=None, pod=None, filter=None):
+        """
+        Reads stored sketches as a DataFrame with columns run_id, service, metric, pod,
+        timestamp, count and sketch. Same filters as read.
+        """
+        root = os.path.join(self.root, SKETCH_DIR_NAME)
+        if not os.path.isdir(root):
+            return pd.DataFrame(columns=["run_id", "service", "metric", "pod", TIMESTAMP_COLUMN, "count", "sketch"])
+        expression = self._filter_expression(filter, run_id, service, metric, pod)
+        return ds.dataset(root, format="parquet", partitioning=PARTITIONING).to_table(filter=expression).to_pandas()
+
+    def read_rollup_df(self, resolution, run_id=None, service=None, metric=None, pod=None, quantiles=()):
+        """
+        Reads samples at a coarser resolution from the coarsest rollup tier whose buckets are
+        no wider than resolution, falling back to raw samples when no tier is fine enough.
+        Partial buckets are merged, so the result has one row per pod, label set and bucket.
+
+        :param resolution: Wanted resolution, in seconds or as a duration such as "5m".
+        :param quantiles: Quantiles (0-1) to compute per bucket from the sketches, as p<q*100> columns.
+        :return: DataFrame with columns run_id, service, metric, pod, labels, timestamp, count,
+            sum, min, max, value (the bucket mean), the requested quantiles and, when read from
+            a tier, sketch (serialized QuantileSketch, see sketches.merge_sketches).
+        """
+        tier = tier_for_resolution(resolution)
+        if tier is None:
+            samples = self.read_df(
+                columns=["run_id", "service", "metric", "pod", "labels", TIMESTAMP_COLUMN, VALUE_COLUMN],
+                run_id=run_id, service=service, metric=metric, pod=pod,
+            )
+            for column in ("sum", "min", "max"):
+                samples[column] = samples[VALUE_COLUMN]
+            samples["count"] = np.isfinite(samples[VALUE_COLUMN]).astype(np.int64)
+            for q in quantiles:
+                samples[f"p{q * 100:g}"] = samples[VALUE_COLUMN]
+            return samples
+
+        root = self.rollup_root(tier)
+        if not os.path.isdir(root):
+            return pd.DataFrame()
+        expression = self._filter_expression(None, run_id, service, metric, pod)
+        rollup = ds.dataset(root, format="parquet", partitioning=PARTITIONING).to_table(filter=expression).to_pandas()
+        if rollup.empty:
+            return rollup
+        parts = []
+        for (run, service_name, metric_name), part in rollup.groupby(["run_id", "service", "metric"], sort=True, observed=True):
+            part = merge_rollups(part.drop(columns=["run_id", "service", "metric"]).astype({"pod": str, "labels": str}))
+            part.insert(0, "metric", metric_name)
+            part.insert(0, "service", service_name)
+            part.insert(0, "run_id", run)
+            parts.append(part)
+        rollup = pd.concat(parts, ignore_index=True)
+        rollup[VALUE_COLUMN] = rollup["sum"] / rollup["count"]
+        for q in quantiles:
+            rollup[f"p{q * 100:g}"] = [QuantileSketch.from_bytes(data).quantile(q) for data in rollup["sketch"]]
+        return rollup
+
+
+def import_csv_directory(store: RunStore, run_id, data_path="data"):
+    """
+    Imports a legacy data/<service>/<metric>.csv tree into the store as one run.
+
+    :return: Number of service/metric series imported.
+    """
+    imported = 0
+    for service in sorted(os.listdir(data_path)):
+        service_path = os.path.join(data_path, service)
+        if not os.path.isdir(service_path) or os.path.abspath(service_path) == os.path.abspath(store.root):
+            continue
+        for file_name in sorted(os.listdir(service_path)):
+            if not file_name.endswith(".csv"):
+                continue
+            metrics_df = pd.read_csv(os.path.join(service_path, file_name), parse_dates=[TIMESTAMP_COLUMN])
+            metrics_df = metrics_df.drop(columns=[c for c in metrics_df.columns if c.startswith("Unnamed")])
+            store.append(run_id, service, file_name[:-len(".csv")], metrics_df)
+            imported += 1
+    return imported
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import math
+import os
+
+import matplotlib.pyplot as plt
+import networkx as nx
+import pandas as pd
+
+LAYOUT_SEED = 42
+# One <structure_key>.json per graph structure; per-run slices produce many distinct edge
+# sets, so only the most recently used layouts are kept
+LAYOUT_CACHE_DIR = "visualizations/network_layouts"
+MAX_CACHED_LAYOUTS = 64
+
+# Per-service metrics from aggregate_data.summarize_service_metrics attached to the nodes (their mean)
+GRAPH_METRICS = ("cpu_usage_per_pod", "memory_usage_per_pod", "http_request_latency_95th", "total_http_requests")
+
+
+def dependency_entries(network_map):
+    """
+    Returns the {parent, child, callCount} entries of a Jaeger dependencies response, which
+    holds them under "data" (the /api/dependencies response) or "dependencies".
+    """
+    if isinstance(network_map, list):
+        return network_map
+    return network_map.get("data") or network_map.get("dependencies") or []
+
+
+def evict_layouts(cache_dir=LAYOUT_CACHE_DIR, keep=MAX_CACHED_LAYOUTS):
+    """
+    Deletes all but the keep most recently used layout files.
+    """
+    paths = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".json")]
+    for path in sorted(paths, key=os.path.getmtime, reverse=True)[keep:]:
+        os.remove(path)
+
+
+class ServiceGraph:
+    """
+    Service dependency graph with Jaeger call counts as edge weights and per-service
+    metrics as node attributes. Loaded once, then queried in memory: children, fan-out
+    amplification, bottleneck ranking and a deterministic, cached drawing layout.
+    """
+
+    def __init__(self, graph: nx.DiGraph = None):
+        self.graph = graph if graph is not None else nx.DiGraph()
+        self._layout = None
+        self._layout_key = None
+
+    @classmethod
+    def from_network_map(cls, network_map):
+        graph = nx.DiGraph()
+        for entry in dependency_entries(network_map):
+            parent, child = entry["parent"], entry["child"]
+            calls = entry.get("callCount", 0)
+            # Jaeger can list the same pair more than once (e.g. per storage partition)
+            if graph.has_edge(parent, child):
+                graph[parent][child]["weight"] += calls
+            else:
+                graph.add_edge(parent, child, weight=calls)
+        return cls(graph)
+
+    @classmethod
+    def load(cls, network_map_path):
+        with open(network_map_path, "r") as f:
+            return cls.from_network_map(json.load(f))
+
+    @property
+    def services(self):
+        return sorted(self.graph.nodes)
+
+    def edges(self):
+        """
+        Returns the edges as {parent, child, callCount} entries, the Jaeger dependencies format.
+        """
+        return [
+            {"parent": parent, "child": child, "callCount": data["weight"]}
+            for parent, child, data in sorted(self.graph.edges(data=True))
+        ]
+
+    def children(self, service):
+        return [{"child": child, "callCount": data["weight"]} for child, data in self.graph[service].items()]
+
+    def to_parent_child_dict(self):
+        """
+        Returns {parent: [{"child": ..., "callCount": ...}, ...]} for every service that calls another.
+        """
+        return {service: self.children(service) for service in self.graph.nodes if self.graph.out_degree(service)}
+
+    def add_service_metrics(self, summaries, metrics=GRAPH_METRICS):
+        """
+        Attaches per-service metric means as node attributes.
+
+        :param summaries: {service: {metric: {"mean": ...}}}, as returned by
+            aggregate_data.summarize_service_metrics.
+        """
+        for service, service_metrics in summaries.items():
+            if service not in self.graph:
+                continue
+            for metric in metrics:
+                mean = service_metrics.get(metric, {}).get("mean")
+                if mean is not None:
+                    self.graph.nodes[service][metric] = mean
+        return self
+
+    def ingress_services(self):
+        """
+        Services nothing else calls: where requests enter the system.
+        """
+        return sorted(service for service in self.graph.nodes if not self.graph.in_degree(service))
+
+    def ingress_request_count(self):
+        """
+        Estimates the requests that entered the system as the largest call count out of an
+        ingress service, i.e. one first-hop call per request. Unlike a client-side count it is
+        subject to the same trace sampling as the edges.
+        """
+        first_hop = [data["weight"] for service in self.ingress_services()
+                     for _, _, data in self.graph.out_edges(service, data=True)]
+        return max(first_hop, default=0)
+
+    def fan_out_amplification(self, ingress_requests=None):
+        """
+        Downstream calls per ingress request, per service and overall.
+
+        :param ingress_requests: Number of requests that entered the system (e.g. wrk2's request
+            count for the same window). Defaults to ingress_request_count().
+        :return: ({service: incoming calls per ingress request}, total calls per ingress request)
+        """
+        if ingress_requests is None:
+            ingress_requests = self.ingress_request_count()
+        if not ingress_requests:
+            return {}, 0.0
+        incoming = {
+            service: sum(data["weight"] for _, _, data in self.graph.in_edges(service, data=True)) / ingress_requests
+            for service in self.graph.nodes
+        }
+        # Every ingress request is one call into an ingress service
+        for service in self.ingress_services():
+            incoming[service] = 1.0
+        total = sum(data["weight"] for _, _, data in self.graph.edges(data=True)) / ingress_requests
+        return incoming, total
+
+    def bottlenecks(self, sort_by="http_request_latency_95th", ingress_requests=None):
+        """
+        One row per service with call volume, amplification and attached metrics, sorted by
+        sort_by (descending). CPU per downstream call shows which services are expensive
+        per unit of work rather than just busy.
+        """
+        amplification, _ = self.fan_out_amplification(ingress_requests)
+        rows = []
+        for service in self.services:
+            node = self.graph.nodes[service]
+            calls = sum(data["weight"] for _, _, data in self.graph.in_edges(service, data=True))
+            row = {
+                "service": service,
+                "incoming_calls": calls,
+                "outgoing_calls": sum(data["weight"] for _, _, data in self.graph.out_edges(service, data=True)),
+                "calls_per_request": amplification.get(service, 0.0),
+                **{metric: node.get(metric) for metric in GRAPH_METRICS},
+            }
+            cpu = node.get("cpu_usage_per_pod")
+            row["cpu_per_call"] = cpu / calls if cpu is not None and calls else None
+            rows.append(row)
+        frame = pd.DataFrame(rows)
+        if sort_by in frame:
+            frame = frame.sort_values(sort_by, ascending=False, na_position="last", ignore_index=True)
+        return frame
+
+    def structure_key(self):
+        """
+        Hash of the node and edge set; layouts only change when it does.
+        """
+        structure = json.dumps([self.services, sorted(self.graph.edges)])
+        return hashlib.sha256(structure.encode()).hexdigest()
+
+    def layout(self, cache_dir=LAYOUT_CACHE_DIR, seed=LAYOUT_SEED):
+        """
+        Returns {service: (x, y)} from a seeded spring layout in which heavier call edges pull
+        services closer together (log-scaled weights). The layout is cached in memory and, if
+        cache_dir is set, on disk in <cache_dir>/<structure_key>.json, so the same graph is
+        drawn identically across runs. Only the MAX_CACHED_LAYOUTS most recently used files
+        are kept.
+        """
+        key = self.structure_key()
+        if self._layout is not None and self._layout_key == key:
+            return self._layout
+        cache_path = os.path.join(cache_dir, f"{key}.json") if cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                layout = {service: tuple(position) for service, position in json.load(f).items()}
+            # Mark it as recently used
+            os.utime(cache_path)
+        else:
+            weighted = nx.DiGraph()
+            weighted.add_nodes_from(sorted(self.graph.nodes))
+            for parent, child, data in sorted(self.graph.edges(data=True)):
+                weighted.add_edge(parent, child, layout_weight=1 + math.log1p(data["weight"]))
+            positions = nx.spring_layout(weighted, weight="layout_weight", seed=seed)
+            layout = {service: (float(x), float(y)) for service, (x, y) in positions.items()}
+            if cache_path:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(cache_path, "w") as f:
+                    json.dump(layout, f)
+                evict_layouts(cache_dir)
+        self._layout, self._layout_key = layout, key
+        return layout
+
+    def draw(self, save_path=None, cache_dir=LAYOUT_CACHE_DIR):
+        """
+        Draws the graph with edge widths scaled by call volume and call counts as edge labels,
+        saved to save_path or shown if it is None.
+        """
+        positions = self.layout(cache_dir)
+        weights = [data["weight"] for _, _, data in self.graph.edges(data=True)]
+        heaviest = max(weights, default=0) or 1
+        fig = plt.figure(figsize=(12, 8))
+        nx.draw(
+            self.graph, positions, with_labels=True, node_size=3000, node_color="lightblue",
+            font_size=10, font_weight="bold", width=[0.5 + 4 * weight / heaviest for weight in weights],
+        )
+        nx.draw_networkx_edge_labels(
+            self.graph, positions, font_size=8,
+            edge_labels={(parent, child): data["weight"] for parent, child, data in self.graph.edges(data=True)},
+        )
+        plt.title("Service Network Map")
+        if save_path is None:
+            plt.show()
+            return
+        os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+        fig.savefig(save_path)
+        plt.close(fig)
@@ -0,0 +1,191 @@
+import math
+import struct
+
+import numpy as np
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# Histogram buckets starting at 0 are spread from this fraction of their upper bound,
+# since log-spaced buckets can't reach 0
+MIN_BUCKET_FRACTION = 1e-3
+
+# relative_accuracy, zero_count, count, number of positive and negative buckets
+_HEADER = struct.Struct("<dddii")
+
+
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch (DDSketch style).
+
+    Values are counted in buckets whose bounds grow geometrically, so any quantile is
+    answered within `relative_accuracy` of the true value while memory stays bounded by
+    the dynamic range of the data rather than the number of samples.
+
+    Counts may be fractional (see add_weighted), e.g. request counts derived from rates.
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _bucket_counts(self, magnitudes):
+        indexes = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+        return zip(*np.unique(indexes, return_counts=True))
+
+    def add(self, values):
+        """
+        Adds a scalar or array of values; non-finite values are ignored.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return
+        self.count += int(values.size)
+        self.zero_count += int(np.count_nonzero(values == 0))
+        for buckets, magnitudes in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            if magnitudes.size:
+                for index, count in self._bucket_counts(magnitudes):
+                    buckets[int(index)] = buckets.get(int(index), 0) + int(count)
+
+    def add_weighted(self, values, weights):
+        """
+        Adds values with a count (weight) each; non-finite values and non-positive weights are ignored.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), values.shape).ravel()
+        keep = np.isfinite(values) & np.isfinite(weights) & (weights > 0)
+        values, weights = values[keep], weights[keep]
+        if not values.size:
+            return
+        self.count += float(weights.sum())
+        self.zero_count += float(weights[values == 0].sum())
+        for buckets, sign in ((self.positive, 1), (self.negative, -1)):
+            selected = sign * values > 0
+            if not selected.any():
+                continue
+            indexes = np.ceil(np.log(sign * values[selected]) / self._log_gamma).astype(np.int64)
+            unique, inverse = np.unique(indexes, return_inverse=True)
+            for index, weight in zip(unique.tolist(), np.bincount(inverse, weights[selected]).tolist()):
+                buckets[index] = buckets.get(index, 0) + weight
+
+    def add_histogram(self, upper_bounds, cumulative_counts):
+        """
+        Adds a Prometheus-style histogram: cumulative counts per upper bound ("le"), which
+        may include +Inf. Each bucket's count is spread uniformly over its value range, the
+        same assumption histogram_quantile makes; the +Inf bucket is counted at the largest
+        finite bound.
+        """
+        bounds = np.asarray(upper_bounds, dtype=np.float64)
+        cumulative = np.asarray(cumulative_counts, dtype=np.float64)
+        order = np.argsort(bounds)
+        bounds = bounds[order]
+        # Guard against counters that went slightly backwards between scrapes
+        cumulative = np.maximum.accumulate(np.nan_to_num(cumulative[order]))
+        counts = np.diff(cumulative, prepend=0.0)
+        finite = np.isfinite(bounds)
+        if not finite.any():
+            return
+        if not finite.all():
+            counts[np.flatnonzero(finite)[-1]] += counts[~finite].sum()
+        lower = np.concatenate([[0.0], bounds[:-1]])
+        for low, high, count in zip(lower[finite], bounds[finite], counts[finite]):
+            if count <= 0:
+                continue
+            low = max(low, high * MIN_BUCKET_FRACTION)
+            if high <= 0 or low >= high:
+                self.add_weighted([high], [count])
+                continue
+            first = math.ceil(math.log(low) / self._log_gamma)
+            last = math.ceil(math.log(high) / self._log_gamma)
+            indexes = np.arange(first, last + 1)
+            edges = np.clip(self.gamma ** np.concatenate([[first - 1], indexes]).astype(np.float64), low, high)
+            weights = np.diff(edges) / (high - low) * count
+            for index, weight in zip(indexes.tolist(), weights.tolist()):
+                if weight > 0:
+                    self.positive[index] = self.positive.get(index, 0) + weight
+            self.count += float(count)
+
+    def _bucket_value(self, index):
+        # Midpoint of the bucket (gamma^(i-1), gamma^i], which keeps the relative error bound
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        """
+        Returns the approximate q-quantile (0 <= q <= 1), or NaN if the sketch is empty.
+        """
+        if not self.count:
+            return float("nan")
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._bucket_value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._bucket_value(index)
+        return self._bucket_value(max(self.positive))
+
+    def merge(self, other: "QuantileSketch"):
+        """
+        Adds the counts of another sketch with the same accuracy into this one.
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy.")
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def to_bytes(self):
+        """
+        Serializes the sketch compactly: a fixed header followed by the bucket indexes
+        (int32) and counts (float64) of the positive and negative buckets.
+        """
+        parts = [_HEADER.pack(self.relative_accuracy, self.zero_count, self.count,
+                              len(self.positive), len(self.negative))]
+        for buckets in (self.positive, self.negative):
+            indexes = sorted(buckets)
+            parts.append(np.array(indexes, dtype="<i4").tobytes())
+            parts.append(np.array([buckets[index] for index in indexes], dtype="<f8").tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        relative_accuracy, zero_count, count, positive, negative = _HEADER.unpack_from(data)
+        sketch = cls(relative_accuracy)
+        sketch.zero_count = zero_count
+        sketch.count = count
+        offset = _HEADER.size
+        for buckets, size in ((sketch.positive, positive), (sketch.negative, negative)):
+            indexes = np.frombuffer(data, dtype="<i4", count=size, offset=offset)
+            offset += 4 * size
+            counts = np.frombuffer(data, dtype="<f8", count=size, offset=offset)
+            offset += 8 * size
+            buckets.update(zip(indexes.tolist(), counts.tolist()))
+        return sketch
+
+
+def merge_sketches(serialized):
+    """
+    Merges an iterable of serialized sketches (e.g. a rollup "sketch" column) into one.
+
+    :return: A QuantileSketch, empty if there was nothing to merge.
+    """
+    merged = None
+    for data in serialized:
+        if data is None:
+            continue
+        sketch = QuantileSketch.from_bytes(data)
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged if merged is not None else QuantileSketch()
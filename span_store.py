@@ -0,0 +1,272 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Jaeger reference types, in order of preference when picking a span's parent
+PARENT_REF_TYPES = ("CHILD_OF", "FOLLOWS_FROM")
+
+SPAN_COLUMNS = {
+    "trace": np.int32,        # index into SpanStore.trace_ids
+    "span_id": np.uint64,
+    "parent": np.int64,       # row of the parent span, -1 for roots (or parents that weren't sampled)
+    "service": np.int32,      # index into SpanStore.services
+    "operation": np.int32,    # index into SpanStore.operations
+    "start_us": np.int64,
+    "duration_us": np.int64,
+}
+# Columns that can be grouped by, with the string table holding their names
+GROUP_COLUMNS = {"service": "services", "operation": "operations"}
+STRINGS_FILE = "strings.json"
+
+
+class StringTable:
+    """
+    Interns strings: every distinct value is stored once and referred to by an int code.
+    """
+
+    def __init__(self, values=()):
+        self.values = []
+        self._codes = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def codes(self, values):
+        return np.fromiter((self.code(value) for value in values), dtype=np.int32)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class SpanStore:
+    """
+    Spans held as one NumPy array per column (SPAN_COLUMNS) with interned trace ids,
+    service and operation names, instead of Jaeger JSON dicts.
+
+    Traces are converted as they are added, so the JSON of a fetched page can be dropped
+    right away. Appended batches are concatenated lazily on first column access.
+
+    A store is saved as one .npy file per column plus the string tables, and loaded back
+    memory-mapped, so analysing millions of spans only pages in the columns it touches.
+    """
+
+    def __init__(self):
+        self.trace_ids = StringTable()
+        self.services = StringTable()
+        self.operations = StringTable()
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in SPAN_COLUMNS.items()}
+        self._pending = []
+
+    def __len__(self):
+        return len(self._columns["trace"]) + sum(len(batch["trace"]) for batch in self._pending)
+
+    def __getattr__(self, name):
+        if name in SPAN_COLUMNS:
+            return self.column(name)
+        raise AttributeError(name)
+
+    def column(self, name):
+        if self._pending:
+            batches = [self._columns, *self._pending]
+            self._columns = {column: np.concatenate([batch[column] for batch in batches]) for column in SPAN_COLUMNS}
+            self._pending = []
+        return self._columns[name]
+
+    def add_traces(self, traces):
+        """
+        Converts Jaeger /api/traces results (the "data" list) into columns and appends them.
+
+        :return: Number of spans added.
+        """
+        base = len(self)
+        rows = {name: [] for name in SPAN_COLUMNS}
+        parent_refs = []
+        for trace in traces:
+            spans = trace.get("spans", [])
+            if not spans:
+                continue
+            trace_code = self.trace_ids.code(trace.get("traceID") or spans[0]["traceID"])
+            processes = trace.get("processes", {})
+            first_row = base + len(rows["trace"])
+            rows_by_span_id = {}
+            for offset, span in enumerate(spans):
+                span_id = int(span["spanID"], 16)
+                rows_by_span_id[span_id] = first_row + offset
+                process = processes.get(span.get("processID"), span.get("process", {}))
+                rows["trace"].append(trace_code)
+                rows["span_id"].append(span_id)
+                rows["service"].append(self.services.code(process.get("serviceName", "")))
+                rows["operation"].append(self.operations.code(span.get("operationName", "")))
+                rows["start_us"].append(span["startTime"])
+                rows["duration_us"].append(span["duration"])
+            for span in spans:
+                parent_refs.append(rows_by_span_id.get(_parent_span_id(span), -1))
+        rows["parent"] = parent_refs
+        if not rows["trace"]:
+            return 0
+        self._pending.append({name: np.asarray(values, dtype=SPAN_COLUMNS[name]) for name, values in rows.items()})
+        return len(rows["trace"])
+
+    @property
+    def end_us(self):
+        return self.column("start_us") + self.column("duration_us")
+
+    def save(self, path):
+        """
+        Writes the store to directory path: <column>.npy per column and strings.json.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in SPAN_COLUMNS:
+            np.save(os.path.join(path, f"{name}.npy"), self.column(name))
+        with open(os.path.join(path, STRINGS_FILE), "w") as f:
+            json.dump({
+                "trace_ids": self.trace_ids.values,
+                "services": self.services.values,
+                "operations": self.operations.values,
+            }, f)
+
+    @classmethod
+    def load(cls, path, memory_map=True):
+        """
+        Opens a store written by save; columns are memory-mapped read-only when memory_map is set.
+        Spans added afterwards are appended to in-memory copies.
+        """
+        store = cls()
+        with open(os.path.join(path, STRINGS_FILE), "r") as f:
+            strings = json.load(f)
+        store.trace_ids = StringTable(strings["trace_ids"])
+        store.services = StringTable(strings["services"])
+        store.operations = StringTable(strings["operations"])
+        store._columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if memory_map else None)
+            for name in SPAN_COLUMNS
+        }
+        return store
+
+    def children(self):
+        """
+        Returns a CSR-style child index: the children of span i are
+        order[offsets[i]:offsets[i + 1]], latest-finishing first.
+        """
+        parent = self.parent
+        end_us = self.end_us
+        rows = np.flatnonzero(parent >= 0)
+        order = rows[np.lexsort((-end_us[rows], parent[rows]))]
+        offsets = np.searchsorted(parent[order], np.arange(len(parent) + 1))
+        return order, offsets
+
+    def parent_values(self, values, fill=-1):
+        """
+        Joins every span to its parent: returns values[parent] per span, fill for roots.
+
+        :param values: A column name or any array with one value per span.
+        """
+        values = self.column(values) if isinstance(values, str) else np.asarray(values)
+        parent = self.parent
+        joined = np.full(len(parent), fill, dtype=np.result_type(values.dtype, np.asarray(fill).dtype))
+        has_parent = parent >= 0
+        joined[has_parent] = values[parent[has_parent]]
+        return joined
+
+    def _group_codes(self, by):
+        by = [by] if isinstance(by, str) else list(by)
+        for name in by:
+            if name not in GROUP_COLUMNS:
+                raise ValueError(f"Cannot group by '{name}'. Use any of {tuple(GROUP_COLUMNS)}.")
+        # Combine the codes of all key columns into one int64 key per span
+        key = np.zeros(len(self), dtype=np.int64)
+        for name in by:
+            key = key * len(getattr(self, GROUP_COLUMNS[name])) + self.column(name)
+        return by, key
+
+    def group_by(self, by=("service", "operation"), values="duration_us", percentiles=(50, 95, 99), mask=None):
+        """
+        Aggregates a per-span value by service and/or operation.
+
+        :param by: "service", "operation" or both.
+        :param values: Column name or array with one value per span; durations by default.
+        :param percentiles: Percentiles (0-100) to compute per group.
+        :param mask: Optional boolean array selecting the spans to include.
+        :return: DataFrame with the group names, count, sum, mean, min, max and p<percentile> columns.
+        """
+        by, key = self._group_codes(by)
+        values = self.column(values) if isinstance(values, str) else np.asarray(values)
+        values = values.astype(np.float64)
+        if mask is not None:
+            key, values = key[mask], values[mask]
+        groups, inverse = np.unique(key, return_inverse=True)
+        # Sort by group, then value, so each group's values are a contiguous sorted run
+        order = np.lexsort((values, inverse))
+        sorted_values = values[order]
+        counts = np.bincount(inverse, minlength=len(groups))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.bincount(inverse, weights=values, minlength=len(groups))
+
+        result = {}
+        remaining = groups
+        for name in reversed(by):
+            table = getattr(self, GROUP_COLUMNS[name])
+            result[name] = np.asarray(table.values, dtype=object)[remaining % len(table)]
+            remaining = remaining // len(table)
+        result = {name: result[name] for name in by}
+        result.update({
+            "count": counts,
+            "sum": sums,
+            "mean": sums / np.maximum(counts, 1),
+            "min": sorted_values[starts] if len(groups) else np.empty(0),
+            "max": sorted_values[starts + counts - 1] if len(groups) else np.empty(0),
+        })
+        for percentile in percentiles:
+            # Nearest-rank percentile within each group's sorted run
+            rank = np.ceil(percentile / 100 * counts).astype(np.int64) - 1
+            result[f"p{percentile:g}"] = sorted_values[starts + np.clip(rank, 0, counts - 1)] if len(groups) else np.empty(0)
+        return pd.DataFrame(result)
+
+    def call_edges(self):
+        """
+        Parent-child join aggregated into service-to-service call counts, with the mean
+        duration of the child spans.
+
+        :return: DataFrame with columns parent, child, calls, mean_child_duration_ms.
+        """
+        parent = self.parent
+        has_parent = parent >= 0
+        size = len(self.services)
+        child_services = self.service[has_parent].astype(np.int64)
+        key = self.service[parent[has_parent]].astype(np.int64) * size + child_services
+        edges, inverse = np.unique(key, return_inverse=True)
+        calls = np.bincount(inverse, minlength=len(edges))
+        durations = np.bincount(inverse, weights=self.duration_us[has_parent], minlength=len(edges))
+        names = np.asarray(self.services.values, dtype=object)
+        return pd.DataFrame({
+            "parent": names[edges // size] if len(edges) else np.empty(0, dtype=object),
+            "child": names[edges % size] if len(edges) else np.empty(0, dtype=object),
+            "calls": calls,
+            "mean_child_duration_ms": durations / np.maximum(calls, 1) / 1000,
+        })
+
+    def service_names(self, codes):
+        return np.asarray(self.services.values, dtype=object)[codes]
+
+    def operation_names(self, codes):
+        return np.asarray(self.operations.values, dtype=object)[codes]
+
+
+def _parent_span_id(span):
+    references = span.get("references") or []
+    for ref_type in PARENT_REF_TYPES:
+        for reference in references:
+            if reference.get("refType") == ref_type:
+                return int(reference["spanID"], 16)
+    return None
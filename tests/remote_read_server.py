@@ -0,0 +1,154 @@
+import re
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import snappy
+
+from remote_read import (MATCHER_TYPES, REMOTE_READ_PATH, _FIXED64, _LENGTH_DELIMITED, _bytes_field, _encode_varint,
+                         _fields, _varint_field)
+
+# Test stand-in for Prometheus' remote-read endpoint: it answers SAMPLES requests from a fixed
+# set of series, so remote_read can be exercised without a cluster. Like remote_read itself, it
+# only implements the SAMPLES response type, not STREAMED_XOR_CHUNKS
+MATCHER_OPERATORS = {number: operator for operator, number in MATCHER_TYPES.items()}
+
+
+def decode_read_request(body):
+    """
+    Decodes a snappy-compressed prometheus.ReadRequest.
+
+    :return: List of (start_ms, end_ms, matchers) per query, matchers as (name, operator, value).
+    """
+    buffer = snappy.decompress(body)
+    queries = []
+    for number, wire_type, query in _fields(buffer, 0, len(buffer)):
+        if number != 1 or wire_type != _LENGTH_DELIMITED:
+            continue
+        start_ms = end_ms = 0
+        matchers = []
+        for query_number, _, value in _fields(buffer, *query):
+            if query_number == 1:
+                start_ms = value
+            elif query_number == 2:
+                end_ms = value
+            elif query_number == 3:
+                matcher = {1: 0, 2: "", 3: ""}
+                for matcher_number, matcher_type, field in _fields(buffer, *value):
+                    matcher[matcher_number] = buffer[field[0]:field[1]].decode() if matcher_type == _LENGTH_DELIMITED else field
+                matchers.append((matcher[2], MATCHER_OPERATORS[matcher[1]], matcher[3]))
+        queries.append((start_ms, end_ms, matchers))
+    return queries
+
+
+def encode_series(labels, timestamps, values):
+    """
+    Serialises one prometheus.TimeSeries, leaving zero values out like protobuf does.
+    """
+    message = b"".join(_bytes_field(1, _bytes_field(1, name) + _bytes_field(2, value)) for name, value in labels.items())
+    for timestamp, value in zip(timestamps, values):
+        sample = _encode_varint(1 << 3 | _FIXED64) + struct.pack("<d", value) if value else b""
+        message += _bytes_field(2, sample + _varint_field(2, int(timestamp)))
+    return message
+
+
+def encode_read_response(results):
+    """
+    Serialises a prometheus.ReadResponse of SAMPLES and returns it snappy-compressed.
+
+    :param results: One list of (labels, timestamps_ms, values) per query.
+    """
+    response = b""
+    for series in results:
+        response += _bytes_field(1, b"".join(_bytes_field(1, encode_series(*item)) for item in series))
+    return snappy.compress(response)
+
+
+def matches(labels, matchers):
+    """
+    Whether a series' labels satisfy every matcher; regex matchers are anchored like in PromQL.
+    """
+    for name, operator, value in matchers:
+        label = labels.get(name, "")
+        if operator == "=" and label != value or operator == "!=" and label == value:
+            return False
+        if operator == "=~" and not re.fullmatch(value, label) or operator == "!~" and re.fullmatch(value, label):
+            return False
+    return True
+
+
+def select_series(series, start_ms, end_ms, matchers):
+    """
+    The series matching the matchers, cut to their samples within [start_ms, end_ms].
+    """
+    selected = []
+    for labels, timestamps, values in series:
+        if not matches(labels, matchers):
+            continue
+        window = (timestamps >= start_ms) & (timestamps <= end_ms)
+        if window.any():
+            selected.append((labels, timestamps[window], values[window]))
+    return selected
+
+
+class RemoteReadHandler(BaseHTTPRequestHandler):
+    """
+    Serves POST /api/v1/read from server.series, a list of (labels, timestamps_ms, values)
+    with numpy arrays. Every decoded request is appended to server.requests.
+    """
+
+    def do_POST(self):
+        if self.path != REMOTE_READ_PATH:
+            self.send_error(404)
+            return
+        queries = decode_read_request(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests.append(queries)
+        body = encode_read_response([select_series(self.server.series, *query) for query in queries])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Encoding", "snappy")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(series, host="127.0.0.1", port=0):
+    """
+    Stand-in remote-read server for the series; port 0 picks a free port.
+    """
+    server = ThreadingHTTPServer((host, port), RemoteReadHandler)
+    server.series = series
+    server.requests = []
+    server.lock = threading.Lock()
+    return server
+
+
+def start_server(series, host="127.0.0.1", port=0):
+    """
+    Starts a stand-in remote-read server in a background thread.
+
+    :return: The server; its URL is f"http://{host}:{server.server_port}", stop it with shutdown().
+    """
+    server = make_server(series, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_series(services, start_ms, end_ms, interval_ms=15000, namespace="socialnetwork"):
+    """
+    A CPU counter per service pod plus one series without a pod, sampled every interval_ms.
+    """
+    timestamps = np.arange(start_ms - start_ms % interval_ms, end_ms + 1, interval_ms, dtype=np.int64)
+    series = [
+        ({"__name__": "container_cpu_usage_seconds_total", "namespace": namespace, "pod": f"{service}-0"},
+         timestamps, (timestamps - timestamps[0]) / 1000.0 * (index + 1))
+        for index, service in enumerate(services)
+    ]
+    series.append(({"__name__": "kube_node_info", "namespace": namespace}, timestamps, np.ones(len(timestamps))))
+    return series
+
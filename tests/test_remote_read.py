@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from http_client import HttpClient
+from remote_read import decode_read_response, encode_read_request, export_run, export_windows, selector_matchers
+from remote_read_server import decode_read_request, encode_read_response, start_server, synthetic_series
+from run_store import RunStore
+
+SERVICES = ["compose-post-service", "text-service"]
+END = datetime(2026, 1, 1, 12, 0)
+START = END - timedelta(minutes=25)
+
+
+def to_ms(time):
+    return int(time.timestamp() * 1000)
+
+
+@pytest.fixture
+def server():
+    server = start_server(synthetic_series(SERVICES, to_ms(START), to_ms(END)))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_export_windows_cover_the_window_without_overlap():
+    windows = export_windows(START, END, chunk_seconds=600)
+    assert len(windows) == 3
+    assert windows[0][0] == to_ms(START)
+    assert windows[-1][1] == to_ms(END)
+    for (_, previous_end), (start, _) in zip(windows, windows[1:]):
+        assert start == previous_end + 1
+
+
+def test_export_windows_of_a_short_window():
+    assert export_windows(START, START + timedelta(seconds=30)) == [(to_ms(START), to_ms(START) + 30000)]
+
+
+def test_read_request_and_response_round_trip():
+    matchers = selector_matchers('{namespace="socialnetwork", pod=~"text-.*", job!="node"}')
+    assert decode_read_request(encode_read_request(1000, 2000, matchers)) == [(1000, 2000, matchers)]
+
+    timestamps = np.array([1000, 2000, 3000], dtype=np.int64)
+    values = np.array([0.0, 1.5, -2.0])
+    [(labels, decoded_timestamps, decoded_values)] = decode_read_response(
+        encode_read_response([[({"__name__": "up", "pod": "a"}, timestamps, values)]])
+    )
+    assert labels == {"__name__": "up", "pod": "a"}
+    np.testing.assert_array_equal(decoded_timestamps, timestamps)
+    np.testing.assert_array_equal(decoded_values, values)
+
+
+def test_export_run_stores_every_sample_per_service(server, tmp_path):
+    prom = HttpClient().prometheus(f"http://127.0.0.1:{server.server_port}")
+    store = RunStore(str(tmp_path), rollups=False)
+
+    stored = export_run(prom, "run", START, END, SERVICES, store=store, chunk_seconds=600)
+
+    assert len(server.requests) == 3
+    assert all(matchers == [("namespace", "=", "socialnetwork")] for [(_, _, matchers)] in server.requests)
+    expected = sum(len(timestamps) for _, timestamps, _ in server.series)
+    assert stored == expected
+    samples = store.read_df(columns=["service", "metric", "timestamp", "value"], run_id="run")
+    assert len(samples) == expected
+    assert set(samples["service"].astype(str)) >= set(SERVICES)
+    text = samples[samples["service"] == "text-service"].sort_values("timestamp")
+    _, _, values = server.series[SERVICES.index("text-service")]
+    np.testing.assert_allclose(text["value"].to_numpy(), values)
+
+
+def test_export_run_with_a_selector(server, tmp_path):
+    prom = HttpClient().prometheus(f"http://127.0.0.1:{server.server_port}")
+    store = RunStore(str(tmp_path), rollups=False)
+
+    stored = export_run(prom, "run", START, END, SERVICES, selector='kube_node_info{namespace="socialnetwork"}',
+                        store=store, chunk_seconds=3600)
+
+    assert len(server.requests) == 1
+    assert stored == len(server.series[-1][1])
+    assert set(store.read_df(columns=["metric"], run_id="run")["metric"].astype(str)) == {"kube_node_info"}
@@ -1,11 +1,10 @@
 from prometheus_api_client import PrometheusConnect
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from datetime import datetime, timedelta
 import subprocess
 import json
 import os
+import argparse
+import tempfile
 from typing import Dict
 import time
 
@@ -16,9 +15,35 @@ from utils import (
     visualize_network_map,
     run_fetch_ports_script,
 )
+from fetch_engine import FetchJob, fetch_all, merge_results, source_key, split_range, step_to_seconds
+from query_planner import plan_queries, split_result
+from metrics_decoder import decode_result
+from run_store import RunStore, new_run_id
+from render import LinePlotJob, PlotRenderer, render_line_plot
+from live_collector import LiveCollector, error_rate_abort
+from wrk2_parser import parse_wrk2_output, save_wrk2_results, wrk2_summary
+from query_cache import QueryCache
+from latency_sketches import HISTOGRAM_METRICS, store_histogram_sketches, store_wrk2_sketches
+from jaeger_traces import analyze_run_traces, print_critical_path_report
+from dependency_snapshots import save_run_dependencies
+from efficiency import print_efficiency_summary, save_run_efficiency
+from promql import PromQLError, analyze_query
+from query_catalog import apply_retention, compile_catalog, validate_catalog
+from recording_rules import prepare_recording_rules, usable_recordings
+from remote_read import export_run
+from http_client import get_client
 # from dev.ssh_utils import manage_tunnels_with_port_forward
 
 BEFORE_AFTER_QUERY_LAG = 20
+# Concurrency limit and per-request timeout (seconds) for Prometheus fetches
+PROM_MAX_CONCURRENCY = 8
+PROM_REQUEST_TIMEOUT = 30
+# How plots are rendered: "parallel", "defer" (after all fetches finish) or "skip"
+RENDER_MODE = "defer"
+# Live mode aborts the load test once any service's 5xx error rate (%) goes above this
+LIVE_ABORT_5XX_RATE = 5.0
+# Per-run dependency snapshots are also stored in slices of this many seconds
+DEPENDENCY_SLICE_SECONDS = 60
 
 # PREREQUISITES:
 # 1. install wrk
@@ -47,18 +72,35 @@ metrics_output_dir = "data"
 for output_dir in metrics_output_dir, visualisation_output_dir:
     os.makedirs(output_dir, exist_ok=True)
 
-from prom_queries import PROMETHEUS_QUERIES
+from prom_queries import QUERY_CATALOG
 
 # Fetch metrics
-def fetch_metrics(prom: PrometheusConnect, query, start_time=None, end_time=None):
+def fetch_metrics(prom: PrometheusConnect, query, start_time=None, end_time=None, cache: QueryCache = None):
     try:
-        if "[5m]" in query or "[2m]" in query or "rate(" in query or "histogram_quantile(" in query:
-            result = prom.custom_query_range(
-                query=query,
-                start_time=start_time,
-                end_time=end_time,
-                step="15s"
-            )
+        info = analyze_query(query)
+        if info.range_query:
+            # Long windows get a coarser step (no wider than the query's range windows) and are
+            # fetched in chunks below the point limit
+            step = info.step_for(start_time, end_time)
+
+            def fetch_range(start, end):
+                return prom.custom_query_range(
+                    query=query,
+                    start_time=datetime.fromtimestamp(start),
+                    end_time=datetime.fromtimestamp(end),
+                    step=step
+                ), "OK"
+
+            result = []
+            for chunk_start, chunk_end in split_range(start_time, end_time, step):
+                if cache is not None:
+                    chunk, msg = cache.query_range(source_key(prom.url, prom.headers, prom.auth), query,
+                                                   chunk_start.timestamp(), chunk_end.timestamp(), step, fetch_range)
+                else:
+                    chunk, msg = fetch_range(chunk_start.timestamp(), chunk_end.timestamp())
+                if chunk is None:
+                    return None, msg
+                merge_results(result, chunk)
         else:
             result = prom.custom_query(query)
         return result, "OK"
@@ -71,44 +113,32 @@ def process_metrics(result, msg):
         print("Result is empty - msg from fetch:" + msg, end=" ", flush=True)
         return
 
-    data = []
-    for metric in result:
-        # If it's a range query, it will contain a "values" key
-        if "values" in metric:
-            for timestamp, value in metric["values"]:
-                data.append({"timestamp": datetime.fromtimestamp(float(timestamp)), "value": float(value)})
-        # If it's an instant query, it will have a "value" key
-        elif "value" in metric:
-            timestamp, value = metric["value"]
-            data.append({"timestamp": datetime.fromtimestamp(float(timestamp)), "value": float(value)})
-    if data:
-        return pd.DataFrame(data)
+    # Long format: one row per sample, with the series labels (pod, ...) as columns
+    metrics_df = decode_result(result)
+    if not metrics_df.empty:
+        return metrics_df
     else:
         raise ValueError("Metrics data is empty after processing.")
 
 
 
 # Visualize metrics with advanced features
-def plot_metrics(metrics_df, title, output_file=None):
+def plot_metrics(metrics_df, title, output_file):
     if "timestamp" not in metrics_df or "value" not in metrics_df:
         raise KeyError("Expected columns 'timestamp' and 'value' not found in the DataFrame.")
-    
-    sns.set(style="whitegrid")
-    plt.figure(figsize=(12, 8))
-    sns.lineplot(x="timestamp", y="value", data=metrics_df, label="Metric Value")
-    plt.title(title, fontsize=16)
-    plt.xlabel("Timestamp", fontsize=14)
-    plt.ylabel("Value", fontsize=14)
-    plt.legend()
-    plt.xticks(rotation=45)
-    
-    if output_file:
-        plt.savefig(output_file)
-        print(f"Plot saved to {output_file}",flush=True)
-    plt.show()
 
-# Run a test with wrk2
-def run_wrk2_test(test_params):
+    render_line_plot(LinePlotJob(
+        data=metrics_df,
+        output_path=output_file,
+        title=title,
+        hue="pod",
+        figsize=(12, 8),
+        style="whitegrid",
+        xtick_rotation=45,
+    ))
+    print(f"Plot saved to {output_file}",flush=True)
+
+def build_wrk2_command(test_params):
     command_list = [
         f"{wrk2_dir}/wrk",
         "-D exp",
@@ -120,12 +150,22 @@ def run_wrk2_test(test_params):
         f"-s {wrk2_script}",
         f"{test_params['url']}",
     ]
-    command = " ".join(command_list).strip()
+    return " ".join(command_list).strip()
+
+# Run a test with wrk2
+def run_wrk2_test(test_params):
+    command = build_wrk2_command(test_params)
     process = subprocess.run(command, shell=True, capture_output=True, text=True)
     if process.returncode != 0:
         raise RuntimeError(f"wrk2 test failed: {process.stderr}")
     return process.stdout
 
+# Start a wrk2 test without waiting for it to finish
+def start_wrk2_test(test_params, stdout, stderr):
+    # exec so that terminating the process stops wrk itself, not just the shell
+    command = "exec " + build_wrk2_command(test_params)
+    return subprocess.Popen(command, shell=True, stdout=stdout, stderr=stderr, text=True)
+
 # Serve visualizations for remote access
 def serve_visualizations(visualisation_output_dir, port=8082):
     import http.server
@@ -139,26 +179,52 @@ def serve_visualizations(visualisation_output_dir, port=8082):
 
 def connect_to_prometheus():
     print(f"[{get_current_utc_timestamp()}] Connecting to prometheus ... ", end="",flush=True)
-    prom = PrometheusConnect(url=prometheus_url, disable_ssl=True)
+    prom = get_client().prometheus(prometheus_url, disable_ssl=True)
     print("Connected" if verify_prometheus_connection(prom) else "Failed",flush=True)
     return prom
 
-def save_jaeger_network_map():
+def save_jaeger_network_map(run_id=None, start_time=None, end_time=None):
+    """
+    Fetches the Jaeger network map and saves it as the latest map in visualizations/. With a
+    run window the map covers exactly that window and is also stored per run (with
+    DEPENDENCY_SLICE_SECONDS slices) in data/dependencies/<run_id>.json for diffing.
+    """
     print(f"[{get_current_utc_timestamp()}] Getting network map from Jaeger...", end="")
-    network_map = get_jaeger_network_map(jaeger_url)
+    if run_id is not None:
+        network_map = save_run_dependencies(jaeger_url, run_id, start_time, end_time, DEPENDENCY_SLICE_SECONDS)
+    else:
+        network_map = get_jaeger_network_map(jaeger_url)
     network_map_filename = f"{visualisation_output_dir}/network_map"
     with open(f"{network_map_filename}.json", "w") as f:
         json.dump(network_map, f, indent=4)
     visualize_network_map(network_map, f"{network_map_filename}.png")
     return network_map
 
-def save_wrk2_outputs():
-    print(f"[{get_current_utc_timestamp()}] Running wrk2 test with {test_params}... ", end="",flush=True)
-    wrk2_output = run_wrk2_test(test_params)
+def save_trace_analysis(run_id, start_time, end_time):
+    """
+    Pulls the run's sampled traces from Jaeger and reports where end-to-end latency goes
+    along the critical path (see jaeger_traces.analyze_run_traces).
+    """
+    report = analyze_run_traces(jaeger_url, run_id, start_time, end_time)
+    print_critical_path_report(report)
+    return report
 
+def write_wrk2_output(wrk2_output, run_id, load_start, run_store: RunStore = None):
     with open(f"{visualisation_output_dir}/wrk2_output.json", "w") as f:
         json.dump(wrk2_output, f)
     print("Complete, output saved to ",f"{visualisation_output_dir}/wrk2_output.json",flush=True)
+
+    # Structured latency/throughput results, stored per run next to the Prometheus data
+    parsed = parse_wrk2_output(wrk2_output)
+    save_wrk2_results(parsed, run_id, test_params, load_start=load_start)
+    store_wrk2_sketches(run_store or RunStore(), run_id, parsed, load_start)
+    print(f"wrk2 summary for run {run_id}: {wrk2_summary(parsed)}", flush=True)
+
+def save_wrk2_outputs(run_id, run_store: RunStore = None):
+    print(f"[{get_current_utc_timestamp()}] Running wrk2 test with {test_params}... ", end="",flush=True)
+    load_start = datetime.now()
+    wrk2_output = run_wrk2_test(test_params)
+    write_wrk2_output(wrk2_output, run_id, load_start, run_store)
     return wrk2_output
 
 def run_prom_requests(prom, prom_queries:Dict[str, str], start_time, end_time):
@@ -196,87 +262,251 @@ def extract_services_from_network_map(network_map):
         services.add(dependency["child"])
     return services
 
-def generate_prometheus_queries_for_services(services, base_queries):
-    service_queries = {}
-    for service in services:
-        service_queries[service] = {}
-        for metric_name, base_query in base_queries.items():
-            # Don't mutate regex-based queries for replicas
-            if metric_name.startswith("replicas_"):
-                service_queries[service][metric_name] = base_query
-            else:
-                service_queries[service][metric_name] = base_query.replace("pod=~", f'pod=~"{service}"')
-    return service_queries
+def compile_service_queries(services, max_priority=None, recorded=()):
+    """
+    Compiles the query catalog for the discovered services (see query_catalog.compile_catalog).
+    """
+    return compile_catalog(QUERY_CATALOG, services, max_priority=max_priority, recorded=recorded)
 
+def install_catalog_rules():
+    """
+    Installs recording rules for the catalog's record=True templates, for the services in
+    the current Jaeger map, and waits for Prometheus to evaluate them. Recorded series only
+    exist from then on, so this runs before the run window opens.
 
-def save_metrics_and_visualizations(prom: PrometheusConnect, service_queries, start_time, end_time):
+    :return: (names of the recorded templates, services the rules cover)
+    """
+    services = extract_services_from_network_map(save_jaeger_network_map())
+    recorded = prepare_recording_rules(prometheus_url, QUERY_CATALOG, services)
+    if recorded:
+        # Cover the padding before the load as well
+        print(f"Waiting {BEFORE_AFTER_QUERY_LAG}s for the recorded series to cover the run window..", flush=True)
+        time.sleep(BEFORE_AFTER_QUERY_LAG)
+    return recorded, services
+
+
+def save_service_metric(run_store: RunStore, run_id, service, metric_name, metrics_df, renderer: PlotRenderer = None):
+    """
+    Appends one service's metric to the run store and hands its plot to the renderer, if any.
+    """
+    run_store.append(run_id, service, metric_name, metrics_df)
+    print(f"Metrics data for '{service}/{metric_name}' saved to run {run_id} in {run_store.root}", flush=True)
+
+    if renderer is not None:
+        renderer.submit(service_plot_job(service, metric_name, metrics_df))
+
+def service_plot_job(service, metric_name, metrics_df):
+    # One line per pod rather than averaging all pods together
+    return LinePlotJob(
+        data=metrics_df,
+        output_path=os.path.join(f"visualizations/{service}", f"{metric_name}.png"),
+        title=f"{metric_name.replace('_', ' ').title()} - {service}",
+        hue="pod",
+        grid=True,
+    )
+
+def render_run_plots(run_store: RunStore, run_id, render_mode=RENDER_MODE):
+    """
+    Renders the per-service plots of a run straight from the run store.
+    """
+    with PlotRenderer(mode=render_mode) as renderer:
+        for service, metric_name in run_store.series_keys(run_id):
+            metrics_df = run_store.read_df(
+                columns=["pod", "timestamp", "value"], run_id=run_id, service=service, metric=metric_name
+            )
+            renderer.submit(service_plot_job(service, metric_name, metrics_df))
+
+def save_metrics_and_visualizations(prom: PrometheusConnect, planned_queries, start_time, end_time,
+                                    run_store: RunStore = None, run_id=None,
+                                    max_workers=PROM_MAX_CONCURRENCY, timeout=PROM_REQUEST_TIMEOUT,
+                                    render_mode=RENDER_MODE, cache: QueryCache = None):
     """
     Fetches metrics for each service and saves data and visualizations.
+    Identical queries are sent once and their series split back out per service by pod or
+    service label; queries run concurrently in priority order (lowest number first), at the
+    catalog step if the query has one, results are saved as they arrive and plots are rendered in a
+    process pool (see render.PlotRenderer). Long windows are fetched in time chunks that are
+    appended to the store one by one and plotted from the store once complete.
     :param prom: Prometheus connection object.
-    :param service_queries: Dictionary of Prometheus queries per service.
+    :param planned_queries: Compiled catalog queries (see compile_service_queries), or a
+        dictionary of Prometheus queries per service.
     :param start_time: Start time for the metrics query.
     :param end_time: End time for the metrics query.
+    :param run_store: Store the samples are appended to, the default store if None.
+    :param run_id: Id the samples are stored under, a new one if None.
+    :param max_workers: Maximum number of concurrent Prometheus requests.
+    :param timeout: Per-request timeout in seconds.
+    :param render_mode: "parallel", "defer" or "skip".
+    :param cache: Optional QueryCache; range queries then only fetch what it doesn't hold yet.
     """
-    for service, queries in service_queries.items():
-        # Create directories for data and visualizations
-        data_dir = f"data/{service}"
-        viz_dir = f"visualizations/{service}"
-        os.makedirs(data_dir, exist_ok=True)
-        os.makedirs(viz_dir, exist_ok=True)
-
-        for metric_name, query in queries.items():
-            print(f"Fetching metrics for service '{service}', metric '{metric_name}'...", flush=True)
-            metrics, msg = fetch_metrics(prom, query, start_time, end_time)
-
-            try:
-                metrics_df = process_metrics(metrics, msg)
-                if metrics_df is not None:
-                    # Save data as CSV
-                    csv_path = os.path.join(data_dir, f"{metric_name}.csv")
-                    metrics_df.to_csv(csv_path, index=False)
-                    print(f"Metrics data saved to {csv_path}", flush=True)
-
-                    # Create visualization
-                    plt.figure(figsize=(10, 6))
-                    sns.lineplot(x="timestamp", y="value", data=metrics_df, label="Metric Value")
-                    plt.title(f"{metric_name.replace('_', ' ').title()} - {service}")
-                    plt.xlabel("Timestamp")
-                    plt.ylabel("Value")
-                    plt.grid(True)
-                    plot_path = os.path.join(viz_dir, f"{metric_name}.png")
-                    plt.savefig(plot_path)
-                    plt.close()
-                    print(f"Visualization saved to {plot_path}", flush=True)
-                else:
-                    print(f"No metrics found for service '{service}', metric '{metric_name}'.", flush=True)
-            except Exception as e:
-                print(f"Error processing metrics for service '{service}', metric '{metric_name}': {e}", flush=True)
-            
-            time.sleep(1)
+    run_store = run_store or RunStore()
+    run_id = run_id or new_run_id()
+    if isinstance(planned_queries, dict):
+        planned_queries = plan_queries(planned_queries)
+    jobs = []
+    for index, planned in sorted(enumerate(planned_queries), key=lambda item: item[1].priority):
+        try:
+            info = analyze_query(planned.query)
+        except PromQLError as e:
+            print(f"Skipping invalid query for {planned.metric_names}: {e}", flush=True)
+            continue
+        jobs.append(FetchJob(key=(index,), query=planned.query, range_query=info.range_query,
+                             step=(planned.step or info.step_for(start_time, end_time)) if info.range_query else None))
+
+    total = sum(len(planned.targets) for planned in planned_queries)
+    print(f"Fetching {len(jobs)} unique queries (from {total} service queries) "
+          f"with up to {max_workers} concurrent requests...", flush=True)
+    # (service, metric) series that arrived in several chunks, plotted once all are stored
+    chunked = set()
+    with PlotRenderer(mode=render_mode) as renderer:
+        for job, metrics, msg in fetch_all(prom, jobs, start_time, end_time, max_workers=max_workers, timeout=timeout,
+                                              cache=cache):
+            planned = planned_queries[job.key[0]]
+            split = split_result(planned, metrics)
+            if not split:
+                print(f"No metrics found for {', '.join(planned.metric_names)} - msg from fetch: {msg}", flush=True)
+                continue
+
+            for service, metric_name, series in split:
+                try:
+                    metrics_df = process_metrics(series, msg)
+                    if metrics_df is None:
+                        print(f"No metrics found for service '{service}', metric '{metric_name}'.", flush=True)
+                    elif metric_name in HISTOGRAM_METRICS:
+                        store_histogram_sketches(run_store, run_id, service, metric_name, metrics_df,
+                                                 step_to_seconds(job.step))
+                    elif job.chunk[1] > 1:
+                        save_service_metric(run_store, run_id, service, metric_name, metrics_df)
+                        chunked.add((service, metric_name))
+                    else:
+                        save_service_metric(run_store, run_id, service, metric_name, metrics_df, renderer)
+                except Exception as e:
+                    print(f"Error processing metrics for service '{service}', metric '{metric_name}': {e}", flush=True)
+
+        if chunked:
+            run_store.compact(run_id)
+            for service, metric_name in sorted(chunked):
+                metrics_df = run_store.read_df(
+                    columns=["pod", "timestamp", "value"], run_id=run_id, service=service, metric=metric_name
+                )
+                renderer.submit(service_plot_job(service, metric_name, metrics_df))
+
+def expire_raw_samples(run_store: RunStore):
+    """
+    Drops raw samples past their catalog retention, keeping the rollups (see query_catalog.apply_retention).
+    """
+    removed = apply_retention(run_store, QUERY_CATALOG)
+    if removed:
+        print(f"Dropped raw samples of {removed} series past their retention.", flush=True)
 
-def main():
+def run_live(prom, run_store: RunStore, run_id, traces=False, recording_rules=False, remote_read=False):
+    """
+    Runs wrk2 while polling Prometheus at the scrape interval, storing samples as they
+    arrive and printing rolling per-service summaries. The load is stopped early if the
+    5xx error rate goes above LIVE_ABORT_5XX_RATE or on Ctrl-C; aborted or failed runs keep
+    their samples but get no wrk2 results or efficiency summary.
+    """
+    # Services have to be known before the load starts so series can be split per service
+    if recording_rules:
+        recorded, services = install_catalog_rules()
+    else:
+        recorded, services = set(), extract_services_from_network_map(save_jaeger_network_map())
+    print(f"Services extracted: {services}", flush=True)
+    planned_queries = compile_service_queries(services, recorded=recorded)
+
+    start_time = datetime.now() - timedelta(seconds=BEFORE_AFTER_QUERY_LAG)
+    print(f"[{get_current_utc_timestamp()}] Running wrk2 test with {test_params} in live mode... ", flush=True)
+    with tempfile.TemporaryFile("w+") as stdout, tempfile.TemporaryFile("w+") as stderr:
+        load_start = datetime.now()
+        process = start_wrk2_test(test_params, stdout, stderr)
+        collector = LiveCollector(
+            prom, planned_queries, run_store, run_id, start_time,
+            max_workers=PROM_MAX_CONCURRENCY, timeout=PROM_REQUEST_TIMEOUT,
+            abort_if=error_rate_abort(LIVE_ABORT_5XX_RATE),
+        )
+        abort_reason = collector.run(process, end_padding=BEFORE_AFTER_QUERY_LAG)
+        stdout.seek(0)
+        stderr.seek(0)
+        wrk2_output, wrk2_errors = stdout.read(), stderr.read()
+
+    end_time = datetime.now()
+    if abort_reason:
+        print(f"Run {run_id} aborted early: {abort_reason}", flush=True)
+    elif process.returncode != 0:
+        abort_reason = f"wrk2 test failed: {wrk2_errors}"
+        print(abort_reason, flush=True)
+    if abort_reason:
+        # The load was cut short, so wrk2's output (if any) doesn't describe the run; keep the
+        # Prometheus samples collected so far, but no wrk2 results or per-request efficiency
+        print(f"Not saving wrk2 results or efficiency for run {run_id}.", flush=True)
+    else:
+        write_wrk2_output(wrk2_output, run_id, load_start, run_store)
+        print_efficiency_summary(save_run_efficiency(run_store, run_id))
+    render_run_plots(run_store, run_id)
+    save_jaeger_network_map(run_id, start_time, end_time)
+    expire_raw_samples(run_store)
+    if remote_read:
+        export_run(prom, run_id, start_time, end_time, services)
+    if traces:
+        save_trace_analysis(run_id, start_time, end_time)
+
+def main(live=False, use_cache=True, traces=False, recording_rules=False, remote_read=False):
     # Connect to Prometheus
     prom = connect_to_prometheus()
     
+    # Catch broken queries before a 10-minute load test rather than after it
+    validate_catalog(QUERY_CATALOG)
+
+    run_store = RunStore()
+    run_id = new_run_id()
+    print(f"Starting run {run_id}", flush=True)
+
+    if live:
+        run_live(prom, run_store, run_id, traces, recording_rules, remote_read)
+        return
+
+    recorded, rule_services = install_catalog_rules() if recording_rules else (set(), set())
+
     # Run wrk2 tests 
     start_time = datetime.now() - timedelta(seconds=BEFORE_AFTER_QUERY_LAG)
-    output_str = save_wrk2_outputs()
+    save_wrk2_outputs(run_id, run_store)
     end_time = datetime.now() + timedelta(seconds=BEFORE_AFTER_QUERY_LAG)
-    print("Completed! \n", output_str[:326])
     print(f"Now waiting for {BEFORE_AFTER_QUERY_LAG}s to allow time for prometheus scraping..")
     time.sleep(BEFORE_AFTER_QUERY_LAG)
-    # Collect Jaeger map
-    network_dict = save_jaeger_network_map()
+    # Collect the Jaeger map of the run window
+    network_dict = save_jaeger_network_map(run_id, start_time, end_time)
     # Extract services from Jaeger network map
     services = extract_services_from_network_map(network_dict)
     print(f"Services extracted: {services}", flush=True)
     
-    service_queries = generate_prometheus_queries_for_services(services, PROMETHEUS_QUERIES)
+    planned_queries = compile_service_queries(services, recorded=usable_recordings(QUERY_CATALOG, recorded, rule_services, services))
+
+    cache = QueryCache() if use_cache else None
+    save_metrics_and_visualizations(prom, planned_queries, start_time, end_time, run_store, run_id, cache=cache)
+    print_efficiency_summary(save_run_efficiency(run_store, run_id))
+    expire_raw_samples(run_store)
+    if remote_read:
+        export_run(prom, run_id, start_time, end_time, services)
 
-    save_metrics_and_visualizations(prom, service_queries, start_time, end_time)
+    if traces:
+        save_trace_analysis(run_id, start_time, end_time)
 
 
 # Main workflow
 if __name__ == "__main__":
-    main()
-    
+    parser = argparse.ArgumentParser(description="Run a wrk2 load test and collect Prometheus metrics and the Jaeger map.")
+    parser.add_argument("--live", action="store_true",
+                        help="Collect metrics while the load test runs instead of after it finishes.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always query Prometheus instead of reusing cached query results.")
+    parser.add_argument("--traces", action="store_true",
+                        help="Also fetch the run's traces from Jaeger and break down latency along the critical path.")
+    parser.add_argument("--recording-rules", action="store_true",
+                        help="Install Prometheus recording rules for the costliest catalog queries before the run "
+                             "and fetch the precomputed series instead.")
+    parser.add_argument("--remote-read", action="store_true",
+                        help="Also bulk-export the raw samples of the run window through Prometheus remote read.")
+    args = parser.parse_args()
+    main(live=args.live, use_cache=not args.no_cache, traces=args.traces, recording_rules=args.recording_rules,
+         remote_read=args.remote_read)
+    get_client().print_timings()
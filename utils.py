@@ -1,37 +1,18 @@
 from prometheus_api_client import PrometheusConnect
 from datetime import datetime
-import requests
 import json
-import networkx as nx
-import matplotlib.pyplot as plt
 import os
 import subprocess
 import re
 
+from http_client import get_client
+from service_graph import ServiceGraph
+
 def visualize_network_map(network_map, save_path=None):
-    G = nx.DiGraph()
-    if "dependencies" in network_map.keys():
-        for dependency in network_map["dependencies"]:
-            parent = dependency["parent"]
-            child = dependency["child"]
-            call_count = dependency.get("callCount", 0)
-            G.add_edge(parent, child, weight=call_count)
-    elif "data" in network_map.keys():
-        for dependency in network_map["data"]:
-            parent = dependency["parent"]
-            child = dependency["child"]
-            call_count = dependency.get("callCount", 0)
-            G.add_edge(parent, child, weight=call_count)
-
-    plt.figure(figsize=(12, 8))
-    pos = nx.spring_layout(G)
-    nx.draw(G, pos, with_labels=True, node_size=3000, node_color="lightblue", font_size=10, font_weight="bold")
-    plt.title("Service Network Map")
+    # Edge widths follow call counts; the layout is seeded and cached, so runs are comparable
+    ServiceGraph.from_network_map(network_map).draw(save_path)
     if save_path is not None:
-        plt.savefig(save_path)
         print("Network map saved to ", save_path)
-    else:
-        plt.show()
 
 def query_pod_metrics(prom: PrometheusConnect, namespace="socialnetwork", msg=False):
     """
@@ -57,13 +38,15 @@ def query_pod_metrics(prom: PrometheusConnect, namespace="socialnetwork", msg=Fa
 
     return metrics
 
-def get_jaeger_network_map(jaeger_url, end_time=None, lookback="1h", msg=False):
+def get_jaeger_network_map(jaeger_url, end_time=None, lookback="1h", msg=False, start_time=None):
     """
     Fetches the network map (dependencies) from Jaeger.
 
     :param jaeger_url: The base URL of the Jaeger server (e.g., http://localhost:16686).
     :param end_time: Optional end time for the query in milliseconds since epoch.
     :param lookback: Lookback period in a human-readable format (e.g., "1h", "30m").
+    :param start_time: Optional start time in milliseconds since epoch; overrides lookback so the
+        map covers exactly [start_time, end_time].
     :return: A dictionary of dependencies between services.
     """
     # Convert `lookback` into milliseconds
@@ -81,19 +64,21 @@ def get_jaeger_network_map(jaeger_url, end_time=None, lookback="1h", msg=False):
 
     # Calculate `endTs` and `startTs`
     end_time_ms = end_time or int(datetime.utcnow().timestamp() * 1000)
-    start_time_ms = end_time_ms - lookback_ms
+    start_time_ms = int(start_time) if start_time is not None else end_time_ms - lookback_ms
 
     # Jaeger dependencies API URL
     dependencies_url = f"{jaeger_url}/api/dependencies"
 
     # Query parameters
+    # Jaeger reads the window as endTs and lookback (both ms); startTs is kept for proxies that use it
     params = {
         "endTs": end_time_ms,
-        "startTs": start_time_ms
+        "startTs": start_time_ms,
+        "lookback": end_time_ms - start_time_ms,
     }
 
     # Perform the HTTP GET request
-    response = requests.get(dependencies_url, params=params)
+    response = get_client().get(dependencies_url, params=params)
     if response.status_code == 200:
         dependencies = response.json()
         if msg:
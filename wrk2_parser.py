@@ -0,0 +1,265 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+WRK2_STORE_DIR = "data/wrk2"
+
+# Percentiles pulled out of the spectrum into the per-run summary
+SUMMARY_PERCENTILES = (50.0, 90.0, 99.0, 99.9, 99.99)
+
+TIME_UNITS_MS = {"us": 0.001, "ms": 1.0, "s": 1000.0, "m": 60000.0, "h": 3600000.0}
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+_DURATION = r"([\d.]+)(us|ms|s|m|h)"
+_THREAD_LATENCY = re.compile(rf"^\s*Latency\s+{_DURATION}\s+{_DURATION}\s+{_DURATION}\s+([\d.]+)%")
+_THREAD_REQ_SEC = re.compile(r"^\s*Req/Sec\s+([\d.]+k?)\s+([\d.]+k?)\s+([\d.]+k?)\s+([\d.]+)%")
+_PERCENTILE_LINE = re.compile(rf"^\s*([\d.]+)%\s+{_DURATION}\s*$")
+_SPECTRUM_LINE = re.compile(r"^\s*([\d.]+)\s+([\d.]+)\s+(\d+)\s+([\d.]+|inf)\s*$")
+_SPECTRUM_FOOTER = re.compile(r"#\[(\w[\w ]*?)\s*=\s*([\d.]+),\s*(\w[\w ]*?)\s*=\s*([\d.]+)\]")
+_TOTALS = re.compile(r"^\s*(\d+) requests in ([\d.]+)(us|ms|s|m|h), ([\d.]+)(B|KB|MB|GB|TB) read")
+_SOCKET_ERRORS = re.compile(r"Socket errors: connect (\d+), read (\d+), write (\d+), timeout (\d+)")
+_NON_2XX = re.compile(r"Non-2xx or 3xx responses: (\d+)")
+_REQUESTS_PER_SEC = re.compile(r"^Requests/sec:\s+([\d.]+)")
+_TRANSFER_PER_SEC = re.compile(r"^Transfer/sec:\s+([\d.]+)(B|KB|MB|GB|TB)")
+
+
+def _to_ms(value, unit):
+    return float(value) * TIME_UNITS_MS[unit]
+
+
+def _count(value):
+    # wrk prints large Req/Sec counts as e.g. "1.20k"
+    return float(value[:-1]) * 1000 if value.endswith("k") else float(value)
+
+
+def _empty_spectrum():
+    return {"value_ms": [], "percentile": [], "total_count": []}
+
+
+def parse_wrk2_output(output):
+    """
+    Parses the stdout of a wrk2 run with latency printing enabled.
+
+    Returns a dictionary of the form:
+    {
+        "thread_latency_ms": {"corrected": {"avg": ..., "stdev": ..., "max": ..., "within_stdev_pct": ...},
+                              "uncorrected": {...}},
+        "thread_requests_per_sec": {"avg": ..., "stdev": ..., "max": ..., "within_stdev_pct": ...},
+        "percentiles_ms": {"recorded": {50.0: ..., 99.0: ..., ...}, "uncorrected": {...}},
+        "spectrum": {"recorded": {"value_ms": np.ndarray, "percentile": np.ndarray, "total_count": np.ndarray},
+                     "uncorrected": {...}},
+        "spectrum_stats": {"recorded": {"mean": ..., "stddeviation": ..., "max": ..., "total count": ...}, ...},
+        "requests": ..., "duration_s": ..., "bytes_read": ..., "requests_per_sec": ..., "transfer_bytes_per_sec": ...,
+        "socket_errors": {"connect": ..., "read": ..., "write": ..., "timeout": ...},
+        "non_2xx_3xx": ...,
+    }
+    Sections that are missing from the output are left out (or zero for error counts).
+    """
+    parsed = {
+        "thread_latency_ms": {},
+        "percentiles_ms": {},
+        "spectrum": {},
+        "spectrum_stats": {},
+        "socket_errors": {"connect": 0, "read": 0, "write": 0, "timeout": 0},
+        "non_2xx_3xx": 0,
+    }
+    # Which distribution the lines being read belong to: "recorded" or "uncorrected"
+    kind = "recorded"
+    section = None
+
+    for line in output.splitlines():
+        stripped = line.strip()
+        if "Uncorrected Latency" in stripped:
+            kind = "uncorrected"
+        if stripped.startswith("Latency Distribution"):
+            kind = "uncorrected" if "Uncorrected" in stripped else "recorded"
+            section = "percentiles"
+            parsed["percentiles_ms"][kind] = {}
+            continue
+        if stripped.startswith("Detailed Percentile spectrum"):
+            section = "spectrum"
+            parsed["spectrum"][kind] = _empty_spectrum()
+            continue
+
+        match = _THREAD_LATENCY.match(line)
+        if match:
+            avg, avg_unit, stdev, stdev_unit, maximum, max_unit, within = match.groups()
+            latency_kind = "uncorrected" if kind == "uncorrected" else "corrected"
+            parsed["thread_latency_ms"][latency_kind] = {
+                "avg": _to_ms(avg, avg_unit),
+                "stdev": _to_ms(stdev, stdev_unit),
+                "max": _to_ms(maximum, max_unit),
+                "within_stdev_pct": float(within),
+            }
+            continue
+        match = _THREAD_REQ_SEC.match(line)
+        if match:
+            avg, stdev, maximum, within = match.groups()
+            parsed["thread_requests_per_sec"] = {
+                "avg": _count(avg), "stdev": _count(stdev), "max": _count(maximum), "within_stdev_pct": float(within),
+            }
+            continue
+
+        if section == "percentiles":
+            match = _PERCENTILE_LINE.match(line)
+            if match:
+                percentile, value, unit = match.groups()
+                parsed["percentiles_ms"][kind][float(percentile)] = _to_ms(value, unit)
+                continue
+        if section == "spectrum":
+            match = _SPECTRUM_LINE.match(line)
+            if match:
+                value, percentile, total_count, _ = match.groups()
+                spectrum = parsed["spectrum"][kind]
+                spectrum["value_ms"].append(float(value))
+                spectrum["percentile"].append(float(percentile))
+                spectrum["total_count"].append(int(total_count))
+                continue
+            for match in _SPECTRUM_FOOTER.finditer(line):
+                stats = parsed["spectrum_stats"].setdefault(kind, {})
+                stats[match.group(1).strip().lower()] = float(match.group(2))
+                stats[match.group(3).strip().lower()] = float(match.group(4))
+
+        match = _TOTALS.match(line)
+        if match:
+            requests, duration, duration_unit, read, read_unit = match.groups()
+            parsed["requests"] = int(requests)
+            parsed["duration_s"] = _to_ms(duration, duration_unit) / 1000
+            parsed["bytes_read"] = float(read) * SIZE_UNITS[read_unit]
+            section = None
+            continue
+        match = _SOCKET_ERRORS.search(line)
+        if match:
+            parsed["socket_errors"] = dict(zip(("connect", "read", "write", "timeout"), map(int, match.groups())))
+            continue
+        match = _NON_2XX.search(line)
+        if match:
+            parsed["non_2xx_3xx"] = int(match.group(1))
+            continue
+        match = _REQUESTS_PER_SEC.match(stripped)
+        if match:
+            parsed["requests_per_sec"] = float(match.group(1))
+            continue
+        match = _TRANSFER_PER_SEC.match(stripped)
+        if match:
+            parsed["transfer_bytes_per_sec"] = float(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+    for kind, spectrum in parsed["spectrum"].items():
+        parsed["spectrum"][kind] = {
+            "value_ms": np.array(spectrum["value_ms"], dtype=np.float64),
+            "percentile": np.array(spectrum["percentile"], dtype=np.float64),
+            "total_count": np.array(spectrum["total_count"], dtype=np.int64),
+        }
+    return parsed
+
+
+def spectrum_percentile(spectrum, percentile):
+    """
+    Looks up a latency percentile (0-100) in a parsed spectrum: the smallest recorded value
+    whose cumulative percentile reaches it.
+    """
+    if not len(spectrum["percentile"]):
+        return None
+    # Tolerance because e.g. 99.9 / 100 is slightly above the 0.999 printed by wrk2
+    index = np.searchsorted(spectrum["percentile"], percentile / 100 - 1e-9, side="left")
+    return float(spectrum["value_ms"][min(index, len(spectrum["value_ms"]) - 1)])
+
+
+def wrk2_summary(parsed, kind="recorded"):
+    """
+    Flattens the scalar results of a parsed run into one record: throughput, errors and
+    p50/p90/p99/p99.9/p99.99 latency in ms, taken from the detailed spectrum when present.
+    """
+    summary = {
+        "requests": parsed.get("requests"),
+        "duration_s": parsed.get("duration_s"),
+        "requests_per_sec": parsed.get("requests_per_sec"),
+        "transfer_bytes_per_sec": parsed.get("transfer_bytes_per_sec"),
+        "non_2xx_3xx": parsed.get("non_2xx_3xx", 0),
+        "socket_errors": sum(parsed.get("socket_errors", {}).values()),
+    }
+    spectrum = parsed["spectrum"].get(kind)
+    percentiles = parsed["percentiles_ms"].get(kind, {})
+    for percentile in SUMMARY_PERCENTILES:
+        value = spectrum_percentile(spectrum, percentile) if spectrum is not None else None
+        summary[f"p{percentile:g}_ms"] = value if value is not None else percentiles.get(percentile)
+    stats = parsed["spectrum_stats"].get(kind, {})
+    summary["mean_ms"] = stats.get("mean")
+    summary["max_ms"] = stats.get("max")
+    return summary
+
+
+def save_wrk2_results(parsed, run_id, test_params=None, output_dir=WRK2_STORE_DIR, load_start=None):
+    """
+    Stores a parsed run next to the Prometheus data:
+    <output_dir>/<run_id>.json with the scalar results, percentiles, test parameters and the
+    time the load started, and <output_dir>/<run_id>_spectrum.parquet with the full latency spectra.
+
+    :param load_start: When wrk2 was started (naive local time, like the stored samples);
+        estimated as now minus the run duration if None.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    record = {key: value for key, value in parsed.items() if key != "spectrum"}
+    record["percentiles_ms"] = {
+        kind: {f"{percentile:g}": value for percentile, value in values.items()}
+        for kind, values in parsed["percentiles_ms"].items()
+    }
+    record["summary"] = wrk2_summary(parsed)
+    record["run_id"] = run_id
+    record["test_params"] = test_params or {}
+    if load_start is None:
+        load_start = datetime.now() - timedelta(seconds=parsed.get("duration_s") or 0)
+    record["load_start"] = load_start.isoformat()
+    with open(os.path.join(output_dir, f"{run_id}.json"), "w") as f:
+        json.dump(record, f, indent=2)
+
+    frames = [
+        pd.DataFrame({"kind": kind, **spectrum}) for kind, spectrum in parsed["spectrum"].items()
+    ]
+    if frames:
+        spectrum_df = pd.concat(frames, ignore_index=True)
+        spectrum_df["run_id"] = run_id
+        spectrum_df.to_parquet(os.path.join(output_dir, f"{run_id}_spectrum.parquet"), index=False)
+
+
+def load_wrk2_summaries(output_dir=WRK2_STORE_DIR, run_ids=None):
+    """
+    Returns one row per stored run (index run_id) with its wrk2 summary, for comparing
+    client-side latency and throughput across runs.
+    """
+    rows = []
+    if not os.path.isdir(output_dir):
+        return pd.DataFrame(rows)
+    for file_name in sorted(os.listdir(output_dir)):
+        if not file_name.endswith(".json"):
+            continue
+        run_id = file_name[:-len(".json")]
+        if run_ids is not None and run_id not in run_ids:
+            continue
+        with open(os.path.join(output_dir, file_name), "r") as f:
+            record = json.load(f)
+        rows.append({"run_id": run_id, **record["summary"]})
+    return pd.DataFrame(rows).set_index("run_id") if rows else pd.DataFrame(rows)
+
+
+def load_wrk2_spectra(output_dir=WRK2_STORE_DIR, run_ids=None, kind="recorded"):
+    """
+    Returns the stored latency spectra of all (or the given) runs as one long DataFrame
+    with columns run_id, kind, value_ms, percentile, total_count.
+    """
+    frames = []
+    if not os.path.isdir(output_dir):
+        return pd.DataFrame()
+    for file_name in sorted(os.listdir(output_dir)):
+        if not file_name.endswith("_spectrum.parquet"):
+            continue
+        run_id = file_name[:-len("_spectrum.parquet")]
+        if run_ids is not None and run_id not in run_ids:
+            continue
+        spectrum_df = pd.read_parquet(os.path.join(output_dir, file_name))
+        frames.append(spectrum_df[spectrum_df["kind"] == kind] if kind else spectrum_df)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()